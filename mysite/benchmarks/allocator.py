@@ -0,0 +1,50 @@
+"""
+Compares URLRedirect create latency as the table grows for the legacy random id picker
+and the Feistel allocator.
+
+    python -m benchmarks.allocator --rows 50000 --window 5000
+"""
+from .utils import setup, percentile
+
+import argparse
+import json
+import time
+
+def run(allocator, rows, window, prefix):
+    from urls import models
+
+    models.allocator = allocator
+    results = []
+    latencies = []
+    for idx in range(rows):
+        start = time.perf_counter()
+        models.URLRedirect.get_or_create('https://www.example.com/{}/{}'.format(prefix, idx))
+        latencies.append(time.perf_counter() - start)
+        if len(latencies) == window:
+            latencies.sort()
+            results.append({
+                'rows': idx + 1,
+                'mean_ms': 1000 * sum(latencies) / window,
+                'p99_ms': 1000 * percentile(latencies, 99),
+            })
+            latencies = []
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument('--rows', type = int, default = 20000)
+    parser.add_argument('--window', type = int, default = 2000)
+    args = parser.parse_args()
+
+    teardown = setup()
+    try:
+        from urls.contrib.allocators import RandomAllocator, FeistelAllocator
+        print(json.dumps({
+            'random': run(RandomAllocator(), args.rows, args.window, 'random'),
+            'feistel': run(FeistelAllocator(), args.rows, args.window, 'feistel'),
+        }, indent = 2))
+    finally:
+        teardown()
+
+if __name__ == '__main__':
+    main()
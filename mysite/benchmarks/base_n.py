@@ -0,0 +1,62 @@
+"""
+Microbenchmarks of the base_n codec against the original implementation, which prepended to 
+a string and recomputed base ** idx for every character.
+
+    python -m benchmarks.base_n --number 100000
+"""
+from urls.contrib import base_n
+
+from itertools import cycle
+
+import argparse
+import json
+import random
+import timeit
+
+def legacy_encode(n, alphabet = base_n.ALPHABET):
+    base = len(alphabet)
+    if n == 0:
+        return alphabet[0]
+    encoded_str = ''
+    while n != 0:
+        encoded_str = alphabet[n % base] + encoded_str
+        n //= base
+    return encoded_str
+
+def legacy_decode(encoded_str, char_map = base_n.CHAR_MAP):
+    base = len(char_map)
+    n = 0
+    for idx, ch in enumerate(reversed(encoded_str)):
+        n += (base ** idx) * char_map[ch]
+    return n
+
+def bench(name, func, number):
+    seconds = min(timeit.repeat(func, number = number, repeat = 3))
+    return { 'name': name, 'ns_per_call': 1e9 * seconds / number }
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument('--number', type = int, default = 100000)
+    args = parser.parse_args()
+
+    ids = [ random.randrange(2147483647) for idx in range(1000) ]
+    codes = [ base_n.encode(id) for id in ids ]
+    large = 2 ** 256
+
+    results = []
+    for label, n in ( ( 'id', cycle(ids).__next__ ), ( '2**256', lambda: large ) ):
+        results.append(bench('legacy_encode ' + label, lambda: legacy_encode(n()), args.number))
+        results.append(bench('encode ' + label, lambda: base_n.encode(n()), args.number))
+    code = cycle(codes).__next__
+    results.append(bench('legacy_decode id', lambda: legacy_decode(code()), args.number))
+    results.append(bench('decode id', lambda: base_n.decode(code()), args.number))
+    results.append(bench('is_valid id', lambda: base_n.is_valid(code(), 6), args.number))
+    long_code = base_n.encode(large)
+    results.append(bench('legacy_decode 2**256', lambda: legacy_decode(long_code), args.number // 10))
+    results.append(bench('decode 2**256', lambda: base_n.decode(long_code), args.number // 10))
+    results.append(bench('encode_many 1000 ids', lambda: base_n.encode_many(ids), args.number // 1000))
+    results.append(bench('decode_many 1000 ids', lambda: base_n.decode_many(codes), args.number // 1000))
+    print(json.dumps(results, indent = 2))
+
+if __name__ == '__main__':
+    main()
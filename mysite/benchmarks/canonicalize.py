@@ -0,0 +1,77 @@
+"""
+Measures the CPU saved by memoizing canonicalize and hostname, on a corpus of messy urls
+where popular urls are submitted repeatedly (a zipf-like distribution), as by the create
+view, and on chunks as by the bulk shortener.
+
+    python -m benchmarks.canonicalize --urls 50000 --distinct 5000
+"""
+from random import Random
+
+import argparse
+import json
+import time
+
+HOSTS = [ 'www.example.com', 'EXAMPLE.org', 'maps.example.co.nz', 'news.example.net:8080', 'bücher.example.de' ]
+PATHS = [ '', '/', '/a b/c', '/path/to/%7euser/', '/Caf%c3%a9', '/über/straße', '/search', '/1.2/index.html' ]
+PARAMS = [ 'q=hello world', 'utm_source=news', 'b=2', 'a=1', 'empty=', 'page=%2f', 'lang=fr', 'id=42' ]
+
+def corpus(urls, distinct, seed = 0):
+    """
+    Returns:
+        a list of urls drawn from distinct messy urls, popular ones repeated most
+    """
+    random = Random(seed)
+    pool = []
+    for idx in range(distinct):
+        url = random.choice([ '', 'http://', 'https://', 'HTTPS://' ]) + random.choice(HOSTS)
+        url += random.choice(PATHS) + '/' + str(idx)
+        query = random.sample(PARAMS, random.randrange(len(PARAMS)))
+        if query:
+            url += '?' + '&'.join(query)
+        if random.random() < 0.2:
+            url += '#section-' + str(idx % 7)
+        pool.append(url)
+    weights = [ 1.0 / (rank + 1) for rank in range(distinct) ]
+    return random.choices(pool, weights, k = urls)
+
+def cpu(func, *args):
+    start = time.process_time()
+    func(*args)
+    return time.process_time() - start
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--urls', type = int, default = 50000)
+    parser.add_argument('--distinct', type = int, default = 5000)
+    parser.add_argument('--chunk-size', type = int, default = 500)
+    args = parser.parse_args()
+
+    from urls.contrib import urls
+
+    data = corpus(args.urls, args.distinct)
+    chunks = [ data[idx:idx + args.chunk_size] for idx in range(0, len(data), args.chunk_size) ]
+
+    def uncached():
+        for url in data:
+            urls._hostname(urls._canonicalize(url))
+
+    def memoized():
+        for url in data:
+            urls.hostname(urls.canonicalize(url))
+
+    def bulk():
+        for chunk in chunks:
+            urls.canonicalize_many(chunk)
+
+    results = { 'urls': args.urls, 'distinct': args.distinct }
+    results['uncached_cpu_s'] = cpu(uncached)
+    urls.clear_memos()
+    results['memoized_cpu_s'] = cpu(memoized)
+    results['memo'] = urls.memo_stats()
+    urls.clear_memos()
+    results['canonicalize_many_cpu_s'] = cpu(bulk)
+    results['saved'] = 1 - results['memoized_cpu_s'] / results['uncached_cpu_s']
+    print(json.dumps(results, indent = 2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+"""
+Load tests the redirect and create endpoints. Seeds a throwaway database with --rows links,
+then drives RedirectURLView and CreateURLView from --concurrency threads through the django
+test client. Created urls point at a local stub server, so validation makes real HTTP
+requests without leaving the machine.
+
+Prints a JSON report with the throughput, p50/p95/p99 latency and queries per request of
+each scenario, so runs before and after a change can be compared:
+
+    python -m benchmarks.load --rows 100000 --requests 20000 --concurrency 8 > before.json
+"""
+from .utils import setup, percentile, stub_server
+
+from concurrent.futures import ThreadPoolExecutor
+from random import Random
+
+import argparse
+import json
+import platform
+import sys
+import time
+
+SEED_CHUNK_SIZE = 5000
+
+def seed(rows, base_url):
+    """
+    Inserts rows URLRedirects to the stub server, with ids from the configured allocator.
+
+    Returns:
+        the short codes of the seeded links
+    """
+    from django.db import transaction
+    from urls.contrib.base_n import encode
+    from urls.contrib.urls import digest
+    from urls.models import URLRedirect, allocator
+
+    codes = []
+    for start in range(0, rows, SEED_CHUNK_SIZE):
+        redirects = []
+        for idx in range(start, min(rows, start + SEED_CHUNK_SIZE)):
+            url = '{}/seed/{}'.format(base_url, idx)
+            redirects.append(URLRedirect(id = allocator.allocate(), original_url = url, url_hash = digest(url)))
+        with transaction.atomic():
+            URLRedirect.objects.bulk_create(redirects)
+        codes.extend(encode(redirect.id) for redirect in redirects)
+    return codes
+
+def request(method, path, data = None, status = 200, success = None):
+    """
+    Sends a request from a per thread test client.
+
+    Args:
+        status:  the expected status code
+        success: the expected "success" of a JSON response, or None to skip the check
+
+    Returns:
+        a tuple of the latency in seconds, the number of queries, and whether the response
+        was as expected
+    """
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    client = _clients.get()
+    with CaptureQueriesContext(connection) as queries:
+        start = time.perf_counter()
+        response = getattr(client, method)(path, data)
+        latency = time.perf_counter() - start
+    ok = response.status_code == status
+    if ok and success is not None:
+        ok = response.json()['success'] == success
+    return latency, len(queries), ok
+
+class _Clients():
+    """
+    A django test Client per thread, the client is not thread safe.
+    """
+
+    def __init__(self):
+        from threading import local
+
+        self.local = local()
+
+    def get(self):
+        from django.test import Client
+
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = Client()
+        return client
+
+_clients = _Clients()
+
+def run(name, calls, concurrency):
+    """
+    Runs the calls from a thread pool.
+
+    Args:
+        name:        the scenario name
+        calls:       a list of argument tuples for request
+        concurrency: the number of threads
+
+    Returns:
+        a dict of the scenario's results
+    """
+    from django.db import connection
+
+    def call(args):
+        try:
+            return request(*args)
+        finally:
+            connection.close()
+
+    # the connection is closed after every call so each worker thread cleans up after itself
+    # instead of leaking sqlite handles, the reconnect is counted in the latency
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers = concurrency) as executor:
+        results = list(executor.map(call, calls))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for latency, queries, ok in results)
+    return {
+        'name': name,
+        'requests': len(results),
+        'errors': sum(1 for latency, queries, ok in results if not ok),
+        'seconds': elapsed,
+        'throughput_rps': len(results) / elapsed if elapsed else None,
+        'p50_ms': 1000 * percentile(latencies, 50),
+        'p95_ms': 1000 * percentile(latencies, 95),
+        'p99_ms': 1000 * percentile(latencies, 99),
+        'queries_per_request': sum(queries for latency, queries, ok in results) / len(results),
+    }
+
+def scenarios(codes, base_url, args):
+    """
+    Returns:
+        a list of (name, calls) tuples
+    """
+    from django.urls import reverse
+
+    random = Random(args.seed)
+    create = reverse('urls:create')
+    # a zipf-like mix where a small share of links gets most of the clicks
+    hot = codes[:max(1, len(codes) // 100)]
+    mixed = [ random.choice(hot) if random.random() < 0.8 else random.choice(codes) for idx in range(args.requests) ]
+    return [
+        ( 'redirect_uniform', [ ( 'get', reverse('urls:redirect', args = ( random.choice(codes), )), None, 301 )
+                for idx in range(args.requests) ] ),
+        ( 'redirect_hot', [ ( 'get', reverse('urls:redirect', args = ( code, )), None, 301 )
+                for code in mixed ] ),
+        ( 'create_new', [ ( 'post', create, { 'url': '{}/new/{}'.format(base_url, idx) }, 200, True )
+                for idx in range(args.creates) ] ),
+        ( 'create_existing', [ ( 'post', create, { 'url': '{}/seed/{}'.format(base_url, random.randrange(args.rows)) }, 200, True )
+                for idx in range(args.creates) ] ),
+        ( 'create_invalid', [ ( 'post', create, { 'url': '{}/status/404/{}'.format(base_url, idx) }, 200, False )
+                for idx in range(args.creates) ] ),
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type = int, default = 10000, help = 'links seeded before the run')
+    parser.add_argument('--requests', type = int, default = 5000, help = 'requests per redirect scenario')
+    parser.add_argument('--creates', type = int, default = 1000, help = 'requests per create scenario')
+    parser.add_argument('--concurrency', type = int, default = 4)
+    parser.add_argument('--only', nargs = '*', help = 'scenario names to run')
+    parser.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args()
+
+    teardown = setup()
+    server, base_url = stub_server()
+    try:
+        import django
+        from django.conf import settings
+        from urls.contrib.clicks import click_log
+        from urls.contrib.counters import click_counter
+
+        start = time.perf_counter()
+        codes = seed(args.rows, base_url)
+        report = {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': settings.DATABASES['default']['ENGINE'],
+            'options': vars(args),
+            'seed_seconds': time.perf_counter() - start,
+            'scenarios': [],
+        }
+        for name, calls in scenarios(codes, base_url, args):
+            if not args.only or name in args.only:
+                report['scenarios'].append(run(name, calls, args.concurrency))
+        click_counter.flush()
+        click_log.flush()
+        json.dump(report, sys.stdout, indent = 2)
+        print()
+    finally:
+        server.shutdown()
+        teardown()
+
+if __name__ == '__main__':
+    main()
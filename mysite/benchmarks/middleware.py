@@ -0,0 +1,122 @@
+"""
+Measures the per request overhead of the middleware stack on redirects. Calls django's WSGI
+handler directly, without a server or the test client, for the same cached link with the
+configured MIDDLEWARE (where urls.middleware.RedirectMiddleware answers redirects) and with
+RedirectMiddleware removed so redirects go through the whole stack. Other paths are timed
+too, they pay for one more url resolution with RedirectMiddleware.
+
+Requests carry the session and CSRF cookies a returning visitor would send.
+
+    python -m benchmarks.middleware --number 20000
+"""
+from .utils import setup, percentile
+
+from io import BytesIO
+
+import argparse
+import json
+import platform
+import time
+
+LEAN = 'urls.middleware.RedirectMiddleware'
+
+def environ(path, cookies):
+    """
+    Returns:
+        a minimal WSGI environ for a GET of path
+    """
+    return {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': path,
+        'QUERY_STRING': '',
+        'SERVER_NAME': 'testserver',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'REMOTE_ADDR': '127.0.0.1',
+        'HTTP_HOST': 'testserver',
+        'HTTP_COOKIE': cookies,
+        'wsgi.version': ( 1, 0 ),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': BytesIO(),
+        'wsgi.errors': BytesIO(),
+        'wsgi.multithread': False,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+
+def bench(name, handler, path, status, number, cookies):
+    """
+    Returns:
+        a dict of the latency percentiles and queries per request of number requests
+    """
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    def start_response(status_line, headers):
+        if not status_line.startswith(str(status)):
+            raise AssertionError('{} returned {}'.format(path, status_line))
+
+    latencies = []
+    with CaptureQueriesContext(connection) as queries:
+        for idx in range(number):
+            start = time.perf_counter()
+            response = handler(environ(path, cookies), start_response)
+            response.close()
+            latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return {
+        'name': name,
+        'requests': number,
+        'mean_us': 1e6 * sum(latencies) / number,
+        'p50_us': 1e6 * percentile(latencies, 50),
+        'p99_us': 1e6 * percentile(latencies, 99),
+        'queries_per_request': len(queries) / number,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type = int, default = 20000, help = 'requests per scenario')
+    parser.add_argument('--warmup', type = int, default = 1000, help = 'untimed requests before each scenario')
+    args = parser.parse_args()
+
+    teardown = setup()
+    try:
+        import django
+        from django.conf import settings
+        from django.core.handlers.wsgi import WSGIHandler
+        from django.test.utils import override_settings
+        from django.urls import reverse
+        from urls.contrib.base_n import encode
+        from urls.contrib.clicks import click_log
+        from urls.contrib.counters import click_counter
+        from urls.models import URLRedirect
+
+        redirect = URLRedirect.get_or_create('https://www.example.com/')
+        redirect_path = reverse('urls:redirect', args = ( encode(redirect.id), ))
+        index_path = reverse('urls:index')
+        cookies = '{}=x{}; {}={}'.format(
+                settings.SESSION_COOKIE_NAME, 'a' * 31, settings.CSRF_COOKIE_NAME, 'b' * 64)
+
+        handlers = {}
+        handlers['lean'] = WSGIHandler()
+        with override_settings(MIDDLEWARE = [ name for name in settings.MIDDLEWARE if name != LEAN ]):
+            handlers['full'] = WSGIHandler()
+
+        results = []
+        for label, path, status in ( ( 'redirect', redirect_path, 301 ), ( 'index', index_path, 200 ) ):
+            for stack, handler in handlers.items():
+                bench(None, handler, path, status, args.warmup, cookies)
+                results.append(bench('{} {}'.format(label, stack), handler, path, status, args.number, cookies))
+        click_counter.flush()
+        click_log.flush()
+        print(json.dumps({
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'middleware': settings.MIDDLEWARE,
+            'scenarios': results,
+        }, indent = 2))
+    finally:
+        teardown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Helpers shared by the benchmark scripts. Run the scripts from the project directory:
+
+    python -m benchmarks.<name> --help
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+import os
+import tempfile
+
+def setup(settings = 'mysite.settings'):
+    """
+    Configures django and creates a throwaway sqlite database so benchmarks never touch the 
+    real one.
+
+    Returns:
+        a function which destroys the database
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings)
+
+    import django
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    fd, name = tempfile.mkstemp(suffix = '.sqlite3')
+    os.close(fd)
+    connection.settings_dict['TEST']['NAME'] = name
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity = 0, autoclobber = True)
+
+    def teardown():
+        connection.creation.destroy_test_db(old_name, verbosity = 0)
+    return teardown
+
+def percentile(values, p):
+    """
+    Args:
+        values: a sorted list of numbers
+        p:      the percentile, from 0 to 100
+
+    Returns:
+        the nearest-rank percentile of values
+    """
+    if not values:
+        return None
+    idx = max(0, min(len(values) - 1, int(round(p / 100.0 * len(values))) - 1))
+    return values[idx]
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Answers every request with a 200, or the status in a /status/<code> path, standing in for 
+    the sites validate_url requests.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_HEAD(self):
+        parts = self.path.split('/')
+        status = int(parts[2]) if len(parts) > 2 and parts[1] == 'status' else 200
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    do_GET = do_HEAD
+
+    def log_message(self, *args):
+        pass
+
+def stub_server():
+    """
+    Starts a StubHandler server on a free local port in a daemon thread.
+
+    Returns:
+        the server, call shutdown() when done, and its base url
+    """
+    server = ThreadingHTTPServer(( '127.0.0.1', 0 ), StubHandler)
+    server.daemon_threads = True
+    Thread(target = server.serve_forever, daemon = True).start()
+    return server, 'http://127.0.0.1:{}'.format(server.server_port)
@@ -0,0 +1,20 @@
+"""
+ASGI config for mysite project.
+
+It exposes the ASGI callable as a module-level variable named ``application``, serving the 
+async create and redirect views (mysite.urls_async). Run it with any ASGI server, ex:
+
+    uvicorn mysite.asgi:application
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysite.settings")
+os.environ.setdefault("URLS_ASYNC", "1")
+
+application = get_asgi_application()
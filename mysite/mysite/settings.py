@@ -41,6 +41,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'urls.middleware.MetricsMiddleware',
+    'urls.middleware.ReplicaPinMiddleware',
+    # answers redirects without the middleware below
+    'urls.middleware.RedirectMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -50,7 +54,8 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'mysite.urls'
+# the async views are routed when serving ASGI, see mysite/asgi.py
+ROOT_URLCONF = 'mysite.urls_async' if os.environ.get('URLS_ASYNC') == '1' else 'mysite.urls'
 
 TEMPLATES = [
     {
@@ -71,6 +76,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'mysite.wsgi.application'
+ASGI_APPLICATION = 'mysite.asgi.application'
 
 
 # Database
@@ -80,9 +86,161 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+    }, 
+    # a read replica of default, only read from once it is listed in URLS_DATABASE_ROUTER
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'replica.sqlite3'),
+    }, 
+}
+
+# Sends the reads of the urls app to the REPLICAS (alias: weight) and writes to the PRIMARY, 
+# see urls.routers. Clients read from the primary for PIN_SECONDS after writing.
+DATABASE_ROUTERS = [ 'urls.routers.ReplicaRouter' ]
+URLS_DATABASE_ROUTER = {
+    'PRIMARY': 'default',
+    'REPLICAS': {},
+    'PIN_SECONDS': 5,
+    'RETRY_AFTER': 30,
+}
+
+# The databases holding the links, each owning an equal range of ids, see 
+# urls.contrib.sharding. Must not change once links have been created. With several shards 
+# the replicas above are not used.
+URLS_SHARDING = {
+    'SHARDS': [ 'default' ],
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/1.11/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
+# Read-through cache of short code -> url used by urls.views.RedirectURLView
+URLS_REDIRECT_CACHE = {
+    'ALIAS': 'default',
+    'TIMEOUT': 60 * 60 * 24,
+    'LOCAL_SIZE': 10000,
+    'LOCAL_TIMEOUT': 60 * 5,
+}
+
+# Preloading of the redirect cache and pinning of the links clicked most, see 
+# urls.contrib.hot. With WARM_UP each worker loads the most used and newest links on its first 
+# request, manage.py warm_redirect_cache does the same for the shared tier after a deploy.
+URLS_HOT_LINKS = {
+    'WARM_UP': False,
+    'WARM_UP_USED': 1000,
+    'WARM_UP_RECENT': 1000,
+    'CAPACITY': 200,
+    'PINNED': 50,
+    'INTERVAL': 60,
+}
+
+# The status and caching headers of redirects and the index page, see urls.contrib.headers. 
+# Redirects cached by browsers or a CDN (MAX_AGE, SHARED_MAX_AGE) are not counted as clicks.
+URLS_HTTP_CACHE = {
+    'PERMANENT': True,
+    'MAX_AGE': 0,
+    'SHARED_MAX_AGE': None,
+    'INDEX_MAX_AGE': 60 * 5,
+}
+
+# A Bloom filter of the link ids, so RedirectURLView answers unknown short codes without a 
+# query, see urls.contrib.bloom. New links are marked in the ALIAS cache until every worker has 
+# rebuilt its filter. Unknown codes are only answered without a query when that cache is shared 
+# by the workers (e.g. memcached or redis), with the default LocMemCache they are checked 
+# against the database unless TRUST_MISSES is set for a single process.
+URLS_ID_FILTER = {
+    'ENABLED': False,
+    'CAPACITY': 1000000,
+    'ERROR_RATE': 0.001,
+    'REBUILD_INTERVAL': 3600,
+}
+
+# Buffered URLRedirect.times_used increments, see urls.contrib.counters
+URLS_CLICK_COUNTER = {
+    'FLUSH_INTERVAL': 5.0,
+    'FLUSH_THRESHOLD': 1000,
+}
+
+# A memory mapped snapshot of the redirects, written by manage.py snapshot_redirects, which 
+# RedirectURLView reads before the cache and database when ENABLED. Workers which edit or 
+# delete links write the revocations of their entries to PATH, so it must be writable by them.
+URLS_SNAPSHOT = {
+    'ENABLED': False,
+    'PATH': os.path.join(BASE_DIR, 'snapshot'),
+    'RELOAD_INTERVAL': 5.0,
+    'MAX_DELTAS': 16,
+}
+
+# Buffered click events, rolled up into hourly and daily counts by manage.py rollup_clicks, 
+# see urls.contrib.clicks. Events newer than SETTLE seconds are left for the next rollup.
+URLS_CLICK_LOG = {
+    'FLUSH_INTERVAL': 5.0,
+    'FLUSH_THRESHOLD': 1000,
+    'SETTLE': 60,
+}
+
+# The rankings of the admin top links dashboard, recomputed by manage.py refresh_top_links, 
+# see urls.contrib.top. DAYS of daily click rollups are summed for the most clicked links.
+URLS_TOP_LINKS = {
+    'SIZE': 100,
+    'DAYS': 7,
+}
+
+# Optional expiry of new links, after LIFETIME seconds or MAX_IDLE seconds without a click. 
+# manage.py purge_expired deletes links expired for GRACE seconds, and with REUSE_IDS their 
+# ids are handed out again after REUSE_AFTER seconds, see urls.contrib.expiry.
+URLS_EXPIRY = {
+    'LIFETIME': None,
+    'MAX_IDLE': None,
+    'GRACE': 3600,
+    'BATCH_SIZE': 500,
+    'SLEEP': 0.1,
+    'REUSE_IDS': False,
+}
+
+# Allocates the non-sequential URLRedirect ids, see urls.contrib.allocators. The key 
+# defaults to SECRET_KEY and must not change once ids have been handed out.
+URLS_ID_ALLOCATOR = {
+    'BACKEND': 'urls.contrib.allocators.FeistelAllocator',
+    'OPTIONS': {
+        'block_size': 100,
+    },
+}
+
+# How CreateURLView checks that a url can be reached, see urls.contrib.validation. MODE is 
+# 'sync' (before creating the link), 'thread' (in a background thread pool) or 'queue' 
+# (drained by manage.py validate_pending).
+URLS_VALIDATION = {
+    'MODE': 'sync',
+    'WORKERS': 8,
+    'TIMEOUT': 2.0,
+    'CACHE': {
+        'POSITIVE_TIMEOUT': 60 * 60,
+        'NEGATIVE_TIMEOUT': 60,
+        'HOST_TIMEOUT': 60 * 5,
+    },
+    'CLIENT': {
+        'MAX_CONNECTIONS': 64,
+        'HOST_CONNECTIONS': 4,
+        'FAILURE_THRESHOLD': 5,
+        'RESET_TIMEOUT': 30,
+    },
+}
+
+# Server-Timing headers and the /metrics/ endpoint, see urls.contrib.metrics. ALLOWED_IPS 
+# are the REMOTE_ADDRs allowed to scrape /metrics/, None for any.
+URLS_METRICS = {
+    'SERVER_TIMING': True,
+    'ALLOWED_IPS': [ '127.0.0.1', '::1' ],
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.11/ref/settings/#auth-password-validators
@@ -0,0 +1,12 @@
+"""mysite URL Configuration for ASGI
+
+The same as mysite.urls, with the async views of the urls app. Selected by the URLS_ASYNC 
+environment variable, which mysite/asgi.py sets.
+"""
+from django.conf.urls import include, url
+from django.contrib import admin
+
+urlpatterns = [
+    url(r'^urls/', include('urls.async_urls')), 
+    url(r'^admin/', admin.site.urls),
+]
@@ -1,21 +1,169 @@
 from django import forms
 from django.contrib import admin
+from django.db.models import Q
+from django.template.response import TemplateResponse
+from django.urls import path, resolve, Resolver404
+from django.utils.html import format_html_join
 
-from .models import URLRedirect
-from .contrib.base_n import encode
+from .models import URLRedirect, TopLink, MAX_INT
+from .contrib.base_n import encode, decode, is_valid
+from .contrib.clicks import clicks_per
+from .contrib.pagination import EstimatedCountPaginator, KeysetChangeList
+from .contrib.sharding import shard_map
+from .contrib.urls import canonicalize, digest
+from .contrib import top
+
+from urllib.parse import urlsplit
+
+MAX_CODE_LENGTH = len(encode(MAX_INT))
+
+class ShardFilter(admin.SimpleListFilter):
+    """
+    Lists the links of one shard at a time, the first by default, as the changelist cannot
+    page through a query spanning several databases.
+    """
+    title = 'shard'
+    parameter_name = 'shard'
+
+    def lookups(self, request, model_admin):
+        return [ ( shard.alias, '{} ({} - {})'.format(shard.alias, encode(shard.start), encode(shard.end - 1)) )
+                for shard in shard_map ]
+
+    def choices(self, changelist):
+        for lookup, title in self.lookup_choices:
+            yield {
+                'selected': (self.value() or shard_map.aliases[0]) == lookup,
+                'query_string': changelist.get_query_string({ self.parameter_name: lookup }),
+                'display': title,
+            }
+
+    def queryset(self, request, queryset):
+        alias = self.value() if self.value() in shard_map.aliases else shard_map.aliases[0]
+        return queryset.using(alias)
+
+class TimesUsedFilter(admin.SimpleListFilter):
+    """
+    Filters by ranges of times used, each a range scan of the (times_used, id) index.
+    """
+    title = 'times used'
+    parameter_name = 'used'
+
+    RANGES = {
+        '0': ( 0, 0 ), 
+        '1-9': ( 1, 9 ), 
+        '10-99': ( 10, 99 ), 
+        '100-999': ( 100, 999 ), 
+        '1000+': ( 1000, None ), 
+    }
+
+    def lookups(self, request, model_admin):
+        return [ ( key, 'Never' if key == '0' else key ) for key in self.RANGES ]
+
+    def queryset(self, request, queryset):
+        if self.value() not in self.RANGES:
+            return queryset
+        low, high = self.RANGES[self.value()]
+        queryset = queryset.filter(times_used__gte = low)
+        return queryset if high is None else queryset.filter(times_used__lte = high)
 
 # Register your models here.
 class URLRedirectAdmin(admin.ModelAdmin):
-    readonly_fields = [ 'id', 'created', 'encoded' ]
+    """
+    Built for large tables: the changelist pages by key rather than OFFSET and estimates its
+    count (urls.contrib.pagination), only sorts and filters on indexed columns, and searches
+    by short code or exact url rather than with LIKE. The top links are precomputed by
+    manage.py refresh_top_links.
+    """
+    list_display    = [ 'encoded', 'original_url', 'times_used', 'created', 'status' ]
+    list_filter     = [ ( 'created', admin.DateFieldListFilter ), TimesUsedFilter, 'status' ]
+    sortable_by     = [ 'encoded', 'times_used', 'created' ]
+    ordering        = [ '-created' ]
+    search_fields   = [ 'original_url' ]
+    paginator       = EstimatedCountPaginator
+    show_full_result_count = False
+    readonly_fields = [ 'id', 'created', 'encoded', 'status', 'status_code', 'status_message', 'daily_clicks' ]
     fields          = [
             'id', 
             'encoded', 
             'created', 
             'times_used', 
             'original_url', 
+            'status', 
+            'status_code', 
+            'status_message', 
+            'expires', 
+            'max_idle', 
+            'permanent', 
+            'daily_clicks', 
     ]
 
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def get_urls(self):
+        return [
+            path('top/', self.admin_site.admin_view(self.top_links_view), name = 'urls_urlredirect_top'), 
+        ] + super().get_urls()
+
+    def top_links_view(self, request):
+        columns = {
+            top.TIMES_USED: 'Times used', 
+            top.RECENT_CLICKS: 'Clicks in the last {} days'.format(top.option('DAYS')), 
+        }
+        rankings = [ ( title, columns[kind], TopLink.objects.filter(kind = kind).order_by('rank') ) 
+                for kind, title in TopLink._meta.get_field('kind').choices ]
+        return TemplateResponse(request, 'admin/urls/urlredirect/top_links.html', dict(
+                self.admin_site.each_context(request), 
+                opts = self.model._meta, 
+                title = 'Top links', 
+                rankings = rankings, 
+                refreshed = TopLink.objects.values_list('refreshed', flat = True).first()))
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Searches by short code, short url or original url, each an indexed lookup.
+        """
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        lookups = Q(pk__in = [])
+        short = term
+        if '/' in term:
+            try:
+                url = canonicalize(term)
+                lookups |= Q(url_hash = digest(url), original_url = url)
+                # a short url
+                match = resolve(urlsplit(url).path)
+                short = match.kwargs.get('short', '') if match.url_name == 'redirect' else ''
+            except (Resolver404, ValueError):
+                short = ''
+        if is_valid(short, MAX_CODE_LENGTH) and decode(short) <= MAX_INT:
+            lookups |= Q(pk = decode(short))
+        return queryset.filter(lookups), False
+
+    def get_list_filter(self, request):
+        if shard_map.sharded:
+            return [ ShardFilter ] + list(super().get_list_filter(request))
+        return super().get_list_filter(request)
+
+    def get_object(self, request, object_id, from_field = None):
+        if not shard_map.sharded or from_field is not None:
+            return super().get_object(request, object_id, from_field)
+        try:
+            pk = int(object_id)
+            return self.get_queryset(request).using(shard_map.using_id(pk)).get(pk = pk)
+        except (ValueError, URLRedirect.DoesNotExist):
+            return None
+
     def encoded(self, instance):
         return encode(instance.id)
+    encoded.admin_order_field = 'id'
+
+    def daily_clicks(self, instance):
+        if instance.id is None:
+            return '-'
+        clicks = [ ( start.date().isoformat(), n ) for start, n in clicks_per(instance.id) if n ]
+        return format_html_join('\n', '<div>{}: {}</div>', reversed(clicks)) or 'None'
+    daily_clicks.short_description = 'Clicks in the last 90 days'
 
 admin.site.register(URLRedirect, URLRedirectAdmin)
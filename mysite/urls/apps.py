@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class UrlsConfig(AppConfig):
     name = 'urls'
+
+    def ready(self):
+        from . import signals
+        from .contrib import hot
+
+        hot.connect()
@@ -0,0 +1,5 @@
+from . import async_views
+from .urls import patterns
+
+app_name = 'urls'
+urlpatterns = patterns(async_views)
@@ -0,0 +1,97 @@
+"""
+Async versions of the create and redirect views, served by urls.async_urls under ASGI (see 
+mysite/asgi.py). Validation uses the non-blocking client in urls.contrib.aio, so a slow site 
+only costs a suspended coroutine rather than a thread. The ORM and django cache are only 
+accessed through sync_to_async, and redirects served from the in-process LRU do not leave 
+the event loop at all.
+"""
+from django.http import JsonResponse, HttpResponseRedirect
+from django.urls import reverse
+
+from asgiref.sync import sync_to_async
+
+import asyncio
+
+from . import views
+from .views import IndexView, BulkCreateURLView, StatusView, ClickStatsView, TrendingView, MetricsView
+from .contrib import validation, expiry, snapshot as snapshots
+from .contrib.urls import ValidationError
+from .contrib.cache import redirect_cache
+from .contrib.counters import click_counter
+from .contrib.hot import hot_links
+from .contrib.clicks import click_log
+from .contrib.metrics import timer
+
+class AsyncViewMixin():
+    """
+    Makes as_view() return a coroutine function, so django runs the view on the event loop. 
+    Class based views are only run asynchronously from django 4.1.
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        async def view(request, *args, **kwargs):
+            self = cls(**initkwargs)
+            self.setup(request, *args, **kwargs)
+            method = request.method.lower()
+            handler = getattr(self, method, None) if method in self.http_method_names else None
+            if handler is None and method == 'head':
+                handler = getattr(self, 'get', None)
+            if handler is None or not asyncio.iscoroutinefunction(handler):
+                return self.http_method_not_allowed(request, *args, **kwargs)
+            return await handler(request, *args, **kwargs)
+        view.view_class = cls
+        view.view_initkwargs = initkwargs
+        return view
+
+class CreateURLView(AsyncViewMixin, views.CreateURLView):
+
+    async def post(self, request):
+        url = request.POST.get('url')
+        if not url:
+            return JsonResponse({
+                'success': False, 
+            })
+        url, host = self.clean(url)
+        try:
+            if validation.mode() == validation.SYNC:
+                with timer('validate'):
+                    await validation.avalidate(url)
+            with timer('db'):
+                redirect = await sync_to_async(self.create)(url)
+        except ValidationError as e:
+            return self.failure(url, host, e)
+        return self.success(request, redirect, url, host)
+
+class RedirectURLView(AsyncViewMixin, views.RedirectURLView):
+
+    async def get(self, request, *args, **kwargs):
+        return await self.follow(request, kwargs.get('short'), count = True)
+
+    async def head(self, request, *args, **kwargs):
+        return await self.follow(request, kwargs.get('short'), count = False)
+
+    async def follow(self, request, short, count):
+        with timer('decode'):
+            pk = self.decode(short)
+        if pk is None:
+            return HttpResponseRedirect(reverse('urls:index'))
+        with timer('local'):
+            found = expiry.read(redirect_cache.get_local(pk))
+        if found is None and snapshots.snapshot is not None:
+            with timer('snapshot'):
+                url = snapshots.snapshot.get(pk)
+            found = None if url is None else ( url, None, None )
+        if found is None:
+            found = await sync_to_async(self.lookup)(pk)
+            if found is None:
+                return HttpResponseRedirect(reverse('urls:index'))
+        if count:
+            with timer('count'):
+                if click_counter.incr(pk, flush = False):
+                    await sync_to_async(click_counter.try_flush)()
+                if click_log.record(pk, request, flush = False):
+                    await sync_to_async(click_log.try_flush)()
+                if hot_links.add(pk, tick = False):
+                    await sync_to_async(hot_links.tick)()
+        return self.redirect(*found)
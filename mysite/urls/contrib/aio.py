@@ -0,0 +1,109 @@
+from urllib3.exceptions import (
+        MaxRetryError, NewConnectionError, SSLError, ConnectTimeoutError, ReadTimeoutError,
+        ResponseError, ProtocolError)
+
+from urllib.parse import urlsplit, urljoin
+
+import asyncio
+import ssl
+
+REDIRECT_STATUSES = ( 301, 302, 303, 307, 308 )
+
+class Response():
+
+    def __init__(self, status, headers):
+        self.status = status
+        self.headers = headers
+
+class AsyncPoolManager():
+    """
+    A minimal non-blocking HTTP/1.1 client for validating urls from async views, with the
+    request() interface of urllib3.PoolManager. A connection is opened per request and only
+    the status line and headers are read.
+
+    Failures are raised as urllib3 exceptions wrapped in a MaxRetryError, like the
+    PoolManager, so both are handled by the same error messages.
+    """
+
+    def __init__(self, ca_certs = None, redirects = 3, user_agent = 'urls-validator'):
+        """
+        Args:
+            ca_certs:   the CA bundle used to verify certificates
+            redirects:  the number of redirects to follow
+            user_agent: sent with every request
+        """
+        self.ssl_context = ssl.create_default_context(cafile = ca_certs)
+        self.redirects = redirects
+        self.user_agent = user_agent
+
+    async def request(self, method, url, timeout = None, redirect = True):
+        """
+        Args:
+            method:   the HTTP method, ex: 'HEAD'
+            url:      the url to request
+            timeout:  seconds allowed for connecting, and for reading the response
+            redirect: whether to follow redirects
+
+        Returns:
+            a Response with the status and headers of the final response
+
+        Raises:
+            MaxRetryError: the reason is a NewConnectionError, SSLError, ConnectTimeoutError,
+                           ReadTimeoutError, ProtocolError or, after too many redirects, a
+                           ResponseError
+        """
+        for attempt in range(self.redirects + 1):
+            response = await self._request(method, url, timeout)
+            location = response.headers.get('location')
+            if not redirect or response.status not in REDIRECT_STATUSES or not location:
+                return response
+            url = urljoin(url, location)
+        raise MaxRetryError(None, url, ResponseError('too many redirects'))
+
+    async def _request(self, method, url, timeout):
+        parts = urlsplit(url)
+        secure = parts.scheme == 'https'
+        host = parts.hostname or ''
+        try:
+            port = parts.port or (443 if secure else 80)
+            reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(host, port,
+                        ssl = self.ssl_context if secure else None,
+                        server_hostname = host if secure else None),
+                    timeout)
+        except asyncio.TimeoutError:
+            raise MaxRetryError(None, url, ConnectTimeoutError(None, 'Connection timed out'))
+        except ssl.SSLError as e:
+            raise MaxRetryError(None, url, SSLError(e))
+        except (OSError, ValueError) as e:
+            raise MaxRetryError(None, url, NewConnectionError(None, str(e)))
+
+        try:
+            path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+            writer.write((
+                    '{} {} HTTP/1.1\r\n'
+                    'Host: {}\r\n'
+                    'User-Agent: {}\r\n'
+                    'Accept: */*\r\n'
+                    'Connection: close\r\n\r\n').format(
+                        method, path, host.encode('idna').decode('ascii') + (':' + str(parts.port) if parts.port else ''),
+                        self.user_agent).encode('ascii'))
+            await writer.drain()
+            return await asyncio.wait_for(self._read_head(reader), timeout)
+        except asyncio.TimeoutError:
+            raise MaxRetryError(None, url, ReadTimeoutError(None, url, 'Read timed out'))
+        except (OSError, ValueError, IndexError) as e:
+            raise MaxRetryError(None, url, ProtocolError(str(e)))
+        finally:
+            writer.close()
+
+    async def _read_head(self, reader):
+        status = (await reader.readline()).decode('latin-1').split(' ', 2)[1]
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return Response(int(status), headers)
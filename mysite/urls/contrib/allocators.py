@@ -0,0 +1,135 @@
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from random import randrange
+from threading import Lock
+
+import hashlib
+
+MAX_INT = 2147483647
+
+DEFAULTS = {
+        'BACKEND': 'urls.contrib.allocators.FeistelAllocator',
+        'OPTIONS': {},
+}
+
+class RandomAllocator():
+    """
+    Picks ids at random, checking the database for each one. The number of round trips per
+    id grows as the table fills (50% chance of collision after ~55000 entries).
+    """
+
+    def __init__(self, max_value = MAX_INT, offset = 0, using = None, **kwargs):
+        self.max_value = max_value
+        self.offset = offset
+        self.using = using
+
+    def allocate(self):
+        from ..models import URLRedirect
+
+        id = self.offset + randrange(self.max_value)
+        while URLRedirect.objects.using(self.using).filter(id = id).exists():
+            id = self.offset + randrange(self.max_value)
+        return id
+
+class FeistelAllocator():
+    """
+    Hands out non-sequential ids without any collision checks by passing a database backed
+    sequence through a keyed permutation of [0, max_value). A balanced Feistel network
+    permutes integers of the smallest even bit width covering max_value (32 bits for
+    MAX_INT) and values >= max_value are cycle walked back into range, so every sequence
+    number maps to a distinct id.
+
+    Each worker reserves BLOCK_SIZE sequence numbers at a time, so the sequence is only
+    touched once per block. The key must never change once ids have been allocated.
+    """
+
+    ROUNDS = 4
+
+    def __init__(self, key = None, block_size = 100, sequence = 'urlredirect', max_value = MAX_INT, 
+            offset = 0, using = None):
+        """
+        Args:
+            key:        bytes or str keying the permutation, defaults to the SECRET_KEY
+            block_size: sequence numbers reserved by each worker at a time
+            sequence:   the name of the urls.models.Sequence row
+            max_value:  ids are in [offset, offset + max_value), max_value is at most 2 ** 32
+            offset:     the first id, e.g. of a shard's range
+            using:      the database holding the sequence, None for the routers' choice
+        """
+        key = key if key is not None else settings.SECRET_KEY
+        if isinstance(key, str):
+            key = key.encode('utf-8')
+        if max_value > 2 ** 32:
+            raise ValueError('max_value must be at most 2 ** 32 (found: {})'.format(max_value))
+        # blake2b keys are at most 64 bytes
+        self.key = hashlib.sha256(key).digest()
+        self.block_size = block_size
+        self.sequence = sequence
+        self.max_value = max_value
+        self.offset = offset
+        self.using = using
+        self.half_bits = max(1, ((max_value - 1).bit_length() + 1) // 2)
+        self.half_mask = (1 << self.half_bits) - 1
+        self._next = 0
+        self._end = 0
+        self._lock = Lock()
+
+    def _round(self, idx, half):
+        data = bytes(( idx, half >> 8, half & 0xff ))
+        digest = hashlib.blake2b(data, digest_size = 2, key = self.key).digest()
+        return int.from_bytes(digest, 'big') & self.half_mask
+
+    def _feistel(self, n):
+        left, right = n >> self.half_bits, n & self.half_mask
+        for idx in range(self.ROUNDS):
+            left, right = right, left ^ self._round(idx, right)
+        return (left << self.half_bits) | right
+
+    def permute(self, n):
+        """
+        Args:
+            n: an integer in [0, max_value)
+
+        Returns:
+            the unique id in [0, max_value) that n maps to
+        """
+        if not 0 <= n < self.max_value:
+            raise ValueError('n must be in [0, {}) (found: {})'.format(self.max_value, n))
+        n = self._feistel(n)
+        while n >= self.max_value:
+            n = self._feistel(n)
+        return n
+
+    def allocate(self):
+        from ..models import Sequence
+
+        with self._lock:
+            if self._next >= self._end:
+                self._next = Sequence.reserve(self.sequence, self.block_size, using = self.using)
+                self._end = self._next + self.block_size
+            n = self._next
+            self._next += 1
+        if n >= self.max_value:
+            raise OverflowError('The id sequence "{}" is exhausted'.format(self.sequence))
+        return self.offset + self.permute(n)
+
+    def reset(self):
+        """
+        Forgets the reserved block, the next allocation reserves a new one.
+        """
+        with self._lock:
+            self._next = self._end = 0
+
+def get_allocator(options = None):
+    """
+    Builds the allocator configured by the URLS_ID_ALLOCATOR setting.
+
+    Args:
+        options: overrides the setting, a dict with a dotted path BACKEND and its OPTIONS
+
+    Returns:
+        an object with an allocate() method returning a new id
+    """
+    options = dict(DEFAULTS, **(options or getattr(settings, 'URLS_ID_ALLOCATOR', {})))
+    return import_string(options['BACKEND'])(**options['OPTIONS'])
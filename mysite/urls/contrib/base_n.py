@@ -1,6 +1,25 @@
+from functools import lru_cache
+
 ALPHABET = '23456789abcdefghijkmnopqrstuvwxyzABCDEFGHJKLMNPQRSTUVWXYZ'
 CHAR_MAP = dict((ch, idx) for idx, ch in enumerate(ALPHABET))
 
+MAX_PAIRS_BASE = 256 # larger alphabets are encoded a character at a time
+
+@lru_cache(maxsize = 8)
+def _pairs(alphabet):
+    """
+    A lookup table of every two character string, indexed by the value it encodes.
+    """
+    base = len(alphabet)
+    return tuple(alphabet[i // base] + alphabet[i % base] for i in range(base * base))
+
+@lru_cache(maxsize = 8)
+def _deletions(alphabet):
+    """
+    A str.translate table deleting every character of the alphabet.
+    """
+    return str.maketrans('', '', alphabet)
+
 def encode(n, alphabet = ALPHABET):
     '''
     Encodes a integer.
@@ -14,46 +33,96 @@ def encode(n, alphabet = ALPHABET):
 
     Raise:
         TypeError:  if alphabet is None
-        ValueError: if alphabet is length 0, or n is < 0
+        ValueError: if alphabet is shorter than 2 characters, or n is < 0
     '''
     base = len(alphabet)
-    if base == 0:
-        raise ValueError('The base must be at least 1')
+    if base < 2:
+        raise ValueError('The base must be at least 2')
     elif n < 0:
         raise ValueError('n must be a positive integer (found: {})'.format(n))
-    elif n == 0:
-        return alphabet[0]
+    elif n < base:
+        return alphabet[n]
 
-    encoded_str = ''
-    while n != 0:
-        encoded_str = alphabet[n % base] + encoded_str
-        n //= base
-    
-    return encoded_str
+    # two characters per division, the digits are collected in reverse and joined once
+    digits = []
+    if base <= MAX_PAIRS_BASE:
+        pairs = _pairs(alphabet)
+        square = base * base
+        while n >= square:
+            n, r = divmod(n, square)
+            digits.append(pairs[r])
+        digits.append(pairs[n] if n >= base else alphabet[n])
+    else:
+        while n:
+            n, r = divmod(n, base)
+            digits.append(alphabet[r])
+    return ''.join(reversed(digits))
 
-def decode(encoded_str, char_map = CHAR_MAP):
+def decode(encoded_str, char_map = CHAR_MAP, max_length = None):
     """
-    Decodes a string. 
+    Decodes a string.
 
     Args:
         encoded_str: the string to decode
         char_map:    A dict of (ch, idx) tuples for each character and index in the encoding
                      alphabet
+        max_length:  the longest string accepted, or None for any length
 
     Returns:
         an integer representing the decoded string
-    
+
     Raises:
-        TypeError:  if encoded_str is empty or None, or char_map is None
-        ValueError: if char_map is length 0
+        TypeError:  if encoded_str is None, or char_map is None
+        ValueError: if char_map is length 0, or encoded_str is longer than max_length
         KeyError:   if a character is not in char_map
     """
     base = len(char_map)
     if base == 0:
         raise ValueError('The base must be at least 1')
+    elif max_length is not None and len(encoded_str) > max_length:
+        raise ValueError('The string must be at most {} characters (found: {})'.format(
+            max_length, len(encoded_str)))
 
     n = 0
-    for idx, ch in enumerate(reversed(encoded_str)):
-        n += (base ** idx) * char_map[ch]
+    for ch in encoded_str:
+        n = n * base + char_map[ch]
 
     return n
+
+def is_valid(encoded_str, max_length = None, alphabet = ALPHABET):
+    """
+    Checks a string can be decoded, without decoding it.
+
+    Args:
+        encoded_str: the string to check
+        max_length:  the longest string accepted, or None for any length
+        alphabet:    the encoding alphabet
+
+    Returns:
+        True if the string is not empty, at most max_length characters, and only contains
+        characters from the alphabet
+    """
+    if not encoded_str or (max_length is not None and len(encoded_str) > max_length):
+        return False
+    return not encoded_str.translate(_deletions(alphabet))
+
+def encode_many(ns, alphabet = ALPHABET):
+    """
+    Encodes many integers.
+
+    Returns:
+        a list of the encoded strings, in the same order as ns
+    """
+    return [ encode(n, alphabet) for n in ns ]
+
+def decode_many(encoded_strs, char_map = CHAR_MAP, max_length = None):
+    """
+    Decodes many strings.
+
+    Returns:
+        a list of the decoded integers, in the same order as encoded_strs
+
+    Raises:
+        as decode, for the first string which cannot be decoded
+    """
+    return [ decode(encoded_str, char_map, max_length) for encoded_str in encoded_strs ]
@@ -0,0 +1,289 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+from .sharding import shard_map
+
+from threading import Lock, Thread
+
+import logging
+import math
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+        'ENABLED': False,
+        'CAPACITY': 1000000,        # ids the filter is sized for at least, grown on rebuild
+        'ERROR_RATE': 0.001,        # the false positive rate at capacity
+        'REBUILD_INTERVAL': 3600,   # seconds between rebuilds, which drop deleted ids
+        'ALIAS': 'default',         # the cache backend shared by the workers
+        'KEY_PREFIX': 'urls:ids:',
+        'SHARED': False,            # publish built filters through the cache, ~1.8MB per million ids
+        'TRUST_MISSES': None,       # answer ids missing from the filter without a query, None when
+                                    # ALIAS is shared by the processes (not LocMemCache or DummyCache)
+}
+
+MASK64 = (1 << 64) - 1
+CHUNK_SIZE = 10000 # ids read per query while building
+
+def option(name):
+    return getattr(settings, 'URLS_ID_FILTER', {}).get(name, DEFAULTS[name])
+
+def _mix(pk):
+    # splitmix64, spreads consecutive ids over the whole 64 bit range
+    h = (pk + 0x9E3779B97F4A7C15) & MASK64
+    h = ((h ^ (h >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    h = ((h ^ (h >> 27)) * 0x94D049BB133111EB) & MASK64
+    return h ^ (h >> 31)
+
+class BloomFilter():
+    """
+    A set of integers which may answer that a missing integer is present (with the
+    probability error_rate at capacity) but never that a present one is missing. Uses
+    capacity * -ln(error_rate) / ln(2)^2 bits, ~14.4 bits per id for 0.1%. Integers cannot be
+    removed.
+    """
+
+    def __init__(self, capacity, error_rate = 0.001, bits = None, hashes = None, data = None):
+        capacity = max(1, capacity)
+        self.bits = bits or max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = hashes or max(1, int(round(self.bits / capacity * math.log(2))))
+        self.data = bytearray(data) if data is not None else bytearray((self.bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, pk):
+        h = _mix(pk)
+        h1, h2 = h & 0xffffffff, (h >> 32) | 1
+        return [ (h1 + idx * h2) % self.bits for idx in range(self.hashes) ]
+
+    def add(self, pk):
+        for position in self._positions(pk):
+            self.data[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, pk):
+        data = self.data
+        for position in self._positions(pk):
+            if not data[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def expected_error_rate(self):
+        """
+        Returns:
+            the false positive rate for the integers added so far
+        """
+        return (1 - math.exp(-self.hashes * self.count / self.bits)) ** self.hashes
+
+class IdFilter():
+    """
+    Tells RedirectURLView which short codes certainly do not exist, so codes guessed by
+    scanners are answered without a database query. A Bloom filter of every URLRedirect id is
+    built in a background thread on first use and every REBUILD_INTERVAL seconds, until it
+    is built every lookup goes to the database.
+
+    Links created by this worker are added as they are saved. Those created by other workers
+    are marked in the shared cache until the next rebuild, and a negative answer is only
+    trusted once that cache has been checked too. With a cache local to each process the
+    marks of other workers cannot be seen, so ids missing from the filter are checked against
+    the database unless TRUST_MISSES is set, e.g. for a single process. Deleted links stay in
+    the filter, and cost a query, until the next rebuild.
+    """
+
+    def __init__(self, options = None):
+        options = dict(DEFAULTS, **(options or {}))
+        self.enabled          = options['ENABLED']
+        self.capacity         = options['CAPACITY']
+        self.error_rate       = options['ERROR_RATE']
+        self.rebuild_interval = options['REBUILD_INTERVAL']
+        self.alias            = options['ALIAS']
+        self.key_prefix       = options['KEY_PREFIX']
+        self.shared           = options['SHARED']
+        self.trust_misses     = options['TRUST_MISSES']
+        self.filter = None
+        self.built = None
+        self.rejected = 0
+        self.passed = 0
+        self.false_positives = 0
+        self.verified = 0
+        self._added = None  # the ids added while a rebuild is running
+        self._lock = Lock()
+        self._thread = None
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @property
+    def trusted(self):
+        """
+        Whether an id missing from the filter and the cache certainly does not exist.
+        """
+        if self.trust_misses is not None:
+            return self.trust_misses
+        return not isinstance(self.cache, ( LocMemCache, DummyCache ))
+
+    def key(self, pk):
+        return self.key_prefix + str(pk)
+
+    def might_exist(self, pk):
+        """
+        Returns:
+            False if the id is certainly not a URLRedirect, True if it may be
+        """
+        if not self.enabled:
+            return True
+        if self.built is None or time.monotonic() - self.built >= self.rebuild_interval:
+            self.rebuild_in_background()
+        current = self.filter
+        if current is None or pk in current or self.cache.get(self.key(pk)) is not None:
+            self.passed += 1
+            return True
+        elif not self.trusted:
+            self.verified += 1
+            return True
+        self.rejected += 1
+        return False
+
+    def found(self, pk):
+        """
+        Records that an id passed by the filter exists, adding it to this worker's filter if
+        it was missing, e.g. created by another worker.
+        """
+        current = self.filter
+        if current is not None and pk not in current:
+            with self._lock:
+                if self.filter is not None:
+                    self.filter.add(pk)
+                if self._added is not None:
+                    self._added.append(pk)
+
+    def false_positive(self, pk):
+        """
+        Records that an id the filter passed did not exist.
+        """
+        current = self.filter
+        if current is not None and pk in current:
+            self.false_positives += 1
+
+    def add(self, pk):
+        self.add_many([ pk ])
+
+    def add_many(self, pks):
+        """
+        Adds the ids of new links, and marks them in the shared cache for the other workers.
+        """
+        if not self.enabled:
+            return
+        pks = list(pks)
+        with self._lock:
+            if self.filter is not None:
+                for pk in pks:
+                    self.filter.add(pk)
+            if self._added is not None:
+                self._added.extend(pks)
+        # kept until every worker has rebuilt its filter since
+        self.cache.set_many(dict((self.key(pk), 1) for pk in pks), 2 * self.rebuild_interval)
+
+    def rebuild_in_background(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = Thread(target = self._run, name = 'id-filter', daemon = True)
+        self._thread.start()
+
+    def _run(self):
+        from django.db import connection
+
+        try:
+            self.rebuild()
+        except Exception:
+            logger.exception('Could not build the id filter')
+            # try again after the interval rather than on every request
+            self.built = time.monotonic()
+        finally:
+            connection.close()
+            with self._lock:
+                self._thread = None
+
+    def rebuild(self):
+        """
+        Builds the filter from the database, or loads the one another worker published
+        within REBUILD_INTERVAL when SHARED.
+        """
+        with self._lock:
+            self._added = []
+        try:
+            built = self.load() if self.shared else None
+            if built is None:
+                built = self.build()
+                if self.shared:
+                    self.publish(built)
+        except BaseException:
+            with self._lock:
+                self._added = None
+            raise
+        with self._lock:
+            for pk in self._added:
+                built.add(pk)
+            self._added = None
+            self.filter = built
+            self.built = time.monotonic()
+        return built
+
+    def build(self):
+        from ..models import URLRedirect
+
+        count = sum(URLRedirect.objects.using(shard_map.using(shard)).count() for shard in shard_map)
+        # room to grow until the next rebuild
+        built = BloomFilter(max(self.capacity, 2 * count), self.error_rate)
+        for shard in shard_map:
+            ids = URLRedirect.objects.using(shard_map.using(shard)).order_by('pk').values_list('pk', flat = True)
+            last = -1
+            while True:
+                chunk = list(ids.filter(pk__gt = last)[:CHUNK_SIZE])
+                for pk in chunk:
+                    built.add(pk)
+                if len(chunk) < CHUNK_SIZE:
+                    break
+                last = chunk[-1]
+        return built
+
+    def publish(self, built):
+        self.cache.set(self.key_prefix + 'filter', (
+                time.time(), built.bits, built.hashes, built.count, bytes(built.data)), self.rebuild_interval)
+
+    def load(self):
+        published = self.cache.get(self.key_prefix + 'filter')
+        if published is None or time.time() - published[0] >= self.rebuild_interval:
+            return None
+        published_at, bits, hashes, count, data = published
+        loaded = BloomFilter(count, bits = bits, hashes = hashes, data = data)
+        loaded.count = count
+        return loaded
+
+    def clear(self):
+        with self._lock:
+            self.filter = None
+            self.built = None
+            self.rejected = self.passed = self.false_positives = self.verified = 0
+
+    def stats(self):
+        current = self.filter
+        checked = self.rejected + self.false_positives
+        return {
+            'entries': current.count if current is not None else 0,
+            'bits': current.bits if current is not None else 0,
+            'rejected': self.rejected,
+            'passed': self.passed,
+            'false_positives': self.false_positives,
+            # missing from the filter, checked against the database as it is not trusted
+            'verified': self.verified,
+            # of the ids which do not exist, the share the filter let through
+            'false_positive_rate': self.false_positives / checked if checked else 0.0,
+            'expected_false_positive_rate': current.expected_error_rate() if current is not None else 0.0,
+        }
+
+id_filter = IdFilter(getattr(settings, 'URLS_ID_FILTER', None))
@@ -0,0 +1,244 @@
+from django.db import router, transaction, IntegrityError
+
+from .urls import canonicalize_many, validate_scheme, digest, ValidationError, PENDING, VALID
+from .base_n import encode
+from .sharding import shard_map
+from .bloom import id_filter
+from . import validation, expiry
+
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+import csv
+import json
+
+JSON = 'json'
+CSV  = 'csv'
+TEXT = 'text'
+
+READ_SIZE = 64 * 1024   # bytes read at a time from a JSON request body, which may be one line
+
+def read_urls(lines, format = TEXT):
+    """
+    Reads urls from an iterable of text lines, streamed so only the url being read is held 
+    in memory.
+
+    Args:
+        lines:  an iterable of str, e.g. an open file, or of blocks of text for JSON
+        format: JSON for a list of urls (or an object with a "urls" list), CSV for the "url"
+                column (or the first column when there is no header), or TEXT for a url per
+                line
+
+    Returns:
+        an iterator of the raw urls
+
+    Raises:
+        ValueError: while iterating, if the JSON is invalid
+    """
+    if format == JSON:
+        return _read_json(lines)
+    elif format == CSV:
+        return _read_csv(lines)
+    return ( line.strip() for line in lines if line.strip() )
+
+class _JSONReader():
+    """
+    Decodes JSON values one at a time from an iterable of text, reading more only when the 
+    value at hand is incomplete.
+    """
+
+    def __init__(self, lines):
+        self.lines = iter(lines)
+        self.buffer = ''
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def more(self):
+        """
+        Appends the next line to the buffer, dropping what was already read.
+
+        Returns:
+            False at the end of the input
+        """
+        line = next(self.lines, None)
+        if line is None:
+            return False
+        self.buffer = self.buffer[self.pos:] + line
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """
+        Returns:
+            the next character which is not whitespace, or '' at the end of the input
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            elif not self.more():
+                return ''
+
+    def expect(self, chars):
+        """
+        Returns:
+            the next character, which must be one of chars
+        """
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError('Expected one of {!r} but found {!r}'.format(chars, char))
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self.more():
+                    raise
+                continue
+            # a number may go on in the next line
+            if end < len(self.buffer) or not self.more():
+                self.pos = end
+                return value
+
+def _read_json(lines):
+    reader = _JSONReader(lines)
+    if reader.expect('[{') == '{':
+        # the values before "urls" are skipped
+        while True:
+            key = reader.value()
+            reader.expect(':')
+            if key == 'urls':
+                reader.expect('[')
+                break
+            reader.value()
+            reader.expect(',')
+    if reader.peek() == ']':
+        return
+    while True:
+        yield reader.value()
+        if reader.expect(',]') == ']':
+            return
+
+def _read_csv(lines):
+    rows = csv.reader(lines)
+    for row in rows:
+        if not row:
+            continue
+        column = row.index('url') if 'url' in row else None
+        if column is None:
+            yield row[0]
+        break
+    else:
+        return
+    for row in rows:
+        if row:
+            yield row[column or 0]
+
+def format_for(name, default = TEXT):
+    """
+    Guesses the input format from a file name or content type.
+    """
+    name = (name or '').lower()
+    if name.endswith('.json') or 'json' in name:
+        return JSON
+    elif name.endswith('.csv') or 'csv' in name:
+        return CSV
+    return default
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+def shorten_many(urls, chunk_size = 500, workers = None):
+    """
+    Shortens urls in chunks, yielding a result per url in input order. Each chunk costs one
+    query to find the urls which already exist and one bulk insert for the rest. New urls are
+    validated concurrently, or stored as pending, according to the URLS_VALIDATION mode.
+
+    Args:
+        urls:       an iterable of raw urls, consumed lazily
+        chunk_size: urls handled per round trip
+        workers:    concurrent validations, defaults to the WORKERS option
+
+    Returns:
+        an iterator of dicts with the keys input, url, success, and either short (the encoded
+        id) and status, or result (the error message)
+    """
+    from ..models import URLRedirect, allocate_id
+
+    mode = validation.mode()
+    with ThreadPoolExecutor(max_workers = workers or validation.option('WORKERS')) as executor:
+        for chunk in chunks(urls, chunk_size):
+            results = []
+            raws = [ (raw or '').strip() for raw in chunk ]
+            canonical = iter(canonicalize_many(raw for raw in raws if raw))
+            for raw in raws:
+                result = { 'input': raw, 'url': next(canonical) if raw else '', 'success': False }
+                try:
+                    validate_scheme(result['url'])
+                except ValidationError as e:
+                    result['result'] = e.message
+                results.append(result)
+
+            candidates = list(dict.fromkeys(r['url'] for r in results if 'result' not in r))
+            owners = shard_map.group(candidates, shard_map.for_url)
+            found = {}
+            for shard, urls in owners.items():
+                found.update((redirect.original_url, redirect) for redirect in URLRedirect.objects
+                        .using(shard_map.using(shard))
+                        .filter(url_hash__in = [ digest(url) for url in urls ])
+                        .only('id', 'original_url', 'status', 'expires'))
+            for redirect in found.values():
+                if expiry.is_expired(redirect.expires):
+                    # shortened again before it was purged, it starts over
+                    for name, value in expiry.defaults().items():
+                        setattr(redirect, name, value)
+                    redirect.save(update_fields = [ 'expires', 'max_idle' ])
+            missing = [ url for url in candidates if url not in found ]
+
+            if mode == validation.SYNC:
+                checked = dict(zip(missing, executor.map(validation.check, missing)))
+            else:
+                checked = dict((url, { 'status': PENDING }) for url in missing)
+
+            new = []
+            for shard, urls in owners.items():
+                created = [ URLRedirect(
+                            id = allocate_id(shard),
+                            original_url = url,
+                            url_hash = digest(url),
+                            **dict(expiry.defaults(), **checked[url]))
+                        for url in urls if url not in found and checked[url]['status'] in ( VALID, PENDING ) ]
+                redirects = URLRedirect.objects.db_manager(shard_map.using(shard) or router.db_for_write(URLRedirect))
+                try:
+                    with transaction.atomic(using = redirects.db):
+                        redirects.bulk_create(created)
+                except IntegrityError:
+                    # an id taken before the allocator was introduced, or the same url created
+                    # concurrently. fall back to creating them one by one.
+                    created = [ URLRedirect.get_or_create(redirect.original_url, redirect.status, 
+                            redirect.status_code, redirect.status_message) for redirect in created ]
+                new.extend(created)
+            id_filter.add_many(redirect.id for redirect in new)
+            found.update((redirect.original_url, redirect) for redirect in new)
+            if mode == validation.THREAD:
+                for redirect in new:
+                    validation.submit(redirect.id, redirect.original_url)
+
+            for result in results:
+                if 'result' in result:
+                    pass
+                elif result['url'] in found:
+                    redirect = found[result['url']]
+                    result.update(success = True, short = encode(redirect.id), status = redirect.status)
+                else:
+                    result['result'] = checked[result['url']]['status_message']
+                yield result
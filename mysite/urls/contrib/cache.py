@@ -0,0 +1,199 @@
+from django.conf import settings
+from django.core.cache import caches
+
+from collections import OrderedDict
+from threading import Lock
+
+import time
+
+DEFAULTS = {
+        'ALIAS': 'default',             # the django cache backend shared by all workers
+        'KEY_PREFIX': 'urls:redirect:',
+        'TIMEOUT': 60 * 60 * 24,        # seconds an entry lives in the shared backend
+        'LOCAL_SIZE': 10000,            # entries held in each worker's in-process LRU
+        'LOCAL_TIMEOUT': 60 * 5,        # seconds an entry lives in the in-process LRU
+}
+
+_missing = object()
+
+class LRUCache():
+    """
+    A thread safe, bounded, least recently used cache where entries can expire after a
+    time to live.
+    """
+
+    def __init__(self, maxsize = 1024, timeout = None):
+        """
+        Args:
+            maxsize: the maximum number of entries, the least recently used is evicted first
+            timeout: the default number of seconds an entry lives, or None to never expire
+        """
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, _missing) is not _missing
+
+    def get(self, key, default = None):
+        with self._lock:
+            entry = self._data.get(key, _missing)
+            if entry is not _missing:
+                value, expires = entry
+                if expires is None or expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, timeout = _missing):
+        if timeout is _missing:
+            timeout = self.timeout
+        expires = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            self._data[key] = ( value, expires )
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last = False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+class RedirectCache():
+    """
+    A read-through cache of URLRedirect primary key -> original url.
+
+    Lookups go to a bounded in-process LRU first, then to the configured django cache
+    backend which is shared between workers. Invalidation only reaches the shared backend
+    and this worker's LRU, so other workers may serve a stale url for at most LOCAL_TIMEOUT
+    seconds.
+
+    The hottest links can also be pinned (urls.contrib.hot), they are read before the LRU 
+    and never evicted, and are refreshed from the shared backend by whoever pinned them.
+    """
+
+    def __init__(self, options = None):
+        options = dict(DEFAULTS, **(options or {}))
+        self.alias      = options['ALIAS']
+        self.key_prefix = options['KEY_PREFIX']
+        self.timeout    = options['TIMEOUT']
+        self.local      = LRUCache(options['LOCAL_SIZE'], options['LOCAL_TIMEOUT'])
+        self.pinned     = {}
+        self.pinned_hits = 0
+        self.shared_hits = 0
+        self.misses      = 0
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    def key(self, pk):
+        return self.key_prefix + str(pk)
+
+    def get(self, pk):
+        """
+        Args:
+            pk: the primary key of the URLRedirect
+
+        Returns:
+            the original url, or None if it is not cached
+        """
+        url = self.get_local(pk)
+        if url is not None:
+            return url
+        url = self.shared.get(self.key(pk))
+        if url is None:
+            self.misses += 1
+            return None
+        self.shared_hits += 1
+        self.local.set(pk, url)
+        return url
+
+    def get_local(self, pk):
+        """
+        Returns:
+            the original url from the pinned links or this worker's LRU, or None
+        """
+        url = self.pinned.get(pk)
+        if url is not None:
+            self.pinned_hits += 1
+            return url
+        return self.local.get(pk)
+
+    def get_shared_many(self, pks):
+        """
+        Returns:
+            a dict of primary key -> original url of those found in the shared backend
+        """
+        found = self.shared.get_many([ self.key(pk) for pk in pks ])
+        return dict(( pk, found[self.key(pk)] ) for pk in pks if self.key(pk) in found)
+
+    def set(self, pk, url):
+        self.local.set(pk, url)
+        self.shared.set(self.key(pk), url, self.timeout)
+
+    def set_many(self, urls):
+        """
+        Args:
+            urls: a dict of primary key -> original url
+        """
+        for pk, url in urls.items():
+            self.local.set(pk, url)
+        self.shared.set_many(dict(( self.key(pk), url ) for pk, url in urls.items()), self.timeout)
+
+    def pin(self, urls):
+        """
+        Replaces the pinned links.
+
+        Args:
+            urls: a dict of primary key -> original url
+        """
+        self.pinned = dict(urls)
+
+    def delete(self, pk):
+        self.pinned.pop(pk, None)
+        self.local.delete(pk)
+        self.shared.delete(self.key(pk))
+
+    def delete_many(self, pks):
+        for pk in pks:
+            self.pinned.pop(pk, None)
+            self.local.delete(pk)
+        self.shared.delete_many([ self.key(pk) for pk in pks ])
+
+    def clear(self):
+        """
+        Clears this worker's LRU and the counters. The shared backend is left untouched.
+        """
+        self.local.clear()
+        self.pinned = {}
+        self.pinned_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {
+            'pinned_hits': self.pinned_hits,
+            'local_hits': self.local.hits,
+            'shared_hits': self.shared_hits,
+            'misses': self.misses,
+            'local_size': len(self.local),
+            'pinned': len(self.pinned),
+        }
+
+redirect_cache = RedirectCache(getattr(settings, 'URLS_REDIRECT_CACHE', None))
@@ -0,0 +1,263 @@
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .counters import BufferedWriter
+from .sharding import shard_map
+
+from collections import Counter
+from datetime import timedelta
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+import re
+
+BROWSER = 'browser'
+MOBILE  = 'mobile'
+BOT     = 'bot'
+UNKNOWN = 'unknown'
+
+HOUR = 'hour'
+DAY  = 'day'
+
+PERIODS = {
+        HOUR: timedelta(hours = 1),
+        DAY: timedelta(days = 1),
+}
+
+DEFAULTS = {
+        'ENABLED': True,
+        'FLUSH_INTERVAL': 5.0,      # seconds of clicks a worker may lose if it is killed
+        'FLUSH_THRESHOLD': 1000,    # clicks buffered before forcing a flush
+        'BATCH_SIZE': 500,          # rows per INSERT statement
+        'BACKGROUND': False,        # flush from a daemon thread, not only on the next click
+        'SETTLE': 60,               # seconds an event is left before it is rolled up
+}
+
+ROLLUP_SEQUENCE = 'click_rollup'
+IN_CHUNK_SIZE = 500 # links per query, within the parameter limits of every backend
+
+_bots   = re.compile(r'bot|crawl|spider|slurp|curl|wget|python|java/|go-http|headless', re.IGNORECASE)
+_mobile = re.compile(r'mobile|android|iphone|ipad|ipod|windows phone', re.IGNORECASE)
+
+def option(name):
+    return getattr(settings, 'URLS_CLICK_LOG', {}).get(name, DEFAULTS[name])
+
+@lru_cache(maxsize = 1024)
+def agent_class(user_agent):
+    """
+    Returns:
+        BOT, MOBILE, BROWSER or UNKNOWN for a User-Agent header
+    """
+    if not user_agent:
+        return UNKNOWN
+    elif _bots.search(user_agent):
+        return BOT
+    elif _mobile.search(user_agent):
+        return MOBILE
+    return BROWSER
+
+def referrer_host(referrer):
+    """
+    Returns:
+        the host of a Referer header, or '' if there is none
+    """
+    try:
+        return (urlsplit(referrer).hostname or '')[:255] if referrer else ''
+    except ValueError:
+        return ''
+
+def truncate(moment, period):
+    """
+    Returns:
+        the start of the hour or day (UTC) containing moment
+    """
+    moment = moment.replace(minute = 0, second = 0, microsecond = 0)
+    return moment.replace(hour = 0) if period == DAY else moment
+
+class ClickLog(BufferedWriter):
+    """
+    Buffers click events in memory and appends them to the ClickEvent table in batches, so a
+    redirect only pays for appending to a list. Flushed like the ClickCounter: once
+    FLUSH_INTERVAL seconds have passed or FLUSH_THRESHOLD clicks are pending, and when the
+    worker exits.
+    """
+
+    name = 'click-log'
+
+    def __init__(self, options = None):
+        options = dict(DEFAULTS, **(options or {}))
+        super().__init__(options)
+        self.enabled = options['ENABLED']
+
+    def record(self, pk, request, flush = True):
+        """
+        Records a click on the URLRedirect with the primary key pk, flushing if due.
+
+        Args:
+            request: the redirect request, for the referrer and user agent
+            flush:   False to leave a due flush to the caller, e.g. from an async view
+
+        Returns:
+            whether a flush was due
+        """
+        if not self.enabled:
+            return False
+        event = (
+                pk,
+                timezone.now(),
+                referrer_host(request.META.get('HTTP_REFERER')),
+                agent_class(request.META.get('HTTP_USER_AGENT', '')))
+        with self._lock:
+            self._pending.append(event)
+        return self.added(flush)
+
+    def pending(self, pk = None):
+        """
+        Returns:
+            the number of unflushed events for pk, or for every link if pk is None
+        """
+        with self._lock:
+            if pk is None:
+                return len(self._pending)
+            return sum(1 for event in self._pending if event[0] == pk)
+
+    def new_buffer(self):
+        return []
+
+    def restore(self, pending):
+        self._pending[:0] = pending
+
+    def write(self, pending):
+        from ..models import ClickEvent
+
+        # the events of a link are written to its shard, and removed from pending once
+        # committed so a failure only puts back the ones which were not written
+        for shard, events in shard_map.group(pending, lambda event: shard_map.for_id(event[0])).items():
+            using = shard_map.using(shard)
+            with transaction.atomic(using = using):
+                ClickEvent.objects.using(using).bulk_create([
+                        ClickEvent(redirect_id = pk, time = clicked, referrer_host = host, agent = agent)
+                        for pk, clicked, host, agent in events ], batch_size = self.batch_size)
+            pending[:] = [ event for event in pending if shard_map.for_id(event[0]) is not shard ]
+
+click_log = ClickLog(getattr(settings, 'URLS_CLICK_LOG', None))
+
+def rollup(batch_size = 5000, settle = None, now = None):
+    """
+    Aggregates the next batch of click events of each shard into hourly and daily
+    ClickRollups. The id of the last event rolled up is kept in a Sequence on the shard and
+    advanced in the same transaction, so each event is counted exactly once however often
+    this runs. Events newer than SETTLE seconds are left for the next run, so clicks still
+    being flushed are not skipped.
+
+    Args:
+        batch_size: the maximum number of events read per shard
+        settle:     overrides the SETTLE option
+        now:        the current time, for testing
+
+    Returns:
+        the number of events rolled up, including those of deleted links which are dropped
+    """
+    settle = option('SETTLE') if settle is None else settle
+    cutoff = (now or timezone.now()) - timedelta(seconds = settle)
+    return sum(rollup_shard(shard_map.using(shard), batch_size, cutoff) for shard in shard_map)
+
+def rollup_shard(using, batch_size, cutoff):
+    from ..models import URLRedirect, ClickEvent, ClickRollup, Sequence
+
+    sequences = Sequence.objects.db_manager(using or router.db_for_write(Sequence))
+    clicks = ClickEvent.objects.db_manager(sequences.db)
+    rollups = ClickRollup.objects.db_manager(sequences.db)
+    with transaction.atomic(using = sequences.db):
+        sequences.get_or_create(name = ROLLUP_SEQUENCE)
+        watermark = sequences.select_for_update().get(name = ROLLUP_SEQUENCE)
+        events = list(clicks
+                .filter(id__gt = watermark.value)
+                .order_by('id')
+                .values_list('id', 'redirect_id', 'time')[:batch_size])
+        for idx, ( id, pk, clicked ) in enumerate(events):
+            if clicked >= cutoff:
+                del events[idx:]
+                break
+        if not events:
+            return 0
+
+        # the events of deleted links have no foreign key constraint, they are dropped
+        clicked_pks = sorted(set(pk for id, pk, clicked in events))
+        live = set()
+        for idx in range(0, len(clicked_pks), IN_CHUNK_SIZE):
+            live.update(URLRedirect.objects.using(sequences.db)
+                    .filter(pk__in = clicked_pks[idx:idx + IN_CHUNK_SIZE])
+                    .values_list('pk', flat = True))
+
+        counts = Counter()
+        for id, pk, clicked in events:
+            if pk not in live:
+                continue
+            for period in PERIODS:
+                counts[( pk, period, truncate(clicked, period) )] += 1
+
+        pks = sorted(set(pk for pk, period, start in counts))
+        earliest = min(( start for pk, period, start in counts ), default = None)
+        existing = set()
+        for idx in range(0, len(pks), IN_CHUNK_SIZE):
+            existing.update(rollups
+                    .filter(redirect_id__in = pks[idx:idx + IN_CHUNK_SIZE], start__gte = earliest)
+                    .values_list('redirect_id', 'period', 'start'))
+        for key in existing & set(counts):
+            pk, period, start = key
+            rollups.filter(redirect_id = pk, period = period, start = start).update(
+                    clicks = F('clicks') + counts[key])
+        rollups.bulk_create([
+                ClickRollup(redirect_id = pk, period = period, start = start, clicks = n)
+                for ( pk, period, start ), n in counts.items() if ( pk, period, start ) not in existing ])
+
+        sequences.filter(name = ROLLUP_SEQUENCE).update(value = events[-1][0])
+    return len(events)
+
+def prune():
+    """
+    Deletes the click events which have been rolled up.
+
+    Returns:
+        the number of events deleted
+    """
+    from ..models import ClickEvent, Sequence
+
+    deleted = 0
+    for shard in shard_map:
+        using = shard_map.using(shard) or router.db_for_write(Sequence)
+        watermark = (Sequence.objects.using(using)
+                .filter(name = ROLLUP_SEQUENCE)
+                .values_list('value', flat = True)
+                .first())
+        if watermark:
+            deleted += ClickEvent.objects.using(using).filter(id__lte = watermark).delete()[0]
+    return deleted
+
+def clicks_per(pk, period = DAY, count = 90, now = None):
+    """
+    Reads the clicks on a link per hour or day from the rollups. The query is answered from
+    the (redirect, period, start, clicks) index without reading the table.
+
+    Args:
+        pk:     the URLRedirect primary key
+        period: HOUR or DAY
+        count:  the number of periods, ending with the current one
+        now:    the current time, for testing
+
+    Returns:
+        a list of (start, clicks) tuples, oldest first, including periods without clicks
+    """
+    from ..models import ClickRollup
+
+    step = PERIODS[period]
+    last = truncate((now or timezone.now()).astimezone(timezone.utc), period)
+    first = last - step * (count - 1)
+    clicks = dict(ClickRollup.objects
+            .using(shard_map.using_id(pk))
+            .filter(redirect_id = pk, period = period, start__gte = first)
+            .values_list('start', 'clicks'))
+    return [ ( first + step * idx, clicks.get(first + step * idx, 0) ) for idx in range(count) ]
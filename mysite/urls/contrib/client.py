@@ -0,0 +1,306 @@
+from urllib3 import exceptions as ex
+
+from collections import OrderedDict
+from contextlib import contextmanager, asynccontextmanager
+from threading import BoundedSemaphore, Lock
+from urllib.parse import urlsplit
+
+import asyncio
+import time
+import urllib3
+
+DEFAULTS = {
+        'MAX_CONNECTIONS': 64,      # concurrent requests over every host
+        'HOST_CONNECTIONS': 4,      # concurrent requests to one host, also the idle connections kept
+        'POOL_TIMEOUT': 1.0,        # seconds to wait for a free connection before giving up
+        'FAILURE_THRESHOLD': 5,     # consecutive timeouts or SSL errors which open a host's circuit
+        'RESET_TIMEOUT': 30,        # seconds an open circuit fails fast before a trial request
+        'HOSTS': 1000,              # hosts tracked, the least recently used is forgotten first
+        'FALLBACK_STATUSES': ( 405, 501 ), # HEAD responses retried with GET
+}
+
+CLOSED    = 'closed'
+OPEN      = 'open'
+HALF_OPEN = 'half_open'
+
+# failures which open a circuit, as a site which timed out or has a bad certificate will
+# keep doing so for a while
+breaker_errors = ( ex.TimeoutError, ex.SSLError )
+
+class CircuitOpenError(ex.HTTPError):
+    """
+    Raised wrapped in a MaxRetryError instead of requesting a host whose circuit is open.
+    """
+    pass
+
+class Host():
+    """
+    The connection slots, circuit breaker and counters of one host.
+    """
+
+    def __init__(self, connections):
+        self.slots = BoundedSemaphore(connections)
+        self.in_use = 0
+        self.failures = 0   # consecutive
+        self.opened = None  # when the circuit opened, None while it is closed
+        self.trial = False  # whether a request is testing the half open circuit
+        self.counts = {
+            'requests': 0,
+            'failures': 0,
+            'rejected': 0,
+            'busy': 0,
+            'fallbacks': 0,
+            'opened': 0,
+        }
+
+class ValidationClient():
+    """
+    The HTTP client of url validation, with the request() interface of urllib3.PoolManager.
+
+    Requests to one host are limited to HOST_CONNECTIONS at a time and every host shares
+    MAX_CONNECTIONS, so a burst of links to a slow site cannot take every connection. A
+    request which waits longer than POOL_TIMEOUT for a slot fails with an EmptyPoolError.
+
+    After FAILURE_THRESHOLD consecutive timeouts or SSL errors the circuit of a host opens
+    and its requests fail at once with a CircuitOpenError. After RESET_TIMEOUT seconds one
+    trial request is let through, which closes the circuit if the host responds or opens it
+    again if it fails.
+
+    Servers which reject HEAD with one of the FALLBACK_STATUSES are asked again with a GET,
+    of which only the status and headers are read.
+
+    Failures are raised as urllib3 exceptions wrapped in a MaxRetryError, like the
+    PoolManager.
+    """
+
+    def __init__(self, options = None, **kwargs):
+        """
+        Args:
+            options: overrides of DEFAULTS
+            kwargs:  passed to the urllib3.PoolManager, ex: ca_certs
+        """
+        options = dict(DEFAULTS, **(options or {}))
+        self.host_connections  = options['HOST_CONNECTIONS']
+        self.pool_timeout      = options['POOL_TIMEOUT']
+        self.failure_threshold = options['FAILURE_THRESHOLD']
+        self.reset_timeout     = options['RESET_TIMEOUT']
+        self.max_hosts         = options['HOSTS']
+        self.fallback_statuses = options['FALLBACK_STATUSES']
+        self.slots = BoundedSemaphore(options['MAX_CONNECTIONS'])
+        self.manager = urllib3.PoolManager(maxsize = self.host_connections, **kwargs)
+        self._hosts = OrderedDict()
+        self._lock = Lock()
+
+    @property
+    def pools(self):
+        return self.manager.pools
+
+    def host(self, url):
+        """
+        Returns:
+            the Host of a url, keyed by scheme and netloc
+        """
+        parts = urlsplit(url)
+        key = parts.scheme + '://' + parts.netloc
+        with self._lock:
+            host = self._hosts.get(key)
+            if host is None:
+                host = self._hosts[key] = Host(self.host_connections)
+                # requests in flight to a forgotten host keep its slots until they finish
+                while len(self._hosts) > self.max_hosts:
+                    self._hosts.popitem(last = False)
+            self._hosts.move_to_end(key)
+            return host
+
+    def state(self, host):
+        if host.opened is None:
+            return CLOSED
+        elif host.trial or time.monotonic() - host.opened < self.reset_timeout:
+            return OPEN
+        return HALF_OPEN
+
+    def request(self, method, url, timeout = None, **kwargs):
+        """
+        Args:
+            method:  the HTTP method, ex: 'HEAD'
+            url:     the url to request
+            timeout: seconds allowed for connecting, and for reading the response
+            kwargs:  passed to urllib3.PoolManager.request
+
+        Returns:
+            the urllib3.HTTPResponse
+
+        Raises:
+            MaxRetryError: as urllib3.PoolManager.request, or with a CircuitOpenError or
+                           EmptyPoolError reason
+        """
+        host = self.host(url)
+        self._admit(host, url)
+        failed = None
+        try:
+            with self._slot(host.slots, host, url), self._slot(self.slots, host, url):
+                self._begin(host)
+                try:
+                    response = self._request(host, method, url, timeout, **kwargs)
+                finally:
+                    self._end(host)
+            failed = False
+            return response
+        except ex.MaxRetryError as e:
+            if isinstance(e.reason, breaker_errors):
+                failed = True
+            raise
+        finally:
+            self._record(host, failed)
+
+    def _request(self, host, method, url, timeout, **kwargs):
+        response = self.manager.request(method, url, timeout = timeout, **kwargs)
+        if method == 'HEAD' and response.status in self.fallback_statuses:
+            with self._lock:
+                host.counts['fallbacks'] += 1
+            response = self.manager.request('GET', url, timeout = timeout, preload_content = False, **kwargs)
+            # the body is not needed, closing the connection beats reading it
+            response.close()
+            response.release_conn()
+        return response
+
+    def _admit(self, host, url):
+        with self._lock:
+            state = self.state(host)
+            if state == OPEN:
+                host.counts['rejected'] += 1
+                raise ex.MaxRetryError(None, url, CircuitOpenError('The circuit of {} is open'.format(url)))
+            elif state == HALF_OPEN:
+                host.trial = True
+
+    @contextmanager
+    def _slot(self, slots, host, url):
+        if not slots.acquire(timeout = self.pool_timeout):
+            raise self._busy(host, url)
+        try:
+            yield
+        finally:
+            slots.release()
+
+    def _busy(self, host, url):
+        with self._lock:
+            host.counts['busy'] += 1
+        return ex.MaxRetryError(None, url, ex.EmptyPoolError(None, 'No free connection for {}'.format(url)))
+
+    def _begin(self, host):
+        with self._lock:
+            host.in_use += 1
+            host.counts['requests'] += 1
+
+    def _end(self, host):
+        with self._lock:
+            host.in_use -= 1
+
+    def _record(self, host, failed):
+        """
+        Updates the circuit of a host after a request, failed is None for the failures which
+        tell nothing about the host, e.g. no free connection.
+        """
+        with self._lock:
+            host.trial = False
+            if failed is None:
+                return
+            elif not failed:
+                host.failures = 0
+                host.opened = None
+                return
+            host.failures += 1
+            host.counts['failures'] += 1
+            if host.opened is not None or host.failures >= self.failure_threshold:
+                if host.opened is None:
+                    host.counts['opened'] += 1
+                host.opened = time.monotonic()
+
+    def clear(self):
+        with self._lock:
+            self._hosts.clear()
+
+    def stats(self):
+        """
+        Returns:
+            a dict of host -> dict of its counters, the requests in flight, the consecutive
+            failures and whether its circuit is open
+        """
+        with self._lock:
+            return dict(( key, dict(host.counts,
+                    in_use = host.in_use,
+                    consecutive_failures = host.failures,
+                    open = int(self.state(host) == OPEN)) ) for key, host in self._hosts.items())
+
+class AsyncValidationClient():
+    """
+    The HTTP client of url validation from async views, requesting through an
+    aio.AsyncPoolManager with the connection slots, circuits and counters of a
+    ValidationClient, so sync and async validations share the same limits and a circuit
+    opened by either fails both fast.
+
+    The slots are the ValidationClient's semaphores, taken without blocking the event loop
+    by polling every POLL_INTERVAL seconds for up to POOL_TIMEOUT.
+    """
+
+    POLL_INTERVAL = 0.01
+
+    def __init__(self, client, manager):
+        """
+        Args:
+            client:  the ValidationClient whose limits and circuits are shared
+            manager: the aio.AsyncPoolManager making the requests
+        """
+        self.client = client
+        self.manager = manager
+
+    async def request(self, method, url, timeout = None):
+        """
+        Requests a url like ValidationClient.request, without blocking the event loop.
+
+        Returns:
+            the aio.Response
+
+        Raises:
+            MaxRetryError: as ValidationClient.request
+        """
+        client = self.client
+        host = client.host(url)
+        client._admit(host, url)
+        failed = None
+        try:
+            async with self._slot(host.slots, host, url), self._slot(client.slots, host, url):
+                client._begin(host)
+                try:
+                    response = await self._request(host, method, url, timeout)
+                finally:
+                    client._end(host)
+            failed = False
+            return response
+        except ex.MaxRetryError as e:
+            if isinstance(e.reason, breaker_errors):
+                failed = True
+            raise
+        finally:
+            client._record(host, failed)
+
+    async def _request(self, host, method, url, timeout):
+        response = await self.manager.request(method, url, timeout = timeout)
+        if method == 'HEAD' and response.status in self.client.fallback_statuses:
+            with self.client._lock:
+                host.counts['fallbacks'] += 1
+            # only the status line and headers are read
+            response = await self.manager.request('GET', url, timeout = timeout)
+        return response
+
+    @asynccontextmanager
+    async def _slot(self, slots, host, url):
+        deadline = time.monotonic() + self.client.pool_timeout
+        while not slots.acquire(blocking = False):
+            if time.monotonic() >= deadline:
+                raise self.client._busy(host, url)
+            await asyncio.sleep(self.POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            slots.release()
@@ -0,0 +1,232 @@
+from django.conf import settings
+from django.db import transaction, DatabaseError
+from django.db.models import F, Case, When, Value, IntegerField, DateTimeField, ExpressionWrapper
+from django.utils import timezone
+
+from .sharding import shard_map
+
+from collections import Counter
+from threading import Lock, Thread, Event
+
+import abc
+import atexit
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+        'FLUSH_INTERVAL': 5.0,      # seconds of clicks a worker may lose if it is killed
+        'FLUSH_THRESHOLD': 1000,    # distinct links buffered before forcing a flush
+        'BATCH_SIZE': 300,          # links per UPDATE statement
+        'BACKGROUND': False,        # flush from a daemon thread, not only on the next click
+}
+
+class BufferedWriter(abc.ABC):
+    """
+    The buffering shared by the ClickCounter and urls.contrib.clicks.ClickLog. Subclasses
+    add to self._pending under self._lock and call added(), and define new_buffer(),
+    restore() and write(). The buffer is flushed once FLUSH_INTERVAL seconds have passed or
+    it holds FLUSH_THRESHOLD entries, from a daemon thread if BACKGROUND is set, and when the
+    worker exits.
+    """
+
+    name = 'buffered-writer'    # of the background thread, and in log messages
+
+    def __init__(self, options):
+        """
+        Args:
+            options: a dict with the FLUSH_INTERVAL, FLUSH_THRESHOLD, BATCH_SIZE and
+                     BACKGROUND options
+        """
+        self.interval   = options['FLUSH_INTERVAL']
+        self.threshold  = options['FLUSH_THRESHOLD']
+        self.batch_size = options['BATCH_SIZE']
+        self.background = options['BACKGROUND']
+        self.last_flush = time.monotonic()
+        self._pending = self.new_buffer()
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._thread = None
+        self._stopped = Event()
+        atexit.register(self.close)
+
+    @abc.abstractmethod
+    def new_buffer(self):
+        """
+        Returns:
+            an empty buffer
+        """
+
+    @abc.abstractmethod
+    def restore(self, pending):
+        """
+        Puts back the entries of a failed flush, called holding the lock.
+        """
+
+    @abc.abstractmethod
+    def write(self, pending):
+        """
+        Writes the entries of pending, removing the ones written so a failure only puts back
+        the others.
+        """
+
+    def added(self, flush = True):
+        """
+        Flushes if due, called after adding to the buffer.
+
+        Args:
+            flush: False to leave a due flush to the caller, e.g. from an async view
+
+        Returns:
+            whether a flush was due
+        """
+        with self._lock:
+            due = (self.interval <= 0
+                    or len(self._pending) >= self.threshold
+                    or time.monotonic() - self.last_flush >= self.interval)
+        if self.background and self.interval > 0 and self._thread is None:
+            self._start()
+        if due and flush:
+            self.try_flush()
+        return due
+
+    def flush(self):
+        """
+        Writes the pending entries to the database.
+
+        Returns:
+            the number of entries written
+
+        Raises:
+            DatabaseError: if the write failed, the entries are put back in the buffer
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, self.new_buffer()
+                self.last_flush = time.monotonic()
+            if not pending:
+                return 0
+            count = len(pending)
+            try:
+                self.write(pending)
+            except Exception:
+                with self._lock:
+                    self.restore(pending)
+                raise
+            return count
+
+    def try_flush(self):
+        """
+        Flushes, logging instead of raising database errors.
+        """
+        try:
+            return self.flush()
+        except DatabaseError:
+            logger.exception('Could not flush the %s', self.name)
+            return 0
+
+    def clear(self):
+        """
+        Discards the pending entries without writing them.
+        """
+        with self._lock:
+            self._pending.clear()
+
+    def close(self):
+        self._stopped.set()
+        try:
+            self.flush()
+        except DatabaseError:
+            logger.exception('Could not flush the %s on exit, %d clicks lost', self.name, self.pending())
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = Thread(target = self._run, name = self.name, daemon = True)
+        self._thread.start()
+
+    def _run(self):
+        from django.db import connection
+
+        while not self._stopped.wait(self.interval):
+            try:
+                self.try_flush()
+            finally:
+                connection.close()
+
+class ClickCounter(BufferedWriter):
+    """
+    Coalesces URLRedirect.times_used increments in memory so a click does not have to be a
+    database write. Pending increments are written as batched UPDATE ... CASE statements
+    once FLUSH_INTERVAL seconds have passed or FLUSH_THRESHOLD links are pending, and when
+    the worker exits.
+
+    Increments are added to the stored value rather than overwriting it, so any number of
+    workers can flush concurrently without losing clicks.
+    """
+
+    name = 'click-counter'
+
+    def __init__(self, options = None):
+        super().__init__(dict(DEFAULTS, **(options or {})))
+
+    def incr(self, pk, n = 1, flush = True):
+        """
+        Records n clicks on the URLRedirect with the primary key pk, flushing if due. A
+        failed flush is logged and the increments are kept for the next attempt.
+
+        Args:
+            flush: False to leave a due flush to the caller, e.g. from an async view
+
+        Returns:
+            whether a flush was due
+        """
+        with self._lock:
+            self._pending[pk] += n
+        return self.added(flush)
+
+    def pending(self, pk = None):
+        """
+        Returns:
+            the number of unflushed clicks for pk, or for every link if pk is None
+        """
+        with self._lock:
+            if pk is None:
+                return sum(self._pending.values())
+            return self._pending.get(pk, 0)
+
+    def new_buffer(self):
+        return Counter()
+
+    def restore(self, pending):
+        self._pending.update(pending)
+
+    def write(self, pending):
+        from ..models import URLRedirect
+
+        # one transaction per shard, the increments of a shard are removed from pending once
+        # committed so a failure only puts back the ones which were not written
+        now = timezone.now()
+        for shard, pks in shard_map.group(pending, shard_map.for_id).items():
+            items = [ ( pk, pending[pk] ) for pk in pks ]
+            using = shard_map.using(shard)
+            with transaction.atomic(using = using):
+                for idx in range(0, len(items), self.batch_size):
+                    batch = items[idx:idx + self.batch_size]
+                    URLRedirect.objects.using(using).filter(pk__in = [ pk for pk, n in batch ]).update(
+                            times_used = F('times_used') + Case(
+                                *[ When(pk = pk, then = Value(n)) for pk, n in batch ],
+                                default = Value(0),
+                                output_field = IntegerField()),
+                            # links expiring when idle were just clicked
+                            expires = Case(
+                                When(max_idle__isnull = False, then = ExpressionWrapper(
+                                    Value(now, output_field = DateTimeField()) + F('max_idle'),
+                                    output_field = DateTimeField())),
+                                default = F('expires')))
+            for pk in pks:
+                del pending[pk]
+
+click_counter = ClickCounter(getattr(settings, 'URLS_CLICK_COUNTER', None))
@@ -0,0 +1,116 @@
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .sharding import shard_map
+
+from datetime import timedelta
+
+import time
+
+DEFAULTS = {
+        'LIFETIME': None,       # seconds until a new link expires, None to keep it forever
+        'MAX_IDLE': None,       # seconds without a click until a new link expires, overrides LIFETIME
+        'GRACE': 3600,          # seconds an expired link is kept, so its last clicks are rolled up
+        'BATCH_SIZE': 500,      # links deleted per transaction
+        'SLEEP': 0.1,           # seconds between the batches of a purge
+        'REUSE_IDS': False,     # hand the ids of purged links out again
+        'REUSE_AFTER': 86400,   # seconds a purged id is held back before it is reused
+}
+
+def option(name):
+    return getattr(settings, 'URLS_EXPIRY', {}).get(name, DEFAULTS[name])
+
+def defaults(now = None):
+    """
+    Returns:
+        the expires and max_idle fields of a new link, according to the URLS_EXPIRY setting
+    """
+    now = now or timezone.now()
+    max_idle, lifetime = option('MAX_IDLE'), option('LIFETIME')
+    if max_idle is not None:
+        return { 'expires': now + timedelta(seconds = max_idle), 'max_idle': timedelta(seconds = max_idle) }
+    elif lifetime is not None:
+        return { 'expires': now + timedelta(seconds = lifetime), 'max_idle': None }
+    return { 'expires': None, 'max_idle': None }
+
+def is_expired(expires, now = None):
+    return expires is not None and expires <= (now or timezone.now())
+
+def entry(url, expires, permanent = None):
+    """
+    Returns:
+        the redirect cache entry of a link, the url alone for a link which never expires and 
+        follows the default redirect policy (urls.contrib.headers), else a (url, expiry 
+        timestamp) or (url, expiry timestamp or None, permanent) tuple
+    """
+    if permanent is not None:
+        return ( url, None if expires is None else expires.timestamp(), permanent )
+    return url if expires is None else ( url, expires.timestamp() )
+
+def read(entry):
+    """
+    Returns:
+        a (url, expiry timestamp or None, permanent or None) tuple for a redirect cache entry, 
+        or None if there is no entry or it was cached with a time which has passed, as the 
+        link may have been clicked since and be read again
+    """
+    if entry is None:
+        return None
+    if isinstance(entry, str):
+        return ( entry, None, None )
+    url, expires, permanent = entry if len(entry) == 3 else entry + ( None, )
+    if expires is not None and time.time() >= expires:
+        return None
+    return ( url, expires, permanent )
+
+def purge(batch_size = None, sleep = None, grace = None, limit = None, now = None):
+    """
+    Deletes the links which expired more than GRACE seconds ago, BATCH_SIZE at a time in
+    (expires, id) order, each batch in its own short transaction followed by SLEEP seconds so
+    the database is never locked for long. Deleting a link deletes its click rollups and
+    drops it from the redirect cache (urls.signals). With REUSE_IDS the ids are recorded as
+    FreeIds for the allocation of new links.
+
+    Args:
+        limit: the maximum number of links deleted, None for all
+        now:   the current time, for testing
+
+    Returns:
+        the number of links deleted
+    """
+    from ..models import URLRedirect, FreeId
+
+    batch_size = option('BATCH_SIZE') if batch_size is None else batch_size
+    sleep = option('SLEEP') if sleep is None else sleep
+    grace = option('GRACE') if grace is None else grace
+    now = now or timezone.now()
+    cutoff = now - timedelta(seconds = grace)
+
+    deleted = 0
+    for shard in shard_map:
+        redirects = URLRedirect.objects.db_manager(shard_map.using(shard) or router.db_for_write(URLRedirect))
+        last = None
+        while limit is None or deleted < limit:
+            expired = redirects.filter(expires__lte = cutoff)
+            if last is not None:
+                expired = expired.filter(Q(expires__gt = last[0]) | Q(expires = last[0], pk__gt = last[1]))
+            size = batch_size if limit is None else min(batch_size, limit - deleted)
+            rows = list(expired.order_by('expires', 'pk').values_list('expires', 'pk')[:size])
+            if not rows:
+                break
+            with transaction.atomic(using = redirects.db):
+                # a link clicked since it was read has a later expiry and is kept
+                pks = list(redirects
+                        .filter(pk__in = [ pk for expires, pk in rows ], expires__lte = cutoff)
+                        .values_list('pk', flat = True))
+                redirects.filter(pk__in = pks).delete()
+                if option('REUSE_IDS'):
+                    FreeId.objects.using(redirects.db).bulk_create(
+                            [ FreeId(id = pk, freed = now) for pk in pks ], ignore_conflicts = True)
+            deleted += len(pks)
+            last = rows[-1]
+            if sleep and len(rows) == size:
+                time.sleep(sleep)
+    return deleted
@@ -0,0 +1,81 @@
+from django.conf import settings
+from django.http import HttpResponseRedirect, HttpResponsePermanentRedirect
+from django.utils.cache import add_never_cache_headers, patch_cache_control, patch_response_headers
+from django.utils.http import quote_etag
+
+from threading import Lock
+
+import hashlib
+import time
+
+DEFAULTS = {
+        'PERMANENT': True,          # 301 for the links without a policy of their own, else 302
+        'MAX_AGE': 0,               # seconds browsers may reuse a redirect, their repeat clicks are not counted
+        'SHARED_MAX_AGE': None,     # seconds a CDN or reverse proxy may reuse it, None for MAX_AGE
+        'INDEX_MAX_AGE': 300,       # seconds the rendered index page is reused, by the server and browsers
+}
+
+def option(name):
+    return getattr(settings, 'URLS_HTTP_CACHE', {}).get(name, DEFAULTS[name])
+
+def is_permanent(permanent = None):
+    """
+    Returns:
+        whether a link redirects with 301 rather than 302, given its own policy or None
+    """
+    return option('PERMANENT') if permanent is None else permanent
+
+def redirect(url, permanent = None, expires = None):
+    """
+    Returns:
+        the redirect response of a link, with the caching headers of the URLS_HTTP_CACHE
+        setting. A link which expires is never cached past its expiry timestamp.
+    """
+    response = (HttpResponsePermanentRedirect if is_permanent(permanent) else HttpResponseRedirect)(url)
+    max_age = option('MAX_AGE')
+    shared = option('SHARED_MAX_AGE')
+    shared = max_age if shared is None else shared
+    if expires is not None:
+        remaining = max(0, int(expires - time.time()))
+        max_age, shared = min(max_age, remaining), min(shared, remaining)
+    if max_age <= 0 and shared <= 0:
+        # every click reaches the view and is counted, browsers cache a bare 301 forever
+        add_never_cache_headers(response)
+        return response
+    patch_response_headers(response, max_age)
+    patch_cache_control(response, public = True, s_maxage = shared)
+    return response
+
+class PageCache():
+    """
+    Pages which are the same for every visitor, rendered at most once every INDEX_MAX_AGE
+    seconds and identified by an ETag of their content.
+    """
+
+    def __init__(self):
+        self._pages = {}
+        self._lock = Lock()
+
+    def get(self, name, render):
+        """
+        Args:
+            name:   the key of the page, e.g. its template name
+            render: a callable returning the page as a str
+
+        Returns:
+            a (content, etag) tuple, content as bytes
+        """
+        now = time.monotonic()
+        page = self._pages.get(name)
+        if page is None or now >= page[0]:
+            content = render().encode('utf-8')
+            page = ( now + option('INDEX_MAX_AGE'), content, quote_etag(hashlib.md5(content).hexdigest()) )
+            with self._lock:
+                self._pages[name] = page
+        return page[1], page[2]
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+
+page_cache = PageCache()
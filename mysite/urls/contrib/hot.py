@@ -0,0 +1,223 @@
+from django.conf import settings
+from django.core.signals import request_started
+from django.db.models import Q
+from django.utils import timezone
+
+from .cache import redirect_cache
+from .sharding import shard_map
+from . import expiry
+
+from heapq import heapify, heappop, heappush
+from threading import Lock, Thread
+
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+        'WARM_UP': False,       # preload the redirect cache in the background on a worker's first request
+        'WARM_UP_USED': 1000,   # the most used links preloaded
+        'WARM_UP_RECENT': 1000, # the most recently created links preloaded
+        'TRACK': True,          # count clicks to find the hottest links
+        'CAPACITY': 200,        # links counted, the estimates are off by at most clicks / CAPACITY
+        'PINNED': 50,           # the hottest links pinned in the in-process tier of the redirect cache
+        'INTERVAL': 60,         # seconds between pinning the hottest links, counts are halved each time
+}
+
+def option(name):
+    return getattr(settings, 'URLS_HOT_LINKS', {}).get(name, DEFAULTS[name])
+
+class SpaceSaving():
+    """
+    The Space-Saving sketch of the most frequent keys of a stream, in at most capacity
+    counters. A key which is not counted replaces the one with the smallest count and
+    inherits it as its error, so a count overestimates the true count by at most its
+    error, and any key seen more than total / capacity times is counted.
+
+    The smallest count is found with a heap of (count, key) entries, pushed on every
+    increment and skipped when popped if the key has since been counted again or evicted.
+    The heap is rebuilt once it holds COMPACT times capacity entries, so a replacement
+    costs O(log capacity) amortized.
+    """
+
+    COMPACT = 4
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}    # key -> [ count, error ]
+        self.total = 0
+        self._heap = []     # (count, key), some stale
+
+    def __len__(self):
+        return len(self.counts)
+
+    def add(self, key, n = 1):
+        self.total += n
+        counter = self.counts.get(key)
+        if counter is not None:
+            counter[0] += n
+        elif len(self.counts) < self.capacity:
+            counter = self.counts[key] = [ n, 0 ]
+        else:
+            count = self._pop_smallest()
+            counter = self.counts[key] = [ count + n, count ]
+        heappush(self._heap, ( counter[0], key ))
+        if len(self._heap) > self.COMPACT * self.capacity:
+            self._rebuild()
+
+    def _pop_smallest(self):
+        """
+        Removes the key with the smallest count.
+
+        Returns:
+            its count
+        """
+        while True:
+            count, key = heappop(self._heap)
+            counter = self.counts.get(key)
+            if counter is not None and counter[0] == count:
+                del self.counts[key]
+                return count
+
+    def _rebuild(self):
+        self._heap = [ ( count, key ) for key, ( count, error ) in self.counts.items() ]
+        heapify(self._heap)
+
+    def decay(self):
+        """
+        Halves every count, so old traffic weighs less than new. Counters which reach 0 are
+        dropped.
+        """
+        self.total //= 2
+        for key, counter in list(self.counts.items()):
+            counter[0] //= 2
+            counter[1] //= 2
+            if not counter[0]:
+                del self.counts[key]
+        self._rebuild()
+
+    def top(self, n = None):
+        """
+        Returns:
+            a list of the (key, count, error) tuples of the n largest counts, largest first
+        """
+        ranked = sorted(self.counts.items(), key = lambda item: ( -item[1][0], item[0] ))
+        return [ ( key, count, error ) for key, ( count, error ) in ranked[:n] ]
+
+    def clear(self):
+        self.counts = {}
+        self.total = 0
+        self._heap = []
+
+class HotLinks():
+    """
+    Follows the links clicked most on this worker with a SpaceSaving sketch. Every INTERVAL
+    seconds the PINNED hottest are read from the shared tier of the redirect cache and pinned
+    in this worker's tier, so a burst of clicks on a few links never falls out of the LRU, and
+    the counts are halved so the ranking follows the current traffic.
+    """
+
+    def __init__(self, options = None):
+        options = dict(DEFAULTS, **(options or {}))
+        self.track    = options['TRACK']
+        self.pinned   = options['PINNED']
+        self.interval = options['INTERVAL']
+        self.sketch = SpaceSaving(options['CAPACITY'])
+        self.ticked = time.monotonic()
+        self._lock = Lock()
+
+    def add(self, pk, tick = True):
+        """
+        Counts a click on the URLRedirect with the primary key pk, pinning the hottest links 
+        if due.
+
+        Args:
+            tick: False to leave a due tick to the caller, e.g. from an async view
+
+        Returns:
+            whether a tick was due
+        """
+        if not self.track:
+            return False
+        with self._lock:
+            self.sketch.add(pk)
+            due = time.monotonic() - self.ticked >= self.interval
+            if due:
+                self.ticked = time.monotonic()
+        if due and tick:
+            self.tick()
+        return due
+
+    def tick(self):
+        """
+        Pins the hottest links in the redirect cache and halves the counts.
+        """
+        with self._lock:
+            hottest = [ pk for pk, count, error in self.sketch.top(self.pinned) ]
+            self.sketch.decay()
+        # links which are not in the shared tier are pinned once they have been read again
+        redirect_cache.pin(redirect_cache.get_shared_many(hottest))
+
+    def top(self, n = None):
+        with self._lock:
+            return self.sketch.top(n)
+
+    def clear(self):
+        with self._lock:
+            self.sketch.clear()
+            self.ticked = time.monotonic()
+
+hot_links = HotLinks(getattr(settings, 'URLS_HOT_LINKS', None))
+
+def warm_up(used = None, recent = None):
+    """
+    Loads the most used and the most recently created links into the redirect cache, the
+    shared tier and this worker's LRU, and pins the most used. Read in index order from
+    each shard, like the admin's sorted lists.
+
+    Returns:
+        the number of links loaded
+    """
+    from ..models import URLRedirect
+
+    used = option('WARM_UP_USED') if used is None else used
+    recent = option('WARM_UP_RECENT') if recent is None else recent
+    redirects = URLRedirect.objects.filter(Q(expires__isnull = True) | Q(expires__gt = timezone.now()))
+    fields = ( 'pk', 'original_url', 'expires', 'permanent' )
+    most_used = list(shard_map.fan_out(
+            redirects.order_by('-times_used', '-pk').values_list('times_used', *fields),
+            key = lambda row: ( -row[0], -row[1] ), limit = used)) if used else []
+    most_recent = list(shard_map.fan_out(
+            redirects.order_by('-created', '-pk').values_list('created', *fields),
+            key = lambda row: ( -row[0].timestamp(), -row[1] ), limit = recent)) if recent else []
+
+    urls = dict(( pk, expiry.entry(url, expires, permanent) ) for order, pk, url, expires, permanent in most_recent + most_used)
+    redirect_cache.set_many(urls)
+    redirect_cache.pin(dict(( row[1], urls[row[1]] ) for row in most_used[:hot_links.pinned]))
+    return len(urls)
+
+def _warm_up_on_start(sender, **kwargs):
+    from django.db import connection
+
+    # once per worker
+    request_started.disconnect(_warm_up_on_start, dispatch_uid = 'urls.hot.warm_up')
+
+    def run():
+        try:
+            count = warm_up()
+            logger.info('Warmed up the redirect cache with %d links', count)
+        except Exception:
+            logger.exception('Could not warm up the redirect cache')
+        finally:
+            connection.close()
+
+    Thread(target = run, name = 'warm-up', daemon = True).start()
+
+def connect():
+    """
+    Warms up the redirect cache in a background thread on the first request of a worker
+    when WARM_UP is set. Called by the app config.
+    """
+    if option('WARM_UP'):
+        request_started.connect(_warm_up_on_start, dispatch_uid = 'urls.hot.warm_up')
@@ -0,0 +1,240 @@
+from django.conf import settings
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+
+import time
+
+DEFAULTS = {
+        'SERVER_TIMING': True,                  # add a Server-Timing header to responses
+        'ALLOWED_IPS': [ '127.0.0.1', '::1' ],  # clients allowed to read /metrics/, None for any
+}
+
+# seconds, from a cached redirect to a slow HEAD request
+TIME_BUCKETS = ( 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0 )
+QUERY_BUCKETS = ( 0, 1, 2, 3, 5, 10, 25, 50, 100 )
+
+def option(name):
+    return getattr(settings, 'URLS_METRICS', {}).get(name, DEFAULTS[name])
+
+class Histogram():
+    """
+    A Prometheus style histogram of observations, thread safe. Observing costs a binary
+    search and an increment under a lock.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [ 0 ] * (len(self.buckets) + 1) # the last is +Inf
+        self.sum = 0
+        self.count = 0
+        self._lock = Lock()
+
+    def observe(self, value):
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[idx] += 1
+            self.sum += value
+            self.count += 1
+
+    def cumulative(self):
+        """
+        Returns:
+            a list of (upper bound, observations <= upper bound) tuples, ending with +Inf
+        """
+        with self._lock:
+            counts = list(self.counts)
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + ( float('inf'), ), counts):
+            total += count
+            result.append(( bound, total ))
+        return result
+
+class RequestMetrics():
+    """
+    The stage timings and query count of the current request.
+    """
+
+    def __init__(self, view = None):
+        self.view = view
+        self.timings = []
+        self.queries = 0
+
+class Registry():
+    """
+    Collects the histograms exposed at /metrics/, keyed by metric name and label values.
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self._lock = Lock()
+
+    def histogram(self, name, labels, buckets = TIME_BUCKETS):
+        key = ( name, labels )
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(key, Histogram(buckets))
+        return histogram
+
+    def observe(self, name, labels, value, buckets = TIME_BUCKETS):
+        """
+        Args:
+            name:   the metric name
+            labels: a tuple of (label, value) tuples
+            value:  the observation
+        """
+        self.histogram(name, labels, buckets).observe(value)
+
+    def clear(self):
+        with self._lock:
+            self.histograms.clear()
+
+    def render(self, gauges = ()):
+        """
+        Args:
+            gauges: an iterable of (name, labels, value) tuples to include
+
+        Returns:
+            the metrics in the Prometheus text exposition format
+        """
+        lines = []
+        last = None
+        for ( name, labels ), histogram in sorted(self.histograms.items(), key = lambda item: item[0]):
+            if name != last:
+                lines.append('# TYPE {} histogram'.format(name))
+                last = name
+            for bound, count in histogram.cumulative():
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('{}_bucket{} {}'.format(name, _labels(labels + (( 'le', le ),)), count))
+            lines.append('{}_sum{} {!r}'.format(name, _labels(labels), histogram.sum))
+            lines.append('{}_count{} {}'.format(name, _labels(labels), histogram.count))
+        for name, labels, value in gauges:
+            if name != last:
+                lines.append('# TYPE {} gauge'.format(name))
+                last = name
+            lines.append('{}{} {}'.format(name, _labels(labels), value))
+        return '\n'.join(lines) + '\n'
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+            for key, value in labels) + '}'
+
+registry = Registry()
+
+_current = ContextVar('urls_request_metrics', default = None)
+
+def begin(view = None):
+    """
+    Starts collecting the metrics of a request, in this thread or coroutine and the threads
+    it hands work to with sync_to_async.
+
+    Returns:
+        a token for end()
+    """
+    return _current.set(RequestMetrics(view))
+
+def current():
+    return _current.get()
+
+def end(token):
+    _current.reset(token)
+
+@contextmanager
+def timer(stage):
+    """
+    Times a stage of the current request. The duration is added to the Server-Timing header
+    and the urls_stage_seconds histogram. Does nothing outside of a request.
+
+    Args:
+        stage: a short name, e.g. 'validate'
+    """
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.timings.append(( stage, time.perf_counter() - start ))
+
+def count_query(execute, sql, params, many, context):
+    """
+    A database execute wrapper counting the queries of the current request, installed on
+    every connection by urls.signals.
+    """
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.queries += 1
+    return execute(sql, params, many, context)
+
+def record(metrics, total):
+    """
+    Adds the timings and query count of a finished request to the histograms.
+    """
+    view = ( ( 'view', metrics.view or 'none' ), )
+    registry.observe('urls_request_seconds', view, total)
+    registry.observe('urls_request_queries', view, metrics.queries, QUERY_BUCKETS)
+    for stage, seconds in metrics.timings:
+        registry.observe('urls_stage_seconds', view + (( 'stage', stage ),), seconds)
+
+def server_timing(metrics, total):
+    """
+    Returns:
+        the Server-Timing header value, durations in milliseconds
+    """
+    return ', '.join('{};dur={:.3f}'.format(stage, 1000 * seconds)
+            for stage, seconds in metrics.timings + [ ( 'total', total ) ])
+
+def gauges():
+    """
+    Returns:
+        a list of (name, labels, value) tuples describing the caches, the click counter, the
+        urllib3 connection pools and the hosts of the validation client
+    """
+    from .cache import redirect_cache
+    from .counters import click_counter
+    from .validation import validation_cache
+    from .bloom import id_filter
+    from . import urls, snapshot
+
+    result = []
+    for key, value in sorted(redirect_cache.stats().items()):
+        result.append(( 'urls_redirect_cache', (( 'stat', key ),), value ))
+    for key, value in sorted(validation_cache.stats().items()):
+        result.append(( 'urls_validation_cache', (( 'stat', key ),), value ))
+    if snapshot.snapshot is not None:
+        for key, value in sorted(snapshot.snapshot.stats().items()):
+            result.append(( 'urls_snapshot', (( 'stat', key ),), value ))
+    if id_filter.enabled:
+        for key, value in sorted(id_filter.stats().items()):
+            result.append(( 'urls_id_filter', (( 'stat', key ),), value ))
+    for function, stats in sorted(urls.memo_stats().items()):
+        for key, value in sorted(stats.items()):
+            result.append(( 'urls_memo', (( 'function', function ), ( 'stat', key )), value ))
+    result.append(( 'urls_click_counter_pending', (), click_counter.pending() ))
+    pools = getattr(urls.pool, 'pools', None) # absent when the pool is replaced in tests
+    if pools is not None:
+        result.append(( 'urls_http_pools', (), len(pools) ))
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = (( 'host', '{}://{}:{}'.format(pool.scheme, pool.host, pool.port) ),)
+            result.append(( 'urls_http_pool_connections', host, pool.num_connections ))
+            result.append(( 'urls_http_pool_requests', host, pool.num_requests ))
+            # the queue is padded with None up to its maxsize, only count open connections
+            idle = sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool else 0
+            result.append(( 'urls_http_pool_idle', host, idle ))
+    hosts = getattr(urls.pool, 'stats', None)
+    if hosts is not None:
+        for host, stats in sorted(hosts().items()):
+            for key, value in sorted(stats.items()):
+                result.append(( 'urls_validation_host', (( 'host', host ), ( 'stat', key )), value ))
+    return sorted(result, key = lambda gauge: gauge[0])
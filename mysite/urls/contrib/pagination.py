@@ -0,0 +1,159 @@
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections, DatabaseError
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+COUNT_LIMIT = 10000   # rows counted before giving up on an exact count
+CURSOR_VAR = 'after'
+
+def table_estimate(model, using):
+    """
+    Reads the number of rows in a table from the database statistics, without scanning it.
+
+    Returns:
+        the estimate, or None if the backend has no statistics for the table
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    if connection.vendor == 'postgresql':
+        sql = 'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass'
+    elif connection.vendor == 'mysql':
+        sql = 'SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s'
+    elif connection.vendor == 'sqlite':
+        # only written by ANALYZE, the first number of a stat is the rows in the table
+        sql = "SELECT CAST(stat AS INTEGER) FROM sqlite_stat1 WHERE tbl = %s AND stat != ''"
+    else:
+        return None
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [ table ])
+            row = cursor.fetchone()
+    except DatabaseError:
+        # e.g. sqlite_stat1 does not exist before the first ANALYZE
+        return None
+    # postgres reports -1 for a table which has never been analyzed
+    return row[0] if row and row[0] is not None and row[0] >= 0 else None
+
+class EstimatedCountPaginator(Paginator):
+    """
+    A Paginator which never scans a whole table to count it. An unfiltered queryset is
+    counted from the database statistics, others are counted up to COUNT_LIMIT rows.
+    approximate is True when the count is not exact.
+    """
+
+    approximate = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = table_estimate(queryset.model, queryset.db)
+            if estimate is not None and estimate >= COUNT_LIMIT:
+                self.approximate = True
+                return estimate
+        count = queryset.order_by()[:COUNT_LIMIT].count()
+        self.approximate = count >= COUNT_LIMIT
+        return count
+
+class KeysetChangeList(ChangeList):
+    """
+    A ChangeList which pages by the values of the ordering columns of the last row shown
+    (WHERE (created, id) < (last created, last id)) rather than by OFFSET, so every page costs
+    an index range scan however deep it is. The position is kept in the CURSOR_VAR query
+    parameter, pages are linked first and next by the pagination.html template of the model.
+
+    Orderings on other columns than KEYSET_FIELDS fall back to the numbered pages.
+    """
+
+    KEYSET_FIELDS = ( 'id', 'created', 'times_used' )
+
+    def __init__(self, request, *args, **kwargs):
+        self.cursor = request.GET.get(CURSOR_VAR)
+        self.next_cursor = None
+        super().__init__(request, *args, **kwargs)
+
+    def get_filters_params(self, params = None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_query_string(self, new_params = None, remove = None):
+        # a changed filter, search or ordering starts from the first page
+        remove = list(remove or [])
+        if CURSOR_VAR not in (new_params or {}):
+            remove.append(CURSOR_VAR)
+        return super().get_query_string(new_params, remove)
+
+    @property
+    def next_url(self):
+        return self.get_query_string({ CURSOR_VAR: self.next_cursor }) if self.next_cursor else None
+
+    @property
+    def first_url(self):
+        return self.get_query_string() if self.cursor else None
+
+    def keyset(self):
+        """
+        Returns:
+            a list of (field, descending) tuples for the ordering, or None if the ordering
+            cannot be paged by keys
+        """
+        keys = []
+        for ordering in self.queryset.query.order_by:
+            if not isinstance(ordering, str):
+                return None
+            name = ordering.lstrip('-')
+            name = 'id' if name == 'pk' else name
+            if name not in self.KEYSET_FIELDS:
+                return None
+            keys.append(( name, ordering.startswith('-') ))
+        if not keys or keys[-1][0] != 'id':
+            return None
+        return keys
+
+    def encode_cursor(self, keys, obj):
+        return ','.join(str(getattr(obj, name).isoformat() if name == 'created' else getattr(obj, name))
+                for name, descending in keys)
+
+    def decode_cursor(self, keys, cursor):
+        values = cursor.split(',')
+        if len(values) != len(keys):
+            raise ValueError(cursor)
+        return [ self.lookup_opts.get_field(name).to_python(value) for ( name, descending ), value in zip(keys, values) ]
+
+    def get_results(self, request):
+        keys = self.keyset()
+        if keys is None:
+            return super().get_results(request)
+
+        queryset = self.queryset
+        if self.cursor:
+            try:
+                values = self.decode_cursor(keys, self.cursor)
+            except (ValueError, ValidationError):
+                raise IncorrectLookupParameters
+            # rows after the cursor in the ordering: (a, b) > (x, y) is a > x or (a = x and b > y)
+            after, equal = Q(), {}
+            for ( name, descending ), value in zip(keys, values):
+                after |= Q(**dict(equal, **{ name + ('__lt' if descending else '__gt'): value }))
+                equal[name] = value
+            queryset = queryset.filter(after)
+
+        results = list(queryset[:self.list_per_page + 1])
+        if len(results) > self.list_per_page:
+            results = results[:self.list_per_page]
+            self.next_cursor = self.encode_cursor(keys, results[-1])
+
+        paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        self.result_count = paginator.count
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.full_result_count = None
+        self.result_list = results
+        self.can_show_all = False
+        # the numbered page links are replaced by first and next
+        self.multi_page = False
+        self.paginator = paginator
@@ -0,0 +1,151 @@
+from django.conf import settings
+from django.utils.functional import cached_property
+
+from .allocators import get_allocator, DEFAULTS as ALLOCATOR_DEFAULTS, MAX_INT
+from .urls import digest
+
+from collections import OrderedDict
+from heapq import merge
+
+DEFAULTS = {
+        'SHARDS': [ 'default' ],    # database aliases, each owning an equal range of ids
+}
+
+def option(name):
+    return getattr(settings, 'URLS_SHARDING', {}).get(name, DEFAULTS[name])
+
+class Shard():
+    """
+    A database holding the URLRedirects with ids in [start, end), and their clicks.
+    """
+
+    def __init__(self, index, alias, start, end):
+        self.index = index
+        self.alias = alias
+        self.start = start
+        self.end = end
+
+    def __repr__(self):
+        return 'Shard({!r}, [{}, {}))'.format(self.alias, self.start, self.end)
+
+    def __contains__(self, pk):
+        return self.start <= pk < self.end
+
+    @cached_property
+    def allocator(self):
+        """
+        The configured allocator, restricted to this shard's ids and sequence.
+        """
+        options = dict(ALLOCATOR_DEFAULTS, **getattr(settings, 'URLS_ID_ALLOCATOR', {}))
+        options['OPTIONS'] = dict(options['OPTIONS'],
+                max_value = self.end - self.start,
+                offset = self.start,
+                sequence = 'urlredirect' if self.index == 0 else 'urlredirect:' + self.alias,
+                using = self.alias)
+        return get_allocator(options)
+
+class ShardMap():
+    """
+    Splits the ids in [0, max_value) into equal ranges, one per database. As a short code
+    decodes to the id, the shard of a link is found from the code alone. Urls are owned by
+    the shard their digest maps to, where their links are created, so looking a url up only
+    ever queries one shard.
+
+    A single shard is the unsharded case, its alias is then returned as None so queries go
+    through the database routers as usual. The shards must not change once ids have been
+    allocated, the data would have to be moved to the new ranges.
+    """
+
+    def __init__(self, aliases, max_value = MAX_INT):
+        self.configure(aliases, max_value)
+
+    def configure(self, aliases, max_value = MAX_INT):
+        """
+        Replaces the shards in place, for the modules which imported the shard map.
+        """
+        span = max_value // len(aliases)
+        self.span = span
+        self.shards = [ Shard(idx, alias, idx * span, max_value if idx == len(aliases) - 1 else (idx + 1) * span)
+                for idx, alias in enumerate(aliases) ]
+
+    def __iter__(self):
+        return iter(self.shards)
+
+    def __len__(self):
+        return len(self.shards)
+
+    @property
+    def sharded(self):
+        return len(self.shards) > 1
+
+    @property
+    def aliases(self):
+        return [ shard.alias for shard in self.shards ]
+
+    def for_id(self, pk):
+        return self.shards[min(pk // self.span, len(self.shards) - 1)]
+
+    def for_url(self, url):
+        """
+        Args:
+            url: the canonicalized url
+
+        Returns:
+            the shard owning the url
+        """
+        return self.shards[int(digest(url)[:8], 16) % len(self.shards)]
+
+    def using(self, shard):
+        """
+        Returns:
+            the alias to pass to QuerySet.using() for the shard, None when unsharded
+        """
+        return shard.alias if self.sharded else None
+
+    def using_id(self, pk):
+        return self.using(self.for_id(pk))
+
+    def using_url(self, url):
+        return self.using(self.for_url(url))
+
+    def group(self, items, shard_for):
+        """
+        Args:
+            items:     an iterable
+            shard_for: a function returning the shard of an item
+
+        Returns:
+            an OrderedDict of each shard, in order, to a list of its items
+        """
+        groups = OrderedDict()
+        for item in items:
+            groups.setdefault(shard_for(item), []).append(item)
+        return OrderedDict((shard, groups[shard]) for shard in self.shards if shard in groups)
+
+    def fan_out(self, queryset, key = None, limit = None):
+        """
+        Runs a query on every shard and merges the results.
+
+        Args:
+            queryset: an ordered QuerySet
+            key:      a function returning the sort key of a result, matching the ordering of
+                      the queryset, or None to concatenate the shards in order, which keeps
+                      results ordered by id
+            limit:    the maximum number of results, read from each shard
+
+        Returns:
+            an iterator of the results
+        """
+        results = []
+        for shard in self.shards:
+            qs = queryset.using(self.using(shard))
+            results.append(qs[:limit].iterator() if limit is not None else qs.iterator())
+        if key is None:
+            merged = ( result for shard in results for result in shard )
+        else:
+            merged = merge(*results, key = key)
+        if limit is None:
+            return merged
+        return ( result for idx, result in zip(range(limit), merged) )
+
+shard_map = ShardMap(option('SHARDS'))
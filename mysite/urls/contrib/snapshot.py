@@ -0,0 +1,384 @@
+from django.conf import settings
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .sharding import shard_map
+from .urls import FAILED
+
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import timedelta
+from threading import Lock
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import json
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import uuid
+
+DEFAULTS = {
+        'ENABLED': False,
+        'PATH': None,               # the snapshot directory, required when enabled
+        'RELOAD_INTERVAL': 5.0,     # seconds between checks for a new manifest
+        'MAX_DELTAS': 16,           # delta segments written before the next full snapshot
+        'OVERLAP': 60,              # seconds of rows a delta repeats from the previous segment
+}
+
+MANIFEST = 'manifest.json'
+LOCK = 'manifest.lock'
+REVOKED = 'revoked'
+MAGIC = b'URLSNAP1'
+# magic, byte order ('<' or '>'), padding, the number of entries
+HEADER = struct.Struct('8sc7xQ')
+BYTE_ORDER = b'<' if sys.byteorder == 'little' else b'>'
+
+def option(name):
+    return getattr(settings, 'URLS_SNAPSHOT', {}).get(name, DEFAULTS[name])
+
+class Segment():
+    """
+    A read only, memory mapped file of sorted ids and their urls:
+
+        header | ids (uint32 * n) | offsets (uint64 * (n + 1)) | utf-8 urls
+
+    The url of ids[i] is blob[offsets[i]:offsets[i + 1]]. The file is mapped rather than
+    read, so every worker shares the same pages of the OS page cache.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        magic, byte_order, count = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or byte_order != BYTE_ORDER:
+            self._mmap.close()
+            raise ValueError('{} is not a snapshot segment for this platform'.format(path))
+        view = memoryview(self._mmap)
+        start = HEADER.size
+        self.ids = view[start:start + 4 * count].cast('I')
+        start += 4 * count
+        self.offsets = view[start:start + 8 * (count + 1)].cast('Q')
+        self.blob = start + 8 * (count + 1)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get(self, pk):
+        """
+        Returns:
+            the url for the id, or None if it is not in the segment
+        """
+        idx = bisect_left(self.ids, pk)
+        if idx == len(self.ids) or self.ids[idx] != pk:
+            return None
+        return self._mmap[self.blob + self.offsets[idx]:self.blob + self.offsets[idx + 1]].decode('utf-8')
+
+def write_segment(path, rows):
+    """
+    Writes a segment atomically.
+
+    Args:
+        path: the file to write
+        rows: an iterable of (id, url) tuples in ascending id order
+
+    Returns:
+        the number of entries written
+    """
+    directory = os.path.dirname(path)
+    ids = array('I')
+    offsets = array('Q', [ 0 ])
+    with tempfile.TemporaryFile(dir = directory) as blob:
+        for pk, url in rows:
+            data = url.encode('utf-8')
+            blob.write(data)
+            ids.append(pk)
+            offsets.append(offsets[-1] + len(data))
+        blob.seek(0)
+
+        fd, temp = tempfile.mkstemp(dir = directory, suffix = '.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, BYTE_ORDER, len(ids)))
+                ids.tofile(f)
+                offsets.tofile(f)
+                shutil.copyfileobj(blob, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp, path)
+        except BaseException:
+            os.unlink(temp)
+            raise
+    return len(ids)
+
+def read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+@contextmanager
+def locked(directory):
+    """
+    Serializes the read, modify and write of the manifest across processes, where fcntl is
+    available.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(directory, LOCK), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def write_manifest(directory, manifest):
+    fd, temp = tempfile.mkstemp(dir = directory, suffix = '.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(temp, os.path.join(directory, MANIFEST))
+
+def export(directory = None, full = False, max_deltas = None, overlap = None):
+    """
+    Exports the URLRedirects to the snapshot. A delta segment only holds the rows created
+    since the previous segment (and OVERLAP seconds before it, for transactions committed
+    late), a full snapshot replaces every segment and is written when there is none yet, on
+    request, after require_full, or once there are MAX_DELTAS deltas. Edited and deleted 
+    links, and links given an expiry, are revoked (see revoke) until the next full snapshot, 
+    which keeps the revocations written while it was being exported.
+
+    Returns:
+        a dict of the segment written, its kind ('full' or 'delta') and number of entries
+    """
+    from ..models import URLRedirect
+
+    directory = directory or option('PATH')
+    max_deltas = option('MAX_DELTAS') if max_deltas is None else max_deltas
+    overlap = option('OVERLAP') if overlap is None else overlap
+    os.makedirs(directory, exist_ok = True)
+
+    manifest = read_manifest(directory)
+    full = (full or manifest is None or 'full_requested' in manifest
+            or len(manifest['segments']) - 1 >= max_deltas)
+    generation = 1 if manifest is None else manifest['generation'] + 1
+    started = timezone.now()
+
+    # expiring links are left to the database, which knows when they were last clicked, and 
+    # the snapshot only holds urls so links with a redirect policy of their own are too. Links 
+    # which failed validation do not redirect
+    redirects = (URLRedirect.objects
+            .filter(expires__isnull = True, permanent__isnull = True)
+            .exclude(status__in = FAILED)
+            .order_by('pk'))
+    if not full:
+        redirects = redirects.filter(created__gte = parse_datetime(manifest['created']) - timedelta(seconds = overlap))
+    name = '{}-{:08d}.snap'.format('full' if full else 'delta', generation)
+    # the shards hold ascending ranges of ids, so reading them in turn keeps the rows sorted
+    count = write_segment(os.path.join(directory, name),
+            shard_map.fan_out(redirects.values_list('pk', 'original_url')))
+
+    read = [] if manifest is None else manifest['segments']
+    with locked(directory):
+        # revoked while exporting
+        manifest = read_manifest(directory)
+        old = [] if manifest is None else manifest['segments']
+        revoked = [ segment for segment in old if segment.startswith(REVOKED) and segment not in read ]
+        segments = revoked + ([ name ] if full else [ name ] + read) # newest first
+        new = {
+            'generation': 1 if manifest is None else manifest['generation'] + 1,
+            'created': started.isoformat(),
+            'segments': segments,
+        }
+        requested = None if manifest is None else manifest.get('full_requested')
+        if requested is not None and not (full and parse_datetime(requested) <= started):
+            # requested while exporting, the rows may have been missed
+            new['full_requested'] = requested
+        write_manifest(directory, new)
+    for segment in set(old) - set(segments):
+        try:
+            # workers that still map the file keep it until they reload
+            os.unlink(os.path.join(directory, segment))
+        except OSError:
+            pass
+    return { 'segment': name, 'kind': 'full' if full else 'delta', 'entries': count }
+
+def require_full(directory = None):
+    """
+    Makes the next export a full snapshot, e.g. after links were imported with the created 
+    time of their export, which is older than the last segment so no delta would hold them. 
+    Does nothing unless the snapshot is enabled or before the first export, which is full.
+
+    Returns:
+        whether a full snapshot was requested
+    """
+    directory = directory or (option('PATH') if option('ENABLED') else None)
+    if directory is None:
+        return False
+    with locked(directory):
+        manifest = read_manifest(directory)
+        if manifest is None:
+            return False
+        # the generation is left alone, the segments did not change
+        write_manifest(directory, dict(manifest, full_requested = timezone.now().isoformat()))
+    return True
+
+def revoke(pks, directory = None):
+    """
+    Revokes the entries of links which were edited or deleted, so they are read from the
+    database again. Writes a segment of empty urls for the ids in the snapshot, placed before
+    every other, which other workers load within RELOAD_INTERVAL seconds. Ids which are not
+    in the snapshot cost nothing.
+
+    Returns:
+        the number of entries revoked
+    """
+    reader = snapshot if directory is None else Snapshot(directory, 0)
+    if reader is None:
+        return 0
+    reader.reload()
+    pks = sorted(set(pk for pk in pks if reader.contains(pk)))
+    if not pks:
+        return 0
+    name = '{}-{}.snap'.format(REVOKED, uuid.uuid4().hex)
+    write_segment(os.path.join(reader.directory, name), [ ( pk, '' ) for pk in pks ])
+    with locked(reader.directory):
+        manifest = read_manifest(reader.directory)
+        if manifest is None:
+            os.unlink(os.path.join(reader.directory, name))
+            return 0
+        # created is left alone, the next delta holds the rows created since the last one
+        write_manifest(reader.directory, dict(manifest,
+                generation = manifest['generation'] + 1,
+                segments = [ name ] + manifest['segments']))
+    reader.reload()
+    return len(pks)
+
+class Revocation():
+    """
+    The ids revoked when a transaction commits, so a transaction editing or deleting many
+    links writes one segment.
+    """
+
+    def __init__(self):
+        self.pks = set()
+        self.done = False
+
+    def __call__(self):
+        self.done = True
+        revoke(self.pks)
+
+def revoke_on_commit(pk, using = None):
+    """
+    Revokes the entry of a link once the transaction editing or deleting it commits, right
+    away outside of a transaction. Does nothing unless the snapshot is enabled.
+    """
+    if snapshot is None:
+        return
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    if connection.in_atomic_block:
+        # joins the Revocation queued in the same savepoint, the hooks are (savepoint ids,
+        # callback, ...) tuples
+        for hook in connection.run_on_commit:
+            if isinstance(hook[1], Revocation) and not hook[1].done and hook[0] == set(connection.savepoint_ids):
+                hook[1].pks.add(pk)
+                return
+    revocation = Revocation()
+    revocation.pks.add(pk)
+    transaction.on_commit(revocation, using = using)
+
+class Snapshot():
+    """
+    Serves redirects from the segments of a snapshot directory, newest first. The manifest
+    is checked at most every RELOAD_INTERVAL seconds and the segments remapped when it
+    changes.
+    """
+
+    def __init__(self, directory, reload_interval = 5.0):
+        self.directory = directory
+        self.reload_interval = reload_interval
+        self.segments = []
+        self.hits = 0
+        self.misses = 0
+        self._generation = None
+        self._checked = float('-inf')
+        self._lock = Lock()
+
+    def get(self, pk):
+        """
+        Returns:
+            the url for the id, or None if it is not in the snapshot
+        """
+        if time.monotonic() - self._checked >= self.reload_interval:
+            self.reload()
+        for segment in self.segments:
+            url = segment.get(pk)
+            if url:
+                self.hits += 1
+                return url
+            elif url is not None:
+                # revoked
+                break
+        self.misses += 1
+        return None
+
+    def contains(self, pk):
+        """
+        Returns:
+            whether the id has an entry which has not been revoked
+        """
+        for segment in self.segments:
+            url = segment.get(pk)
+            if url is not None:
+                return bool(url)
+        return False
+
+    def reload(self):
+        """
+        Remaps the segments if the manifest changed.
+        """
+        with self._lock:
+            self._checked = time.monotonic()
+            manifest = read_manifest(self.directory)
+            if manifest is None or manifest['generation'] == self._generation:
+                return
+            segments = []
+            try:
+                for name in manifest['segments']:
+                    segments.append(Segment(os.path.join(self.directory, name)))
+            except FileNotFoundError:
+                # replaced by a newer snapshot while loading, try again on the next request
+                self._checked = float('-inf')
+                return
+            self.segments = segments
+            self._generation = manifest['generation']
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': sum(len(segment) for segment in self.segments),
+            'segments': len(self.segments),
+        }
+
+def get_snapshot():
+    """
+    Returns:
+        the Snapshot configured by URLS_SNAPSHOT, or None if it is disabled
+    """
+    if not option('ENABLED'):
+        return None
+    return Snapshot(option('PATH'), option('RELOAD_INTERVAL'))
+
+snapshot = get_snapshot()
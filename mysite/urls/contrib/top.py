@@ -0,0 +1,82 @@
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .clicks import truncate, DAY
+from .sharding import shard_map
+
+from datetime import timedelta
+
+TIMES_USED    = 'times_used'
+RECENT_CLICKS = 'recent_clicks'
+
+DEFAULTS = {
+        'SIZE': 100,    # links per ranking
+        'DAYS': 7,      # days of clicks counted by the RECENT_CLICKS ranking
+}
+
+def option(name):
+    return getattr(settings, 'URLS_TOP_LINKS', {}).get(name, DEFAULTS[name])
+
+def most_used(size):
+    """
+    Returns:
+        a list of (id, url, times used) tuples of the most used links, read from the
+        (times_used, id) index of each shard
+    """
+    from ..models import URLRedirect
+
+    queryset = URLRedirect.objects.order_by('-times_used', '-pk').values_list('pk', 'original_url', 'times_used')
+    return list(shard_map.fan_out(queryset, key = lambda row: ( -row[2], -row[0] ), limit = size))
+
+def most_clicked(size, days, now = None):
+    """
+    Returns:
+        a list of (id, url, clicks) tuples of the links clicked most in the last days,
+        summed from the daily click rollups
+    """
+    from ..models import URLRedirect, ClickRollup
+
+    since = truncate((now or timezone.now()).astimezone(timezone.utc), DAY) - timedelta(days = days - 1)
+    queryset = (ClickRollup.objects
+            .filter(period = DAY, start__gte = since)
+            .values('redirect_id')
+            .annotate(total = Sum('clicks'))
+            .order_by('-total', '-redirect_id')
+            .values_list('redirect_id', 'total'))
+    clicked = list(shard_map.fan_out(queryset, key = lambda row: ( -row[1], -row[0] ), limit = size))
+
+    urls = {}
+    for shard, pks in shard_map.group([ pk for pk, total in clicked ], shard_map.for_id).items():
+        urls.update(URLRedirect.objects
+                .using(shard_map.using(shard))
+                .filter(pk__in = pks)
+                .values_list('pk', 'original_url'))
+    return [ ( pk, urls[pk], total ) for pk, total in clicked if pk in urls ]
+
+def refresh(size = None, days = None, now = None):
+    """
+    Recomputes the rankings of the top links dashboard, replacing the previous ones in one
+    transaction. The queries read whole indexes, so this runs in the background (manage.py
+    refresh_top_links) rather than when the dashboard is viewed.
+
+    Returns:
+        the number of TopLinks written
+    """
+    from ..models import TopLink
+
+    size = option('SIZE') if size is None else size
+    days = option('DAYS') if days is None else days
+    rankings = {
+        TIMES_USED: most_used(size),
+        RECENT_CLICKS: most_clicked(size, days, now),
+    }
+    refreshed = timezone.now()
+    links = [ TopLink(kind = kind, rank = rank, link_id = pk, original_url = url, value = value, refreshed = refreshed)
+            for kind, rows in rankings.items()
+            for rank, ( pk, url, value ) in enumerate(rows, 1) ]
+    with transaction.atomic(using = router.db_for_write(TopLink)):
+        TopLink.objects.all().delete()
+        TopLink.objects.bulk_create(links)
+    return len(links)
@@ -0,0 +1,323 @@
+from django.db import router, transaction
+from django.utils.dateparse import parse_datetime, parse_duration
+from django.utils.duration import duration_iso_string
+
+from .urls import digest, VALID
+from .base_n import encode, decode
+from .sharding import shard_map
+from .bloom import id_filter
+from .cache import redirect_cache
+from . import snapshot
+
+import bz2
+import csv
+import gzip
+import io
+import json
+import lzma
+import sys
+import time
+
+JSONL = 'jsonl'
+CSV   = 'csv'
+
+GZIP  = 'gzip'
+BZIP2 = 'bz2'
+XZ    = 'xz'
+
+COMPRESSORS = {
+        GZIP: gzip.open,
+        BZIP2: bz2.open,
+        XZ: lzma.open,
+}
+
+EXTENSIONS = {
+        '.gz': GZIP,
+        '.bz2': BZIP2,
+        '.xz': XZ,
+}
+
+# the columns of an export, short is the encoded id and only read back if there is no id
+FIELDS = [ 'id', 'short', 'original_url', 'times_used', 'created', 'status', 'status_code', 'status_message', 
+        'expires', 'max_idle', 'permanent' ]
+COLUMNS = [ field for field in FIELDS if field != 'short' ]
+
+# the permanent flag as written to a CSV by csv.DictWriter, or by hand
+BOOLEANS = {
+        '': None,
+        'true': True,
+        'false': False,
+        '1': True,
+        '0': False,
+}
+
+SKIP   = 'skip'
+UPDATE = 'update'
+
+def compression_for(name):
+    """
+    Guesses the compression from a file name.
+
+    Returns:
+        GZIP, BZIP2, XZ or None
+    """
+    for extension, compression in EXTENSIONS.items():
+        if (name or '').lower().endswith(extension):
+            return compression
+    return None
+
+def format_for(name, default = JSONL):
+    """
+    Guesses the format from a file name, ignoring a compression extension.
+    """
+    name = (name or '').lower()
+    for extension in EXTENSIONS:
+        if name.endswith(extension):
+            name = name[:-len(extension)]
+    if name.endswith('.csv'):
+        return CSV
+    elif name.endswith('.jsonl') or name.endswith('.json'):
+        return JSONL
+    return default
+
+def open_file(name, mode = 'r', compression = None):
+    """
+    Opens a file for reading or writing text, - for stdin or stdout.
+
+    Args:
+        name:        the path, or -
+        mode:        'r' or 'w'
+        compression: GZIP, BZIP2, XZ or None for uncompressed
+
+    Returns:
+        a text file, which the caller closes unless it is sys.stdin or sys.stdout
+    """
+    if name == '-':
+        stream = sys.stdin if mode == 'r' else sys.stdout
+        if compression is None:
+            return stream
+        # closing the compressed file leaves the standard stream open
+        return io.TextIOWrapper(COMPRESSORS[compression](stream.buffer, mode + 'b'), encoding = 'utf-8', newline = '')
+    if compression is None:
+        return open(name, mode, encoding = 'utf-8', newline = '')
+    return COMPRESSORS[compression](name, mode + 't', encoding = 'utf-8', newline = '')
+
+class Progress():
+    """
+    Counts rows, calling report with the total and the rows per second at most every
+    interval seconds.
+    """
+
+    def __init__(self, report = None, interval = 5.0):
+        self.report = report
+        self.interval = interval
+        self.rows = 0
+        self.started = self._reported = time.monotonic()
+
+    @property
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return self.rows / elapsed if elapsed > 0 else 0.0
+
+    def add(self, n):
+        self.rows += n
+        if self.report is not None and time.monotonic() - self._reported >= self.interval:
+            self._reported = time.monotonic()
+            self.report(self.rows, self.rate)
+
+    def done(self):
+        if self.report is not None:
+            self.report(self.rows, self.rate)
+        return self.rows
+
+def iter_rows(chunk_size = 1000):
+    """
+    Reads every URLRedirect in id order, a chunk at a time. Chunks are paged by id (WHERE
+    id > last) rather than OFFSET, so every chunk is an index range scan and memory use does
+    not depend on the size of the table. Shards are read in turn.
+
+    Returns:
+        an iterator of dicts with the FIELDS
+    """
+    from ..models import URLRedirect
+
+    for shard in shard_map:
+        redirects = URLRedirect.objects.using(shard_map.using(shard)).order_by('pk').values_list(*COLUMNS)
+        last = -1
+        while True:
+            chunk = list(redirects.filter(pk__gt = last)[:chunk_size])
+            for row in chunk:
+                row = dict(zip(COLUMNS, row))
+                row['short'] = encode(row['id'])
+                row['created'] = row['created'].isoformat()
+                if row['expires'] is not None:
+                    row['expires'] = row['expires'].isoformat()
+                if row['max_idle'] is not None:
+                    row['max_idle'] = duration_iso_string(row['max_idle'])
+                yield row
+            if len(chunk) < chunk_size:
+                break
+            last = chunk[-1][0]
+
+def write_rows(stream, rows, format = JSONL, progress = None):
+    """
+    Writes rows as JSON lines or CSV with a header.
+
+    Returns:
+        the number of rows written
+    """
+    progress = progress or Progress()
+    if format == CSV:
+        writer = csv.DictWriter(stream, FIELDS)
+        writer.writeheader()
+        write = writer.writerow
+    else:
+        write = lambda row: stream.write(json.dumps(row) + '\n')
+    for row in rows:
+        write(row)
+        progress.add(1)
+    return progress.done()
+
+def export(stream, format = JSONL, chunk_size = 1000, progress = None):
+    """
+    Writes every URLRedirect to a stream.
+
+    Returns:
+        the number of rows written
+    """
+    return write_rows(stream, iter_rows(chunk_size), format, progress)
+
+def read_rows(lines, format = JSONL):
+    """
+    Reads the rows of an export.
+
+    Args:
+        lines:  an iterable of str, e.g. an open file
+        format: JSONL or CSV
+
+    Returns:
+        an iterator of dicts with the COLUMNS
+
+    Raises:
+        ValueError: if a row has neither an id nor a short code, or a field is invalid
+    """
+    rows = csv.DictReader(lines) if format == CSV else ( json.loads(line) for line in lines if line.strip() )
+    for number, row in enumerate(rows, 1):
+        try:
+            yield parse_row(row)
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError('Invalid row {}: {!r}'.format(number, e))
+
+def parse_row(row):
+    """
+    Converts the fields of a JSON row, or of a CSV row in which every field is a string.
+    """
+    if row.get('id') not in ( None, '' ):
+        id = int(row['id'])
+    else:
+        id = decode(row['short'])
+    created = row.get('created') or None
+    if created is not None:
+        created = parse_datetime(created)
+        if created is None:
+            raise ValueError('invalid created time {!r}'.format(row['created']))
+    expires = row.get('expires') or None
+    if expires is not None:
+        expires = parse_datetime(expires)
+        if expires is None:
+            raise ValueError('invalid expiry time {!r}'.format(row['expires']))
+    max_idle = row.get('max_idle') or None
+    if max_idle is not None:
+        max_idle = parse_duration(max_idle)
+        if max_idle is None:
+            raise ValueError('invalid max idle time {!r}'.format(row['max_idle']))
+    permanent = row.get('permanent')
+    if isinstance(permanent, str) and permanent.lower() in BOOLEANS:
+        # a CSV row
+        permanent = BOOLEANS[permanent.lower()]
+    elif permanent is not None and not isinstance(permanent, bool):
+        raise ValueError('invalid permanent flag {!r}'.format(permanent))
+    status_code = row.get('status_code')
+    parsed = {
+        'id': id,
+        'original_url': row['original_url'],
+        'times_used': int(row.get('times_used') or 0),
+        'status': row.get('status') or VALID,
+        'status_code': None if status_code in ( None, '' ) else int(status_code),
+        'status_message': row.get('status_message') or '',
+        'expires': expires,
+        'max_idle': max_idle,
+        'permanent': permanent,
+    }
+    if created is not None:
+        # otherwise the import time
+        parsed['created'] = created
+    return parsed
+
+def import_rows(rows, batch_size = 1000, mode = SKIP, progress = None):
+    """
+    Loads rows into the URLRedirect table in batches, one transaction per batch and shard.
+    Each batch costs one query for the ids which already exist, a bulk insert for the rest
+    and, when updating, a bulk update of the existing ones. New links only reach the 
+    snapshot with its next full export, see snapshot.require_full.
+
+    Args:
+        rows:       an iterable of dicts from read_rows
+        batch_size: rows per transaction
+        mode:       SKIP to keep the existing links with the same ids, UPDATE to overwrite them
+
+    Returns:
+        a dict of the number of rows created, updated and skipped
+    """
+    from ..models import URLRedirect
+
+    progress = progress or Progress()
+    counts = { 'created': 0, 'updated': 0, 'skipped': 0 }
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            _import_batch(URLRedirect, batch, mode, counts)
+            progress.add(len(batch))
+            batch = []
+    if batch:
+        _import_batch(URLRedirect, batch, mode, counts)
+        progress.add(len(batch))
+    progress.done()
+    if counts['created']:
+        # they keep their created time, which deltas select by
+        snapshot.require_full()
+    return counts
+
+def _clear_taken_hashes(redirects, objects):
+    """
+    Imports the links of a url which already has one, in the database or earlier in the 
+    batch, without a hash, as url_hash is unique. They keep redirecting by their own ids.
+    """
+    owners = dict(redirects
+            .filter(url_hash__in = [ obj.url_hash for obj in objects ])
+            .values_list('url_hash', 'pk'))
+    for obj in objects:
+        if owners.setdefault(obj.url_hash, obj.pk) != obj.pk:
+            obj.url_hash = None
+
+def _import_batch(URLRedirect, batch, mode, counts):
+    for shard, rows in shard_map.group(batch, lambda row: shard_map.for_id(row['id'])).items():
+        redirects = URLRedirect.objects.db_manager(shard_map.using(shard) or router.db_for_write(URLRedirect))
+        objects = dict(( row['id'], URLRedirect(url_hash = digest(row['original_url']), **row) ) for row in rows)
+        with transaction.atomic(using = redirects.db):
+            existing = set(redirects.filter(pk__in = list(objects)).values_list('pk', flat = True))
+            _clear_taken_hashes(redirects, [ obj for pk, obj in objects.items() if pk not in existing or mode == UPDATE ])
+            redirects.bulk_create([ obj for pk, obj in objects.items() if pk not in existing ])
+            if mode == UPDATE and existing:
+                redirects.bulk_update([ objects[pk] for pk in existing ],
+                        [ column for column in COLUMNS if column != 'id' ] + [ 'url_hash' ])
+        id_filter.add_many(pk for pk in objects if pk not in existing)
+        if mode == UPDATE and existing:
+            # bulk_update sends no post_save, see urls.signals
+            redirect_cache.delete_many(existing)
+            snapshot.revoke(existing)
+        counts['created'] += len(objects) - len(existing)
+        counts['updated' if mode == UPDATE else 'skipped'] += len(existing)
+        # rows repeating an id within the batch are only imported once
+        counts['skipped'] += len(rows) - len(objects)
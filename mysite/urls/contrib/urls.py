@@ -1,27 +1,74 @@
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
 from django.utils.translation import ugettext as _
 
 from w3lib.url import canonicalize_url
 from urllib3 import exceptions as ex
 
+from .aio import AsyncPoolManager
+from .client import ValidationClient, AsyncValidationClient, CircuitOpenError
+
+from functools import lru_cache
+
 import certifi
+import hashlib
 import urllib3
 
 allowed_schema = [ 'http', 'https' ]
-pool = urllib3.PoolManager(
+# built on first use, so importing this module does not need the settings configured
+pool = SimpleLazyObject(lambda: ValidationClient(
+        getattr(settings, 'URLS_VALIDATION', {}).get('CLIENT'), 
         cert_reqs = 'CERT_REQUIRED', 
-        ca_certs = certifi.where())
+        ca_certs = certifi.where()))
+async_pool = AsyncValidationClient(pool, AsyncPoolManager(ca_certs = certifi.where()))
 
 basic_error_msgs = {
         ex.NewConnectionError: 'We could not establish a connection to that site',
         ex.SSLError: 'There was a problem with the site\'s SSL certificate', 
         ex.MaxRetryError: 'The maximum number of retries was exceeded while trying to connect', 
         ex.EmptyPoolError: 'Please try again later', 
+        CircuitOpenError: 'That site is not responding, please try again later', 
+}
+
+PENDING     = 'pending'
+VALID       = 'valid'
+INVALID     = 'invalid'
+UNREACHABLE = 'unreachable'
+BAD_SSL     = 'bad_ssl'
+HTTP_ERROR  = 'http_error'
+
+# links which failed validation, they do not redirect until validated again
+FAILED = ( INVALID, UNREACHABLE, BAD_SSL, HTTP_ERROR )
+
+basic_error_statuses = {
+        ex.NewConnectionError: UNREACHABLE, 
+        ex.SSLError: BAD_SSL, 
+        ex.MaxRetryError: UNREACHABLE, 
+        ex.EmptyPoolError: UNREACHABLE, 
+        CircuitOpenError: UNREACHABLE, 
 }
 
+# failures of the host itself rather than of the url
+host_errors = ( ex.NewConnectionError, ex.SSLError )
+
 class ValidationError(Exception):
     
-    def __init__(self, message):
+    def __init__(self, message, status = INVALID, status_code = None, host_error = False):
         self.message = message
+        self.status = status
+        self.status_code = status_code
+        self.host_error = host_error
+
+def validate_scheme(url, allowed_schema = allowed_schema):
+    """
+    Checks the scheme of a url without accessing it.
+
+    Raises:
+        ValidationError: if the scheme is missing or not allowed
+    """
+    indexof = url.find('://')
+    if indexof == -1 or url[0:indexof] not in allowed_schema:
+        raise ValidationError(_('The scheme must be http or https'))
 
 def validate_url(url, allowed_schema = allowed_schema, timeout = 2.0):
     """
@@ -32,32 +79,64 @@ def validate_url(url, allowed_schema = allowed_schema, timeout = 2.0):
         allowed_schema: a collection of allowed schemas (ex: [ 'http', 'https' ])
 
     Raises:
-        ValidationError: with a descriptive message where possible, if the url was invalid
+        ValidationError: with a descriptive message where possible, if the url was invalid. 
+                         status is one of INVALID, UNREACHABLE, BAD_SSL or HTTP_ERROR, 
+                         status_code is the HTTP status if the site responded and 
+                         host_error is True if any url on the same host would fail
     """
-    indexof = url.find('://')
-    if indexof == -1 or url[0:indexof] not in allowed_schema:
-        raise ValidationError(_('The scheme must be http or https'))
-
-    str = None
+    validate_scheme(url, allowed_schema)
     try:
         response = pool.request('HEAD', url, timeout = timeout)
+    except urllib3.exceptions.MaxRetryError as e:
+        raise connection_error(e)
+    check_status(response.status)
+
+async def avalidate_url(url, allowed_schema = allowed_schema, timeout = 2.0):
+    """
+    Validates a url like validate_url, without blocking the event loop.
 
-        if response.status == 404:
-            str = _('The webpage could not be found')
-        elif response.status != 200:
-            str = _('The site returned the error code "') + str(response.status) + '"'
+    Raises:
+        ValidationError: as validate_url
+    """
+    validate_scheme(url, allowed_schema)
+    try:
+        response = await async_pool.request('HEAD', url, timeout = timeout)
     except urllib3.exceptions.MaxRetryError as e:
-        t = type(e.reason)
-        str = basic_error_msgs.get(t)
-        if not str:
-            if t == ex.ResponseError and str(e.reason) == 'too many redirects':
-                str = _('The maximum number of retries was exceeded while trying to connect')
-            else:
-                str = _('A problem occured, please try a different url')
-    if str:
-        raise ValidationError(str)
+        raise connection_error(e)
+    check_status(response.status)
 
-def canonicalize(url, default_scheme = 'http'):
+def check_status(status_code):
+    """
+    Raises:
+        ValidationError: if the HTTP status is not 200
+    """
+    if status_code == 404:
+        raise ValidationError(_('The webpage could not be found'), HTTP_ERROR, status_code)
+    elif status_code != 200:
+        raise ValidationError(
+                _('The site returned the error code "') + str(status_code) + '"', HTTP_ERROR, status_code)
+
+def connection_error(e):
+    """
+    Args:
+        e: the MaxRetryError raised while requesting a url
+
+    Returns:
+        the ValidationError describing its reason
+    """
+    t = type(e.reason)
+    message = basic_error_msgs.get(t)
+    if not message:
+        if t == ex.ResponseError and str(e.reason) == 'too many redirects':
+            message = _('The maximum number of retries was exceeded while trying to connect')
+        else:
+            message = _('A problem occured, please try a different url')
+    return ValidationError(message, basic_error_statuses.get(t, UNREACHABLE), None, issubclass(t, host_errors))
+
+MEMO_SIZE = 10000       # results remembered by canonicalize and hostname
+MEMO_MAX_LENGTH = 2048  # longer urls are not remembered, bounding the memory used
+
+def _canonicalize(url, default_scheme = 'http'):
     """
     Canonicalize the given url by applying the following procedures:
 
@@ -85,7 +164,7 @@ def canonicalize(url, default_scheme = 'http'):
         url = default_scheme + '://' + url
     return canonicalize_url(url, keep_fragments = True)
 
-def hostname(url):
+def _hostname(url):
     """
     Attempts to extract the hostname from the url.
 
@@ -102,3 +181,66 @@ def hostname(url):
     url = url[start:end]
     parts = url.split('.')
     return ' '.join(part.title() for part in reversed(parts) if len(part) > 3)
+
+_canonicalize_memo = lru_cache(maxsize = MEMO_SIZE)(_canonicalize)
+_hostname_memo = lru_cache(maxsize = MEMO_SIZE)(_hostname)
+
+def canonicalize(url, default_scheme = 'http'):
+    """
+    Canonicalizes a url like _canonicalize, remembering the results for recent urls.
+    """
+    if len(url) > MEMO_MAX_LENGTH:
+        return _canonicalize(url, default_scheme)
+    return _canonicalize_memo(url, default_scheme)
+
+def hostname(url):
+    """
+    Extracts the hostname like _hostname, remembering the results for recent urls.
+    """
+    if len(url) > MEMO_MAX_LENGTH:
+        return _hostname(url)
+    return _hostname_memo(url)
+
+def canonicalize_many(urls, default_scheme = 'http'):
+    """
+    Canonicalizes many urls, each distinct url only once and through the memo of 
+    canonicalize. The batch saves nothing more: w3lib parses every url on its own, so the 
+    parsed components of one url are not reused for another, e.g. on the same host.
+
+    Args:
+        urls:           an iterable of urls
+        default_scheme: if a scheme is not present
+
+    Returns:
+        a list of the canonicalized urls, in the same order as urls
+    """
+    urls = list(urls)
+    canonical = dict((url, canonicalize(url, default_scheme)) for url in dict.fromkeys(urls))
+    return [ canonical[url] for url in urls ]
+
+def memo_stats():
+    """
+    Returns:
+        a dict of the hits, misses and size of the canonicalize and hostname memos
+    """
+    stats = {}
+    for name, memo in ( ( 'canonicalize', _canonicalize_memo ), ( 'hostname', _hostname_memo ) ):
+        info = memo.cache_info()
+        stats[name] = { 'hits': info.hits, 'misses': info.misses, 'size': info.currsize }
+    return stats
+
+def clear_memos():
+    _canonicalize_memo.cache_clear()
+    _hostname_memo.cache_clear()
+
+def digest(url):
+    """
+    A fixed width digest of a url, used to index urls instead of the urls themselves.
+
+    Args:
+        url: the canonicalized url
+
+    Returns:
+        the 128 bit blake2b digest of the url as 32 hex characters
+    """
+    return hashlib.blake2b(url.encode('utf-8'), digest_size = 16).hexdigest()
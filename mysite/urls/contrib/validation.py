@@ -0,0 +1,259 @@
+from django.conf import settings
+from django.db import connection
+
+from .urls import validate_url, avalidate_url, ValidationError, PENDING, VALID, UNREACHABLE, FAILED
+from .cache import LRUCache, redirect_cache
+from .sharding import shard_map
+from . import snapshot
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+SYNC   = 'sync'     # validate inside CreateURLView.post, invalid urls are never stored
+THREAD = 'thread'   # store as pending and validate in this process' thread pool
+QUEUE  = 'queue'    # store as pending, the validate_pending command drains them
+
+DEFAULTS = {
+        'MODE': SYNC,
+        'WORKERS': 8,       # concurrent validations, per process for THREAD, per command for QUEUE
+        'TIMEOUT': 2.0,     # seconds to wait for the HEAD request
+        'CACHE': {},
+        'CLIENT': {},       # the limits and circuit breaker of the HTTP client, see urls.contrib.client
+}
+
+CACHE_DEFAULTS = {
+        'SIZE': 10000,              # urls remembered
+        'POSITIVE_TIMEOUT': 60 * 60,# seconds a valid url is not checked again
+        'NEGATIVE_TIMEOUT': 60,     # seconds an invalid url is not checked again
+        'HOST_SIZE': 1000,          # hosts remembered
+        'HOST_TIMEOUT': 60 * 5,     # seconds a host with a bad certificate or no connection is skipped
+}
+
+_executor = None
+
+def option(name):
+    return getattr(settings, 'URLS_VALIDATION', {}).get(name, DEFAULTS[name])
+
+def mode():
+    return option('MODE')
+
+class ValidationCache():
+    """
+    Remembers validation outcomes so popular urls are not requested over and over. Valid
+    and invalid outcomes expire separately, and connection level failures (no connection,
+    bad SSL certificate) are also remembered per host so no other url on that host is
+    requested until they expire.
+    """
+
+    def __init__(self, options = None):
+        options = dict(CACHE_DEFAULTS, **(options or {}))
+        self.positive_timeout = options['POSITIVE_TIMEOUT']
+        self.negative_timeout = options['NEGATIVE_TIMEOUT']
+        self.host_timeout     = options['HOST_TIMEOUT']
+        self.urls  = LRUCache(options['SIZE'])
+        self.hosts = LRUCache(options['HOST_SIZE'])
+
+    def host(self, url):
+        parts = urlsplit(url)
+        return parts.scheme + '://' + parts.netloc
+
+    def get(self, url):
+        """
+        Returns:
+            the cached outcome for the url or its host, or None
+        """
+        result = self.urls.get(url)
+        if result is None:
+            result = self.hosts.get(self.host(url))
+        return result
+
+    def set(self, url, result, host_error = False):
+        if result['status'] == VALID:
+            self.urls.set(url, result, self.positive_timeout)
+        else:
+            self.urls.set(url, result, self.negative_timeout)
+        if host_error:
+            self.hosts.set(self.host(url), result, self.host_timeout)
+
+    def clear(self):
+        self.urls.clear()
+        self.hosts.clear()
+
+    def stats(self):
+        return {
+            'url_hits': self.urls.hits,
+            'host_hits': self.hosts.hits,
+            'misses': self.hosts.misses, # the host tier is only consulted on a url miss
+            'requests_saved': self.urls.hits + self.hosts.hits,
+        }
+
+validation_cache = ValidationCache(option('CACHE'))
+
+def check(url):
+    """
+    Validates a url, returning the outcome instead of raising it. Outcomes are read from and 
+    stored in the validation cache.
+
+    Returns:
+        a dict of the status, status_code and status_message fields of a URLRedirect
+    """
+    result = validation_cache.get(url)
+    if result is not None:
+        return result
+    try:
+        validate_url(url, timeout = option('TIMEOUT'))
+    except ValidationError as e:
+        return _failed(url, e)
+    return _passed(url)
+
+async def acheck(url):
+    """
+    Validates a url like check, without blocking the event loop.
+    """
+    result = validation_cache.get(url)
+    if result is not None:
+        return result
+    try:
+        await avalidate_url(url, timeout = option('TIMEOUT'))
+    except ValidationError as e:
+        return _failed(url, e)
+    return _passed(url)
+
+def _passed(url):
+    result = {
+        'status': VALID,
+        'status_code': 200,
+        'status_message': '',
+    }
+    validation_cache.set(url, result)
+    return result
+
+def _failed(url, e):
+    result = {
+        'status': e.status,
+        'status_code': e.status_code,
+        'status_message': e.message,
+    }
+    # timeouts and exhausted pools may well succeed on the next attempt
+    if e.status != UNREACHABLE or e.host_error:
+        validation_cache.set(url, result, e.host_error)
+    return result
+
+def _raise_for(result):
+    if result['status'] != VALID:
+        raise ValidationError(result['status_message'], result['status'], result['status_code'])
+
+def validate(url):
+    """
+    Validates a url like urls.contrib.urls.validate_url, through the validation cache.
+
+    Raises:
+        ValidationError: if the url was invalid
+    """
+    _raise_for(check(url))
+
+async def avalidate(url):
+    """
+    Validates a url like validate, without blocking the event loop.
+    """
+    _raise_for(await acheck(url))
+
+def store(pk, result):
+    """
+    Records the outcome of a validation, unless the link was validated in the meantime. A 
+    link which failed is dropped from the redirect cache and the snapshot, as it no longer 
+    redirects.
+    """
+    from ..models import URLRedirect
+
+    using = shard_map.using_id(pk)
+    updated = URLRedirect.objects.using(using).filter(pk = pk, status = PENDING).update(**result)
+    if updated and result['status'] in FAILED:
+        redirect_cache.delete(pk)
+        snapshot.revoke_on_commit(pk, using)
+    return updated
+
+def retry(redirect, result = None):
+    """
+    Gives a link which failed validation another chance when its url is shortened again.
+
+    Args:
+        redirect: the URLRedirect, updated in place
+        result:   the outcome of validating its url just now, or None to mark it pending 
+                  and have it validated again
+
+    Returns:
+        whether the link was updated, it is not if it was validated in the meantime
+    """
+    from ..models import URLRedirect
+
+    result = result or { 'status': PENDING, 'status_code': None, 'status_message': '' }
+    updated = (URLRedirect.objects
+            .using(shard_map.using_id(redirect.pk))
+            .filter(pk = redirect.pk, status = redirect.status)
+            .update(**result))
+    if updated:
+        for name, value in result.items():
+            setattr(redirect, name, value)
+    return updated
+
+def submit(pk, url):
+    """
+    Validates a pending link in the background thread pool.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers = option('WORKERS'))
+    return _executor.submit(_validate, pk, url)
+
+def _validate(pk, url):
+    try:
+        store(pk, check(url))
+    except Exception:
+        logger.exception('Could not validate %s', url)
+    finally:
+        connection.close()
+
+def drain(limit = None, workers = None, chunk_size = 100):
+    """
+    Validates pending links. HEAD requests run concurrently in a thread pool, the database
+    is only accessed from the calling thread.
+
+    Args:
+        limit:      the maximum number of links to validate, or None for all
+        workers:    the number of concurrent requests, defaults to the WORKERS option
+        chunk_size: links fetched per query
+
+    Returns:
+        the number of links validated
+    """
+    from ..models import URLRedirect
+
+    done = 0
+    shards = iter(shard_map)
+    shard = next(shards)
+    last = -1
+    with ThreadPoolExecutor(max_workers = workers or option('WORKERS')) as executor:
+        while limit is None or done < limit:
+            size = chunk_size if limit is None else min(chunk_size, limit - done)
+            rows = list(URLRedirect.objects
+                    .using(shard_map.using(shard))
+                    .filter(status = PENDING, pk__gt = last)
+                    .order_by('pk')
+                    .values_list('pk', 'original_url')[:size])
+            if not rows:
+                # the shards are read in turn
+                shard = next(shards, None)
+                if shard is None:
+                    break
+                last = -1
+                continue
+            for ( pk, url ), result in zip(rows, executor.map(check, [ url for pk, url in rows ])):
+                store(pk, result)
+            done += len(rows)
+            last = rows[-1][0]
+    return done
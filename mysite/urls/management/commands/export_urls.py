@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from urls.contrib import transfer
+
+import sys
+
+class Command(BaseCommand):
+    help = ('Writes every shortened url, with its short code, as JSON lines or CSV. The table is '
+            'read a chunk at a time so memory use does not grow with its size.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', nargs = '?', default = '-', 
+                help = 'the output file, - for stdout')
+        parser.add_argument('--format', choices = [ transfer.JSONL, transfer.CSV ], 
+                help = 'the output format, guessed from the file extension by default')
+        parser.add_argument('--compress', choices = list(transfer.COMPRESSORS), 
+                help = 'the compression, guessed from the file extension by default')
+        parser.add_argument('--chunk-size', type = int, default = 1000, 
+                help = 'rows read per query')
+        parser.add_argument('--progress', type = float, default = 5.0, metavar = 'SECONDS', 
+                help = 'seconds between progress reports on stderr')
+
+    def handle(self, *args, **options):
+        format = options['format'] or transfer.format_for(options['file'])
+        compression = options['compress'] or transfer.compression_for(options['file'])
+        progress = transfer.Progress(self.report, options['progress'])
+        stream = transfer.open_file(options['file'], 'w', compression)
+        try:
+            transfer.export(stream, format, options['chunk_size'], progress)
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+
+    def report(self, rows, rate):
+        self.stderr.write('Exported {} urls ({:.0f} rows/s)'.format(rows, rate))
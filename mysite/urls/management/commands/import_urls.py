@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from urls.contrib import transfer
+
+import sys
+
+class Command(BaseCommand):
+    help = ('Loads shortened urls written by export_urls, keeping their ids and short codes. Rows '
+            'are inserted in batches, one transaction per batch.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', nargs = '?', default = '-', 
+                help = 'the input file, - for stdin')
+        parser.add_argument('--format', choices = [ transfer.JSONL, transfer.CSV ], 
+                help = 'the input format, guessed from the file extension by default')
+        parser.add_argument('--compress', choices = list(transfer.COMPRESSORS), 
+                help = 'the compression, guessed from the file extension by default')
+        parser.add_argument('--batch-size', type = int, default = 1000, 
+                help = 'rows per transaction')
+        parser.add_argument('--update', action = 'store_true', 
+                help = 'overwrite the existing urls with the same ids, rather than skipping them')
+        parser.add_argument('--progress', type = float, default = 5.0, metavar = 'SECONDS', 
+                help = 'seconds between progress reports on stderr')
+
+    def handle(self, *args, **options):
+        format = options['format'] or transfer.format_for(options['file'])
+        compression = options['compress'] or transfer.compression_for(options['file'])
+        progress = transfer.Progress(self.report, options['progress'])
+        mode = transfer.UPDATE if options['update'] else transfer.SKIP
+        stream = transfer.open_file(options['file'], 'r', compression)
+        try:
+            counts = transfer.import_rows(transfer.read_rows(stream, format), options['batch_size'], mode, progress)
+        except ValueError as e:
+            raise CommandError(e)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        self.stdout.write('Created {created}, updated {updated} and skipped {skipped} urls'.format(**counts))
+
+    def report(self, rows, rate):
+        self.stderr.write('Imported {} urls ({:.0f} rows/s)'.format(rows, rate))
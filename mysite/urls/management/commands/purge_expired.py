@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from urls.contrib import expiry
+
+import time
+
+class Command(BaseCommand):
+    help = ('Deletes the expired links in small batches, pausing between batches so the database '
+            'is never locked for long.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type = int, default = None, 
+                help = 'links deleted per transaction, defaults to the URLS_EXPIRY BATCH_SIZE')
+        parser.add_argument('--sleep', type = float, default = None, 
+                help = 'seconds between batches, defaults to the URLS_EXPIRY SLEEP')
+        parser.add_argument('--limit', type = int, default = None, 
+                help = 'the maximum number of links deleted')
+        parser.add_argument('--loop', type = float, default = None, metavar = 'SECONDS', 
+                help = 'keep purging every SECONDS')
+
+    def handle(self, *args, **options):
+        while True:
+            count = expiry.purge(options['batch_size'], options['sleep'], limit = options['limit'])
+            self.stdout.write('Purged {} expired links'.format(count))
+            if options['loop'] is None:
+                break
+            time.sleep(options['loop'])
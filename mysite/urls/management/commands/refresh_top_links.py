@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from urls.contrib import top
+
+import time
+
+class Command(BaseCommand):
+    help = 'Recomputes the most used and most clicked links shown on the admin dashboard.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type = int, default = None, 
+                help = 'links per ranking, defaults to the URLS_TOP_LINKS SIZE')
+        parser.add_argument('--days', type = int, default = None, 
+                help = 'days of clicks ranked, defaults to the URLS_TOP_LINKS DAYS')
+        parser.add_argument('--loop', type = float, default = None, metavar = 'SECONDS', 
+                help = 'keep refreshing every SECONDS')
+
+    def handle(self, *args, **options):
+        while True:
+            count = top.refresh(options['size'], options['days'])
+            self.stdout.write('Refreshed {} top links'.format(count))
+            if options['loop'] is None:
+                break
+            time.sleep(options['loop'])
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from urls.contrib import clicks
+
+import time
+
+class Command(BaseCommand):
+    help = 'Aggregates click events into hourly and daily counts per link.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type = int, default = 5000, 
+                help = 'the number of events rolled up per transaction')
+        parser.add_argument('--prune', action = 'store_true', 
+                help = 'delete the events once they have been rolled up')
+        parser.add_argument('--loop', type = float, default = None, metavar = 'SECONDS', 
+                help = 'keep rolling up, sleeping for SECONDS when there is nothing to do')
+
+    def handle(self, *args, **options):
+        while True:
+            total = 0
+            done = clicks.rollup(batch_size = options['batch_size'])
+            while done:
+                total += done
+                done = clicks.rollup(batch_size = options['batch_size'])
+            self.stdout.write('Rolled up {} clicks'.format(total))
+            if options['prune']:
+                self.stdout.write('Pruned {} clicks'.format(clicks.prune()))
+            if options['loop'] is None:
+                break
+            time.sleep(options['loop'])
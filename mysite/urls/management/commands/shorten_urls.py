@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.urls import reverse
+
+from urls.contrib import bulk
+
+import json
+import sys
+
+class Command(BaseCommand):
+    help = 'Shortens the urls in a JSON, CSV or text file, writing a JSON object per url to stdout.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', nargs = '?', default = '-', 
+                help = 'the input file, - for stdin')
+        parser.add_argument('--format', choices = [ bulk.JSON, bulk.CSV, bulk.TEXT ], 
+                help = 'the input format, guessed from the file extension by default')
+        parser.add_argument('--base-url', default = '', 
+                help = 'prepended to the path of each short url (ex: https://example.com)')
+        parser.add_argument('--chunk-size', type = int, default = 500)
+        parser.add_argument('--workers', type = int, default = None, 
+                help = 'the number of concurrent validations')
+
+    def handle(self, *args, **options):
+        format = options['format'] or bulk.format_for(options['file'])
+        stream = sys.stdin if options['file'] == '-' else open(options['file'], encoding = 'utf-8')
+        try:
+            urls = bulk.read_urls(stream, format)
+            results = bulk.shorten_many(urls, options['chunk_size'], options['workers'])
+            for result in results:
+                if result['success']:
+                    result['result'] = options['base_url'] + reverse('urls:redirect', args = ( result['short'], ))
+                self.stdout.write(json.dumps(result))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
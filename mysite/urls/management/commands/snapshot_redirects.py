@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from urls.contrib import snapshot
+
+import time
+
+class Command(BaseCommand):
+    help = ('Writes the shortened urls to the memory mapped snapshot read by the redirect view, '
+            'as a delta of the urls created since the last run unless a full snapshot is due.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default = None, 
+                help = 'the snapshot directory, defaults to the URLS_SNAPSHOT PATH')
+        parser.add_argument('--full', action = 'store_true', 
+                help = 'replace every segment with a full snapshot')
+        parser.add_argument('--loop', type = float, default = None, metavar = 'SECONDS', 
+                help = 'keep writing deltas every SECONDS')
+
+    def handle(self, *args, **options):
+        full = options['full']
+        while True:
+            result = snapshot.export(options['path'], full = full)
+            self.stdout.write('Wrote {entries} urls to the {kind} segment {segment}'.format(**result))
+            if options['loop'] is None:
+                break
+            full = False
+            time.sleep(options['loop'])
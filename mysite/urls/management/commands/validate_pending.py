@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from urls.contrib import validation
+
+import time
+
+class Command(BaseCommand):
+    help = 'Validates shortened urls which are pending, see the URLS_VALIDATION setting.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type = int, default = None, 
+                help = 'the maximum number of urls to validate')
+        parser.add_argument('--workers', type = int, default = None, 
+                help = 'the number of concurrent requests')
+        parser.add_argument('--loop', type = float, default = None, metavar = 'SECONDS', 
+                help = 'keep draining the queue, sleeping for SECONDS when it is empty')
+
+    def handle(self, *args, **options):
+        while True:
+            done = validation.drain(limit = options['limit'], workers = options['workers'])
+            self.stdout.write('Validated {} urls'.format(done))
+            if options['loop'] is None:
+                break
+            if not done:
+                time.sleep(options['loop'])
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from urls.contrib import hot
+
+class Command(BaseCommand):
+    help = 'Loads the most used and the most recently created links into the redirect cache.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--used', type = int, default = None, 
+                help = 'most used links loaded, defaults to the URLS_HOT_LINKS WARM_UP_USED')
+        parser.add_argument('--recent', type = int, default = None, 
+                help = 'most recently created links loaded, defaults to the URLS_HOT_LINKS WARM_UP_RECENT')
+
+    def handle(self, *args, **options):
+        count = hot.warm_up(options['used'], options['recent'])
+        self.stdout.write('Loaded {} links into the redirect cache'.format(count))
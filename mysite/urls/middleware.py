@@ -0,0 +1,160 @@
+from django.urls import resolve, Resolver404
+
+from asgiref.sync import markcoroutinefunction, async_to_sync, sync_to_async
+
+from . import routers
+from .contrib import metrics
+
+import asyncio
+import time
+
+class MetricsMiddleware():
+    """
+    Times every request and counts its queries. The stages timed by the views with
+    urls.contrib.metrics.timer are returned in a Server-Timing header, and everything is
+    collected into the histograms served by MetricsView.
+
+    Runs natively in both WSGI and ASGI handlers, so the async views are not pushed into a
+    thread.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.server_timing = metrics.option('SERVER_TIMING')
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        token = metrics.begin()
+        try:
+            start = time.perf_counter()
+            response = self.get_response(request)
+            return self.finish(request, response, metrics.current(), time.perf_counter() - start)
+        finally:
+            metrics.end(token)
+
+    async def __acall__(self, request):
+        token = metrics.begin()
+        try:
+            start = time.perf_counter()
+            response = await self.get_response(request)
+            return self.finish(request, response, metrics.current(), time.perf_counter() - start)
+        finally:
+            metrics.end(token)
+
+    def finish(self, request, response, current, total):
+        # read after the view rather than in process_view, which an async handler would
+        # call from a thread
+        match = getattr(request, 'resolver_match', None)
+        if match is not None:
+            current.view = match.url_name
+        metrics.record(current, total)
+        if self.server_timing:
+            response['Server-Timing'] = metrics.server_timing(current, total)
+        return response
+
+class ReplicaPinMiddleware():
+    """
+    Scopes the state of urls.routers.ReplicaRouter to each request, and sets a short lived 
+    cookie on the responses to requests which wrote to the database so the client's next 
+    requests read from the primary.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        token = routers.begin(request)
+        try:
+            return self.finish(request, self.get_response(request), routers.current())
+        finally:
+            routers.end(token)
+
+    async def __acall__(self, request):
+        token = routers.begin(request)
+        try:
+            return self.finish(request, await self.get_response(request), routers.current())
+        finally:
+            routers.end(token)
+
+    def finish(self, request, response, state):
+        # clicks flushed by a redirect are writes too, only pin clients which asked to write
+        if state.written and request.method not in routers.SAFE_METHODS:
+            response.set_cookie(routers.PIN_COOKIE, '1', 
+                    max_age = routers.option('PIN_SECONDS'), httponly = True, samesite = 'Lax')
+        return response
+
+class RedirectMiddleware():
+    """
+    Serves redirects without the rest of the middleware. Sessions, CSRF, authentication, 
+    messages and clickjacking headers do nothing for a GET of a short url, so a GET or HEAD 
+    request resolving to urls:redirect is handed straight to the view, and any other request 
+    goes down the stack. Place it after the middleware redirects still need (metrics and 
+    replica pinning) and before the rest.
+
+    Redirects also skip SecurityMiddleware, set SECURE_SSL_REDIRECT and HSTS at the proxy if 
+    they are needed on short urls. A path without its trailing slash does not resolve, so it 
+    still reaches CommonMiddleware's APPEND_SLASH.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    URL_NAME = 'redirect'
+    NAMESPACE = 'urls'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def match(self, request):
+        """
+        Returns:
+            the ResolverMatch of a redirect request, or None for any other request
+        """
+        if request.method not in ( 'GET', 'HEAD' ):
+            return None
+        try:
+            match = resolve(request.path_info, getattr(request, 'urlconf', None))
+        except Resolver404:
+            return None
+        if match.url_name != self.URL_NAME or match.namespace != self.NAMESPACE:
+            return None
+        return match
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        match = self.match(request)
+        if match is None:
+            return self.get_response(request)
+        request.resolver_match = match
+        if asyncio.iscoroutinefunction(match.func):
+            # the async views under WSGI, as django's handler runs them
+            return async_to_sync(match.func)(request, *match.args, **match.kwargs)
+        return match.func(request, *match.args, **match.kwargs)
+
+    async def __acall__(self, request):
+        match = self.match(request)
+        if match is None:
+            return await self.get_response(request)
+        request.resolver_match = match
+        if asyncio.iscoroutinefunction(match.func):
+            return await match.func(request, *match.args, **match.kwargs)
+        return await sync_to_async(match.func)(request, *match.args, **match.kwargs)
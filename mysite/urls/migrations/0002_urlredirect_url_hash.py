@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models, transaction
+
+import hashlib
+
+CHUNK_SIZE = 2000
+BATCH_SIZE = 500    # rows per UPDATE, each sets url_hash with a CASE over their ids
+
+def backfill_url_hash(apps, schema_editor):
+    """
+    Fills url_hash for existing rows, a chunk per transaction so large tables are never 
+    locked for long, with a few bulk UPDATEs per chunk rather than one per row. The digest 
+    is duplicated from urls.contrib.urls.digest as migrations should not depend on 
+    application code that may change.
+    """
+    URLRedirect = apps.get_model('urls', 'URLRedirect')
+    db = schema_editor.connection.alias
+    last = -1
+    while True:
+        with transaction.atomic(using = db):
+            rows = list(URLRedirect.objects.using(db)
+                    .filter(pk__gt = last)
+                    .order_by('pk')
+                    .values_list('pk', 'original_url')[:CHUNK_SIZE])
+            URLRedirect.objects.using(db).bulk_update([ URLRedirect(pk = pk, 
+                    url_hash = hashlib.blake2b(url.encode('utf-8'), digest_size = 16).hexdigest())
+                    for pk, url in rows ], [ 'url_hash' ], batch_size = BATCH_SIZE)
+        if len(rows) < CHUNK_SIZE:
+            break
+        last = rows[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('urls', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='urlredirect',
+            name='url_hash',
+            field=models.CharField(db_index=True, editable=False, max_length=32, null=True),
+        ),
+        migrations.RunPython(backfill_url_hash, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='urlredirect',
+            name='original_url',
+            field=models.URLField(),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('urls', '0003_sequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='urlredirect',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('valid', 'Valid'), ('invalid', 'Invalid'), ('unreachable', 'Unreachable'), ('bad_ssl', 'Bad SSL certificate'), ('http_error', 'HTTP error')], db_index=True, default='valid', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='urlredirect',
+            name='status_code',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='urlredirect',
+            name='status_message',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
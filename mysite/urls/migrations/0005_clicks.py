@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('urls', '0004_urlredirect_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClickRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('start', models.DateTimeField()),
+                ('clicks', models.IntegerField(default=0)),
+                ('redirect', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='urls.URLRedirect')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ClickEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('time', models.DateTimeField()),
+                ('referrer_host', models.CharField(blank=True, max_length=255)),
+                ('agent', models.CharField(choices=[('browser', 'Browser'), ('mobile', 'Mobile'), ('bot', 'Bot'), ('unknown', 'Unknown')], max_length=8)),
+                ('redirect', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='urls.URLRedirect')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='clickrollup',
+            index=models.Index(fields=['redirect', 'period', 'start', 'clicks'], name='urls_rollup_clicks_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='clickrollup',
+            unique_together={('redirect', 'period', 'start')},
+        ),
+    ]
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('urls', '0007_urlredirect_created_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TopLink',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('times_used', 'Most used'), ('recent_clicks', 'Most clicked recently')], max_length=16)),
+                ('rank', models.IntegerField()),
+                ('link_id', models.IntegerField()),
+                ('original_url', models.URLField()),
+                ('value', models.BigIntegerField()),
+                ('refreshed', models.DateTimeField()),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='urlredirect',
+            name='created',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='urlredirect',
+            index=models.Index(fields=['created', 'id'], name='urls_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='urlredirect',
+            index=models.Index(fields=['times_used', 'id'], name='urls_times_used_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='toplink',
+            unique_together={('kind', 'rank')},
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('urls', '0008_admin_indexes_toplink'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FreeId',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('freed', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='urlredirect',
+            name='expires',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='urlredirect',
+            name='max_idle',
+            field=models.DurationField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='urlredirect',
+            index=models.Index(fields=['expires', 'id'], name='urls_expires_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('urls', '0009_expiry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='urlredirect',
+            name='permanent',
+            field=models.BooleanField(blank=True, null=True),
+        ),
+    ]
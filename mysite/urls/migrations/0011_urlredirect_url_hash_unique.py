@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def clear_duplicate_hashes(apps, schema_editor):
+    """
+    Clears url_hash on the duplicate links created before it was unique, the oldest id of
+    each url keeps it and is the one URLRedirect.get_or_create returns from now on. The
+    duplicates keep redirecting by their own short codes.
+    """
+    URLRedirect = apps.get_model('urls', 'URLRedirect')
+    redirects = URLRedirect.objects.using(schema_editor.connection.alias)
+    duplicates = (redirects
+            .filter(url_hash__isnull = False)
+            .values('url_hash')
+            .annotate(links = Count('id'), first = Min('id'))
+            .filter(links__gt = 1)
+            .values_list('url_hash', 'first'))
+    for url_hash, first in list(duplicates):
+        redirects.filter(url_hash = url_hash).exclude(pk = first).update(url_hash = None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('urls', '0010_urlredirect_permanent'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_duplicate_hashes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='urlredirect',
+            name='url_hash',
+            field=models.CharField(editable=False, max_length=32, null=True, unique=True),
+        ),
+    ]
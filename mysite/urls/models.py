@@ -1,38 +1,288 @@
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, router, transaction, IntegrityError
+from django.db.models import F, Q
+from django.db.models.signals import post_save
+from django.utils import timezone
 
-from random import randrange
+from .contrib.urls import digest, PENDING, VALID, INVALID, UNREACHABLE, BAD_SSL, HTTP_ERROR
+from .contrib.allocators import get_allocator, MAX_INT
+from .contrib.sharding import shard_map
+from .contrib.clicks import BROWSER, MOBILE, BOT, UNKNOWN, HOUR, DAY
+from .contrib.top import TIMES_USED, RECENT_CLICKS
+from .contrib import expiry
 
-MAX_INT = 2147483647
+from contextlib import nullcontext
+from datetime import timedelta
+
+allocator = get_allocator()
+
+STATUS_CHOICES = [
+        ( PENDING, 'Pending' ), 
+        ( VALID, 'Valid' ), 
+        ( INVALID, 'Invalid' ), 
+        ( UNREACHABLE, 'Unreachable' ), 
+        ( BAD_SSL, 'Bad SSL certificate' ), 
+        ( HTTP_ERROR, 'HTTP error' ), 
+]
+
+AGENT_CHOICES = [
+        ( BROWSER, 'Browser' ), 
+        ( MOBILE, 'Mobile' ), 
+        ( BOT, 'Bot' ), 
+        ( UNKNOWN, 'Unknown' ), 
+]
+
+PERIOD_CHOICES = [
+        ( HOUR, 'Hour' ), 
+        ( DAY, 'Day' ), 
+]
+
+RANKING_CHOICES = [
+        ( TIMES_USED, 'Most used' ), 
+        ( RECENT_CLICKS, 'Most clicked recently' ), 
+]
 
 # Create your models here.
 class URLRedirect(models.Model):
-    original_url = models.URLField(db_index = True)
-    times_used   = models.IntegerField(default = 0)
-    created      = models.DateTimeField(auto_now_add = True)
+    original_url   = models.URLField()
+    # unique, the links of urls which share a digest and older duplicates have none
+    url_hash       = models.CharField(max_length = 32, unique = True, null = True, editable = False)
+    times_used     = models.IntegerField(default = 0)
+    # not auto_now_add, which would overwrite the time of imported links
+    created        = models.DateTimeField(default = timezone.now, editable = False)
+    status         = models.CharField(max_length = 16, choices = STATUS_CHOICES, default = VALID, db_index = True)
+    status_code    = models.IntegerField(null = True, blank = True)
+    status_message = models.CharField(max_length = 255, blank = True)
+    # when the link stops redirecting, pushed back to max_idle after each click if set
+    expires        = models.DateTimeField(null = True, blank = True)
+    max_idle       = models.DurationField(null = True, blank = True)
+    # redirect with 301 or 302, None for the URLS_HTTP_CACHE default
+    permanent      = models.BooleanField(null = True, blank = True)
+
+    class Meta:
+        indexes = [
+            # the keyset pagination of the admin, urls.contrib.pagination, sorted by either
+            models.Index(fields = [ 'created', 'id' ], name = 'urls_created_idx'), 
+            models.Index(fields = [ 'times_used', 'id' ], name = 'urls_times_used_idx'), 
+            # the batches of urls.contrib.expiry.purge
+            models.Index(fields = [ 'expires', 'id' ], name = 'urls_expires_idx'), 
+        ]
 
     def __str__(self):
         return self.original_url
 
+    def clean(self):
+        # url_hash is not a form field, so model forms do not check it is unique
+        if self._state.adding or self.url_hash is not None:
+            others = type(self)._default_manager.using(self._state.db or router.db_for_write(type(self)))
+            if others.filter(url_hash = digest(self.original_url)).exclude(pk = self.pk).exists():
+                raise ValidationError({ 'original_url': 'This url has already been shortened.' })
+
+    def save(self, *args, **kwargs):
+        # links without a hash keep none, see get_or_create
+        if self._state.adding or self.url_hash is not None:
+            self.url_hash = digest(self.original_url)
+        super().save(*args, **kwargs)
+
     @classmethod
-    def get_or_create(cls, url):
+    def get_or_create(cls, url, status = VALID, status_code = None, status_message = ''):
         """
         Gets the URLRedirect for the url, creating a new one if it does not exist 
-        in the database.
+        in the database. An existing link costs one query and a new one an INSERT more, 
+        concurrent calls for the same url all get the link whose INSERT won on url_hash. 
+        Inside a transaction the INSERT also costs a savepoint and its release, so a 
+        conflict does not break the transaction.
 
         Args:
-            original_url: the validated, normalized, and canonicalized url
+            original_url:   the validated, normalized, and canonicalized url
+            status:         the validation status of a new URLRedirect
+            status_code:    the HTTP status its validation got, if any
+            status_message: the message its validation failed with, if any
 
         Returns:
             the URLRedirect object for the url
         """
-        qs = cls.objects.filter(original_url = url)
-        if qs.exists():
+        # the url is only ever stored on the shard owning it
+        shard = shard_map.for_url(url)
+        redirects = cls.objects.db_manager(shard_map.using(shard) or router.db_for_write(cls))
+        url_hash = digest(url)
+        while True:
             # TODO if adding custom urls they should be excluded here
-            return qs.first()
-        else:
-            id = randrange(MAX_INT)
-            while cls.objects.filter(id = id).exists(): # birthday paradox. 50% chance of collision after ~55000 entries
-                id = randrange(MAX_INT)
-            redirect = cls.objects.create(id = id, original_url = url)
-            redirect.save()
-            return redirect
+            redirect = redirects.filter(url_hash = url_hash).first()
+            if redirect is not None and redirect.original_url != url:
+                # a hash collision, the url is kept without a hash
+                return cls._get_or_create_unhashed(redirects, shard, url, 
+                        status = status, status_code = status_code, status_message = status_message)
+            elif redirect is not None:
+                if expiry.is_expired(redirect.expires):
+                    # shortened again before it was purged, it starts over
+                    for name, value in expiry.defaults().items():
+                        setattr(redirect, name, value)
+                    redirect.save(update_fields = [ 'expires', 'max_idle' ])
+                return redirect
+            id = allocate_id(shard)
+            try:
+                with savepoint(redirects.db):
+                    return redirects.create(id = id, original_url = url, status = status, 
+                            status_code = status_code, status_message = status_message, **expiry.defaults())
+            except IntegrityError:
+                # the same url created concurrently, read on the next pass, or an id picked at
+                # random before the allocator was introduced, skipped
+                if not redirects.filter(Q(url_hash = url_hash) | Q(id = id)).exists():
+                    raise
+
+    @classmethod
+    def _get_or_create_unhashed(cls, redirects, shard, url, **fields):
+        """
+        Gets or creates the link of a url whose digest belongs to another url. Its lookup 
+        scans the links without a hash, which also hold the duplicates created before 
+        url_hash was unique.
+        """
+        redirect = redirects.filter(url_hash = None, original_url = url).order_by('pk').first()
+        while redirect is None:
+            # bulk_create, as save() would set the hash
+            created = cls(id = allocate_id(shard), original_url = url, **dict(expiry.defaults(), **fields))
+            try:
+                with savepoint(redirects.db):
+                    redirect = redirects.bulk_create([ created ])[0]
+            except IntegrityError:
+                if not redirects.filter(id = created.id).exists():
+                    raise
+                continue
+            # bulk_create sends no post_save, which adds new links to the id filter
+            post_save.send(sender = cls, instance = redirect, created = True, update_fields = None, 
+                    raw = False, using = redirects.db)
+        return redirect
+
+def savepoint(using):
+    """
+    Returns:
+        a context manager around an INSERT which may fail on a unique constraint, a 
+        savepoint inside a transaction so the IntegrityError can be handled, nothing in 
+        autocommit mode where the INSERT is a transaction of its own
+    """
+    if transaction.get_connection(using).in_atomic_block:
+        return transaction.atomic(using = using)
+    return nullcontext()
+
+def allocate_id(shard):
+    """
+    Returns:
+        an id for a new link on the shard, a purged one when URLS_EXPIRY REUSE_IDS is set
+    """
+    if expiry.option('REUSE_IDS'):
+        id = FreeId.pop(shard_map.using(shard) or router.db_for_write(FreeId), 
+                timezone.now() - timedelta(seconds = expiry.option('REUSE_AFTER')))
+        if id is not None:
+            return id
+    return (shard.allocator if shard_map.sharded else allocator).allocate()
+
+class Sequence(models.Model):
+    """
+    A named counter, incremented in blocks by the id allocator.
+    """
+    name  = models.CharField(max_length = 64, primary_key = True)
+    value = models.BigIntegerField(default = 0)
+
+    def __str__(self):
+        return '{} = {}'.format(self.name, self.value)
+
+    @classmethod
+    def reserve(cls, name, n = 1, using = None):
+        """
+        Atomically reserves the next n values of a sequence, creating it if needed.
+
+        Args:
+            name:  the name of the sequence
+            n:     the number of values to reserve
+            using: the database, None for the routers' choice of database to write to
+
+        Returns:
+            the first reserved value, the block is [value, value + n)
+        """
+        sequences = cls.objects.db_manager(using or router.db_for_write(cls))
+        with transaction.atomic(using = sequences.db):
+            sequences.get_or_create(name = name)
+            sequences.filter(name = name).update(value = F('value') + n)
+            return sequences.get(name = name).value - n
+
+class ClickEvent(models.Model):
+    """
+    A click on a shortened url, appended in batches by urls.contrib.clicks.click_log and 
+    aggregated into ClickRollups by the rollup_clicks command. Only the primary key is 
+    indexed, the rollup reads the log in primary key order.
+    """
+    id            = models.BigAutoField(primary_key = True)
+    redirect      = models.ForeignKey(URLRedirect, on_delete = models.DO_NOTHING, 
+            db_constraint = False, db_index = False, related_name = '+')
+    time          = models.DateTimeField()
+    referrer_host = models.CharField(max_length = 255, blank = True)
+    agent         = models.CharField(max_length = 8, choices = AGENT_CHOICES)
+
+    def __str__(self):
+        return '{} at {}'.format(self.redirect_id, self.time)
+
+class ClickRollup(models.Model):
+    """
+    The number of clicks on a link in an hour or day (UTC).
+    """
+    redirect = models.ForeignKey(URLRedirect, on_delete = models.CASCADE, db_index = False, 
+            related_name = 'rollups')
+    period   = models.CharField(max_length = 4, choices = PERIOD_CHOICES)
+    start    = models.DateTimeField()
+    clicks   = models.IntegerField(default = 0)
+
+    class Meta:
+        unique_together = [ ( 'redirect', 'period', 'start' ) ]
+        indexes = [
+            # covers the range queries of urls.contrib.clicks.clicks_per
+            models.Index(fields = [ 'redirect', 'period', 'start', 'clicks' ], name = 'urls_rollup_clicks_idx'), 
+        ]
+
+    def __str__(self):
+        return '{} {} {}: {}'.format(self.redirect_id, self.period, self.start, self.clicks)
+
+class TopLink(models.Model):
+    """
+    A link in a precomputed ranking of the admin dashboard, see urls.contrib.top. The id and
+    url are copied rather than referenced, as the link may live on another shard.
+    """
+    kind         = models.CharField(max_length = 16, choices = RANKING_CHOICES)
+    rank         = models.IntegerField()
+    link_id      = models.IntegerField()
+    original_url = models.URLField()
+    value        = models.BigIntegerField()
+    refreshed    = models.DateTimeField()
+
+    class Meta:
+        unique_together = [ ( 'kind', 'rank' ) ]
+
+    def __str__(self):
+        return '{} #{}: {}'.format(self.kind, self.rank, self.original_url)
+
+class FreeId(models.Model):
+    """
+    The id of a purged link, handed out again by allocate_id once it has been free for
+    REUSE_AFTER seconds. Kept on the shard the id belongs to.
+    """
+    id    = models.IntegerField(primary_key = True)
+    freed = models.DateTimeField(db_index = True)
+
+    def __str__(self):
+        return '{} freed at {}'.format(self.id, self.freed)
+
+    @classmethod
+    def pop(cls, using, before):
+        """
+        Takes a free id, workers racing for the same id retry with the next one.
+
+        Returns:
+            an id freed before the given time, or None if there is none
+        """
+        free = cls.objects.using(using)
+        while True:
+            id = free.filter(freed__lte = before).values_list('id', flat = True).first()
+            if id is None:
+                return None
+            if free.filter(id = id).delete()[0]:
+                return id
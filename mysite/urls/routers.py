@@ -0,0 +1,136 @@
+from django.conf import settings
+from django.db import connections, DatabaseError
+
+from .contrib.sharding import shard_map
+
+from contextvars import ContextVar
+from random import Random
+from threading import Lock
+
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+        'PRIMARY': 'default',
+        'REPLICAS': {},         # alias: weight, an empty dict sends everything to PRIMARY
+        'APPS': [ 'urls' ],     # the apps whose reads may go to a replica
+        'PIN_SECONDS': 5,       # seconds a client reads from the primary after writing
+        'RETRY_AFTER': 30,      # seconds a replica is skipped after failing to connect
+}
+
+PIN_COOKIE = 'urls_primary'
+SAFE_METHODS = ( 'GET', 'HEAD', 'OPTIONS', 'TRACE' )
+
+def option(name):
+    return getattr(settings, 'URLS_DATABASE_ROUTER', {}).get(name, DEFAULTS[name])
+
+class RequestState():
+    """
+    Whether the current request must read from the primary, and the replica it reads from
+    otherwise.
+    """
+
+    def __init__(self, pinned = False):
+        self.pinned = pinned
+        self.written = False
+        self.replica = None
+
+_state = ContextVar('urls_router_state', default = None)
+
+def begin(request):
+    """
+    Lets the reads of a request go to a replica, unless it is a write (e.g. a POST) or the
+    client wrote within the last PIN_SECONDS. Outside of a request everything goes to the
+    primary, so management commands and background threads always read their own writes.
+
+    Returns:
+        a token for end()
+    """
+    pinned = request.method not in SAFE_METHODS or PIN_COOKIE in request.COOKIES
+    return _state.set(RequestState(pinned))
+
+def current():
+    return _state.get()
+
+def end(token):
+    _state.reset(token)
+
+class ReplicaRouter():
+    """
+    Sends the reads of the APPS to the replicas listed in the URLS_DATABASE_ROUTER setting,
+    chosen per request by weight, and every write to the primary. A request reads from the
+    primary once it has written, and urls.middleware.ReplicaPinMiddleware keeps the client
+    that wrote on the primary for PIN_SECONDS, so a link resolves as soon as it is created.
+
+    A replica which cannot be connected to is skipped for RETRY_AFTER seconds, when there is
+    no healthy replica the primary is used.
+    """
+
+    def __init__(self):
+        self._down = {}
+        self._random = Random()
+        self._lock = Lock()
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label not in option('APPS'):
+            return None
+        state = _state.get()
+        if state is None or state.pinned:
+            return option('PRIMARY')
+        if state.replica is None or not self.healthy(state.replica):
+            state.replica = self.choose()
+        return state.replica or option('PRIMARY')
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.pinned = state.written = True
+        if model._meta.app_label not in option('APPS'):
+            return None
+        instance = hints.get('instance')
+        if instance is not None and shard_map.sharded and instance._state.db in shard_map.aliases:
+            # an object read from a shard is saved back to it
+            return instance._state.db
+        return option('PRIMARY')
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = set(option('REPLICAS')) | { option('PRIMARY') } | set(shard_map.aliases)
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def choose(self):
+        """
+        Returns:
+            a healthy replica picked by weight, or None if there is none
+        """
+        replicas = [ ( alias, weight ) for alias, weight in option('REPLICAS').items()
+                if weight > 0 and self.healthy(alias) ]
+        if not replicas:
+            return None
+        with self._lock:
+            return self._random.choices(
+                    [ alias for alias, weight in replicas ],
+                    [ weight for alias, weight in replicas ])[0]
+
+    def healthy(self, alias):
+        """
+        Connects to a replica if needed, marking it down if the connection fails.
+        """
+        until = self._down.get(alias)
+        if until is not None:
+            if time.monotonic() < until:
+                return False
+            self._down.pop(alias, None)
+        try:
+            connections[alias].ensure_connection()
+        except DatabaseError:
+            logger.warning('Database replica %s is unavailable', alias, exc_info = True)
+            self.mark_down(alias)
+            return False
+        return True
+
+    def mark_down(self, alias):
+        self._down[alias] = time.monotonic() + option('RETRY_AFTER')
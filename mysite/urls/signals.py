@@ -0,0 +1,36 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import URLRedirect
+from .contrib.cache import redirect_cache
+from .contrib.bloom import id_filter
+from .contrib import metrics, snapshot
+
+@receiver(post_save, sender = URLRedirect)
+def invalidate_on_save(sender, instance, created = False, update_fields = None, using = None, **kwargs):
+    """
+    Drops the cached url when a URLRedirect is edited, e.g. from the admin, and revokes its
+    snapshot entry. Saves which only touch the click counter leave the cache alone. New links
+    are added to the id filter.
+    """
+    if created:
+        id_filter.add(instance.pk)
+    if update_fields and set(update_fields) <= { 'times_used' }:
+        return
+    redirect_cache.delete(instance.pk)
+    if not created:
+        snapshot.revoke_on_commit(instance.pk, using)
+
+@receiver(post_delete, sender = URLRedirect)
+def invalidate_on_delete(sender, instance, using = None, **kwargs):
+    redirect_cache.delete(instance.pk)
+    snapshot.revoke_on_commit(instance.pk, using)
+
+@receiver(connection_created)
+def count_queries(sender, connection, **kwargs):
+    """
+    Counts the queries of each request for urls.middleware.MetricsMiddleware.
+    """
+    if metrics.count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(metrics.count_query)
@@ -1,12 +1,48 @@
-from django.test import TestCase, SimpleTestCase
+from django.test import TestCase, SimpleTestCase, TransactionTestCase, AsyncClient, override_settings
+from django.db import connection, connections, router, transaction, DatabaseError, IntegrityError, OperationalError
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.contrib.auth.models import User
+from django.core.management import call_command, CommandError
 from django.shortcuts import reverse
+from django.core.cache import caches
+from django.core.signals import request_started
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
 
-from .models import URLRedirect
+from .models import URLRedirect, Sequence, ClickEvent, ClickRollup, TopLink, FreeId
+from .admin import URLRedirectAdmin
 from .views import CreateURLView
-from .contrib.urls import hostname
-from .contrib.base_n import decode, encode
+from .contrib.urls import hostname, digest, canonicalize, canonicalize_many, memo_stats, clear_memos, MEMO_MAX_LENGTH, VALID
+from .contrib.urls import validate_url, avalidate_url, ValidationError, UNREACHABLE
+from .contrib.base_n import decode, encode, is_valid, encode_many, decode_many
+from .contrib.aio import AsyncPoolManager
+from .contrib.client import ValidationClient, AsyncValidationClient, CircuitOpenError
+from .contrib.cache import LRUCache, redirect_cache
+from .contrib.bloom import BloomFilter, IdFilter, id_filter
+from .contrib.headers import page_cache
+from .contrib.hot import SpaceSaving, HotLinks, hot_links
+from .contrib import hot
+from .contrib.counters import BufferedWriter, ClickCounter, click_counter
+from .contrib.allocators import FeistelAllocator
+from .contrib import validation, bulk, clicks, transfer, pagination, top, expiry
+from .contrib.clicks import click_log
+from .contrib.validation import validation_cache
+from .contrib.metrics import Histogram, registry
+from .contrib.snapshot import Segment, Snapshot, write_segment
+from .routers import PIN_COOKIE
+from .contrib import snapshot
+from .contrib.sharding import ShardMap, shard_map
 
 from collections import namedtuple
+from datetime import datetime, timedelta
+from unittest import skipUnless
+from threading import Barrier, Thread
+from http.server import HTTPServer, ThreadingHTTPServer, BaseHTTPRequestHandler
+import asyncio
+from io import StringIO
+import tempfile
+import time
+import os
 from mock import patch
 import json
 
@@ -51,8 +87,77 @@ class BaseNTests(SimpleTestCase):
         n = 2 ** 64
         self.assertEqual(n, decode(encode(n, BASE_N_ALPHABET), BASE_N_CHARMAP))
 
+    def test_encode_matches_positional_notation(self):
+        alphabet = '0123456789'
+        for n in list(range(1000)) + [ 10 ** 12, 10 ** 12 - 1, 123456789 ]:
+            with self.subTest(n = n):
+                self.assertEqual(str(n), encode(n, alphabet))
+
+    def test_encode_large_alphabet(self):
+        alphabet = ''.join(chr(0x100 + idx) for idx in range(300))
+        charmap = dict((ch, i) for i, ch in enumerate(alphabet))
+        self.assertEqual(299 * 300 + 1, decode(encode(299 * 300 + 1, alphabet), charmap))
+
+    def test_decode_longer_than_max_length_raises_error(self):
+        with self.assertRaises(ValueError):
+            decode('abcdefg', max_length = 6)
+        self.assertEqual(decode('abcdef'), decode('abcdef', max_length = 6))
+
+    def test_is_valid(self):
+        self.assertTrue(is_valid('abc'))
+        self.assertFalse(is_valid(''))
+        self.assertFalse(is_valid('ab0')) # not in the alphabet
+        self.assertFalse(is_valid('abcdefg', max_length = 6))
+
+    def test_batch_encode_and_decode(self):
+        ns = [ 0, 1, 57, 2147483647 ]
+        self.assertEqual(ns, decode_many(encode_many(ns)))
+
+class LRUCacheTests(SimpleTestCase):
+
+    def test_least_recently_used_is_evicted(self):
+        cache = LRUCache(maxsize = 2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(1, cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(2, len(cache))
+
+    def test_expired_entries_are_misses(self):
+        cache = LRUCache(timeout = 60)
+        cache.set('a', 1)
+        cache.set('b', 2, timeout = -1)
+        self.assertEqual(1, cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(( 1, 1 ), ( cache.hits, cache.misses ))
+
 class URLSTests(SimpleTestCase):
 
+    def setUp(self):
+        clear_memos()
+
+    def test_canonicalize(self):
+        self.assertEqual('http://www.example.com/?a=1&b=2', canonicalize('www.example.com/?b=2&a=1'))
+        self.assertEqual('https://www.example.com/a%20b#top', canonicalize('https://www.example.com/a b#top'))
+
+    def test_canonicalize_is_memoized(self):
+        canonicalize('www.example.com/?b=2&a=1')
+        canonicalize('www.example.com/?b=2&a=1')
+        canonicalize('www.example.com/?a=1&b=2')
+        self.assertEqual({ 'hits': 1, 'misses': 2, 'size': 2 }, memo_stats()['canonicalize'])
+
+    def test_long_urls_are_not_memoized(self):
+        url = 'https://www.example.com/' + 'a' * MEMO_MAX_LENGTH
+        self.assertEqual(url, canonicalize(url))
+        self.assertEqual(0, memo_stats()['canonicalize']['size'])
+
+    def test_canonicalize_many(self):
+        urls = [ 'www.example.com/?b=2&a=1', 'example.org', 'www.example.com/?b=2&a=1' ]
+        self.assertEqual([ canonicalize(url) for url in urls ], canonicalize_many(urls))
+        self.assertEqual(2, memo_stats()['canonicalize']['misses'])
+
     def test_hostname(self):
         values = [
                     ( 'https://www.example.com/', 'Example' ), 
@@ -92,8 +197,33 @@ class PoolManagerMock():
             raise self.error
         return Response(self.status)
 
+class AsyncPoolAdapter():
+    """
+    Serves the async client's requests from whichever PoolManagerMock is patched in, so the 
+    same tests run against the async views.
+    """
+
+    async def request(self, method, url, timeout = None):
+        from .contrib import urls
+        return urls.pool.request(method, url, timeout = timeout)
+
+from urllib3.exceptions import MaxRetryError, SSLError, ReadTimeoutError, NewConnectionError, EmptyPoolError
+
+def clear_caches():
+    redirect_cache.clear()
+    click_counter.clear()
+    click_log.clear()
+    clear_memos()
+    validation_cache.clear()
+    id_filter.clear()
+    page_cache.clear()
+    hot_links.clear()
+    caches['default'].clear()
+
 class CreateURLViewTests(TestCase):
-    from urllib3.exceptions import MaxRetryError, SSLError
+
+    def setUp(self):
+        clear_caches()
 
     def assertEquals(self, data, expected, name):
         actual = data[name]
@@ -220,13 +350,376 @@ class CreateURLViewTests(TestCase):
     def test_urllib3_error(self):
         self.checkResponse('https://www.example.com/badssl', success = False)
 
+class ValidationCacheTests(TestCase):
+
+    def setUp(self):
+        clear_caches()
+
+    def test_valid_url_is_requested_once(self):
+        pool = PoolManagerMock(None)
+        with patch('urls.contrib.urls.pool', pool), patch.object(pool, 'request', wraps = pool.request) as request:
+            validation.check('http://www.example.com/')
+            validation.check('http://www.example.com/')
+        self.assertEqual(1, request.call_count)
+        self.assertEqual(1, validation_cache.stats()['requests_saved'])
+
+    def test_negative_outcomes_expire_separately(self):
+        cache = validation.ValidationCache({ 'NEGATIVE_TIMEOUT': -1 })
+        cache.set('http://www.example.com/404', { 'status': 'http_error' })
+        cache.set('http://www.example.com/', { 'status': 'valid' })
+        self.assertIsNone(cache.get('http://www.example.com/404'))
+        self.assertEqual('valid', cache.get('http://www.example.com/')['status'])
+
+    @patch('urls.contrib.urls.pool', PoolManagerMock(MaxRetryError(None, None, SSLError())))
+    def test_host_errors_skip_other_urls_on_host(self):
+        self.assertEqual('bad_ssl', validation.check('https://www.example.com/a')['status'])
+        with patch('urls.contrib.urls.pool', PoolManagerMock(None)):
+            self.assertEqual('bad_ssl', validation.check('https://www.example.com/b')['status'])
+            self.assertEqual('valid', validation.check('http://www.example.com/b')['status'])
+        self.assertEqual(1, validation_cache.stats()['host_hits'])
+
+    @patch('urls.contrib.urls.pool', PoolManagerMock(MaxRetryError(None, None, ReadTimeoutError(None, None, None))))
+    def test_timeouts_are_not_cached(self):
+        validation.check('http://www.example.com/')
+        self.assertIsNone(validation_cache.get('http://www.example.com/'))
+
+class BulkShortenTests(TestCase):
+
+    def setUp(self):
+        clear_caches()
+
+    def test_read_urls_formats(self):
+        self.assertEqual([ 'a', 'b' ], list(bulk.read_urls([ '["a", "b"]' ], bulk.JSON)))
+        self.assertEqual([ 'a', 'b' ], list(bulk.read_urls([ '{"urls": ["a",\n', '"b"]}' ], bulk.JSON)))
+        self.assertEqual([ 'a', 'b' ], list(bulk.read_urls([ 'name,url\n', 'x,a\n', 'y,b\n' ], bulk.CSV)))
+        self.assertEqual([ 'a', 'b' ], list(bulk.read_urls([ 'a\n', 'b\n' ], bulk.CSV)))
+        self.assertEqual([ 'a', 'b' ], list(bulk.read_urls([ ' a \n', '\n', 'b' ], bulk.TEXT)))
+
+    def test_json_is_read_incrementally(self):
+        blocks = [ '{"name": "campaign", "size": 1', '2, "urls": [ "a', '", "b"', ' , "c"] }' ]
+        self.assertEqual([ 'a', 'b', 'c' ], list(bulk.read_urls(blocks, bulk.JSON)))
+        self.assertEqual([], list(bulk.read_urls([ ' [ ', ' ] ' ], bulk.JSON)))
+
+        def lines():
+            yield '["a", '
+            raise AssertionError('read past the first url')
+        self.assertEqual('a', next(bulk.read_urls(lines(), bulk.JSON)))
+
+        for invalid in ( '["a" "b"]', '["a", ', '{"other": []}', 'a' ):
+            with self.assertRaises(ValueError):
+                list(bulk.read_urls([ invalid ], bulk.JSON))
+
+    @patch('urls.contrib.urls.pool', PoolManagerMock(None))
+    def test_results_in_input_order_and_deduplicated(self):
+        existing = URLRedirect.get_or_create('http://www.example.com/')
+        urls = [ 'www.example.com/', 'http://www.example.com/a', 'ftp://www.example.com/', 'HTTP://www.example.com/a' ]
+        results = list(bulk.shorten_many(urls))
+
+        self.assertEqual(urls, [ r['input'] for r in results ])
+        self.assertEqual([ True, True, False, True ], [ r['success'] for r in results ])
+        self.assertEqual(encode(existing.id), results[0]['short'])
+        self.assertEqual(results[1]['short'], results[3]['short'])
+        self.assertEqual(2, URLRedirect.objects.count())
+
+    @patch('urls.contrib.urls.pool', PoolManagerMock(None))
+    def test_queries_per_chunk(self):
+        urls = [ 'http://www.example.com/{}'.format(idx) for idx in range(50) ]
+        allocator = FeistelAllocator(key = 'test', block_size = 100)
+        allocator.allocate()
+        # the IN lookup and the bulk insert inside a savepoint
+        with patch('urls.models.allocator', allocator), self.assertNumQueries(4):
+            results = list(bulk.shorten_many(urls, chunk_size = 100))
+        self.assertEqual(50, len(set(r['short'] for r in results)))
+
+    @patch('urls.contrib.urls.pool', PoolManagerMock(None, 404))
+    def test_invalid_urls_are_not_created(self):
+        results = list(bulk.shorten_many([ 'http://www.example.com/404' ]))
+        self.assertFalse(results[0]['success'])
+        self.assertEqual('The webpage could not be found', results[0]['result'])
+        self.assertFalse(URLRedirect.objects.exists())
+
+    @patch('urls.contrib.urls.pool', PoolManagerMock(None))
+    def test_bulk_view_streams_results(self):
+        self.client.force_login(User.objects.create(username = 'staff', is_staff = True))
+        response = self.client.post(reverse('urls:bulk'), 'url\nhttp://www.example.com/\nftp://x/\n', content_type = 'text/csv')
+        lines = [ json.loads(line) for line in b''.join(response.streaming_content).splitlines() ]
+        self.assertEqual([ True, False ], [ line['success'] for line in lines ])
+        self.assertTrue(lines[0]['result'].startswith('http://testserver/urls/'))
+
+    @patch('urls.contrib.urls.pool', PoolManagerMock(None))
+    @patch('urls.contrib.bulk.READ_SIZE', 7)
+    def test_bulk_view_reads_json_in_blocks(self):
+        self.client.force_login(User.objects.create(username = 'staff', is_staff = True))
+        body = json.dumps({ 'urls': [ 'http://www.example.com/caf\u00e9', 'ftp://x/' ] }, ensure_ascii = False)
+        response = self.client.post(reverse('urls:bulk'), body.encode('utf-8'), content_type = 'application/json')
+        lines = [ json.loads(line) for line in b''.join(response.streaming_content).splitlines() ]
+        self.assertEqual([ True, False ], [ line['success'] for line in lines ])
+        self.assertEqual('http://www.example.com/caf%C3%A9', lines[0]['url'])
+
+    @patch('urls.contrib.urls.pool', PoolManagerMock(None))
+    def test_fallback_keeps_validation_detail(self):
+        existing = URLRedirect.get_or_create('http://www.example.com/')
+        # the first id is taken, as by a link created before the allocator
+        with patch('urls.models.allocate_id', side_effect = [ existing.id, existing.id + 1 ]):
+            results = list(bulk.shorten_many([ 'http://www.example.com/new' ]))
+        redirect = URLRedirect.objects.get(pk = decode(results[0]['short']))
+        self.assertEqual(existing.id + 1, redirect.id)
+        self.assertEqual(( VALID, 200 ), ( redirect.status, redirect.status_code ))
+
+    def test_bulk_view_requires_staff(self):
+        response = self.client.post(reverse('urls:bulk'), '[]', content_type = 'application/json')
+        self.assertEqual(403, response.status_code)
+
+    @override_settings(URLS_VALIDATION = { 'MODE': 'queue' })
+    def test_command_writes_a_line_per_url(self):
+        with tempfile.NamedTemporaryFile('w', suffix = '.json') as f:
+            f.write('["www.example.com/", "ftp://www.example.com/"]')
+            f.flush()
+            out = StringIO()
+            call_command('shorten_urls', f.name, '--base-url', 'https://sho.rt', stdout = out)
+        lines = [ json.loads(line) for line in out.getvalue().splitlines() ]
+        self.assertEqual('pending', lines[0]['status'])
+        self.assertTrue(lines[0]['result'].startswith('https://sho.rt/urls/'))
+        self.assertFalse(lines[1]['success'])
+
+class AsyncValidationTests(TestCase):
+
+    def setUp(self):
+        clear_caches()
+
+    def create(self, url):
+        return json.loads(self.client.post(reverse('urls:create'), { 'url' : url }).content)
+
+    def status(self, data):
+        return json.loads(self.client.get(data['status_url']).content)
+
+    @override_settings(URLS_VALIDATION = { 'MODE': 'sync' })
+    @patch('urls.contrib.urls.pool', PoolManagerMock(None))
+    def test_sync_mode_stores_valid(self):
+        data = self.create('http://www.example.com/')
+        self.assertEqual('valid', data['status'])
+        self.assertEqual('valid', self.status(data)['status'])
+
+    @override_settings(URLS_VALIDATION = { 'MODE': 'queue' })
+    @patch('urls.contrib.urls.pool', PoolManagerMock(None, 404))
+    def test_queue_mode_creates_pending_link(self):
+        data = self.create('http://www.example.com/404')
+        self.assertTrue(data['success'])
+        self.assertEqual('pending', data['status'])
+        self.assertEqual('pending', self.status(data)['status'])
+
+        self.assertEqual(1, validation.drain())
+
+        status = self.status(data)
+        self.assertFalse(status['success'])
+        self.assertEqual('http_error', status['status'])
+        self.assertEqual(404, status['status_code'])
+        self.assertEqual(0, validation.drain())
+
+    @override_settings(URLS_VALIDATION = { 'MODE': 'queue' })
+    @patch('urls.contrib.urls.pool', PoolManagerMock(MaxRetryError(None, None, SSLError())))
+    def test_queue_mode_records_bad_ssl(self):
+        data = self.create('https://www.example.com/badssl')
+        validation.drain()
+        self.assertEqual('bad_ssl', self.status(data)['status'])
+
+    @override_settings(URLS_VALIDATION = { 'MODE': 'queue' })
+    def test_scheme_is_still_checked_immediately(self):
+        self.assertFalse(self.create('ftp://www.example.com/')['success'])
+
+    @override_settings(URLS_VALIDATION = { 'MODE': 'thread' })
+    @patch('urls.contrib.validation.submit')
+    def test_thread_mode_submits_pending_link(self, submit):
+        data = self.create('http://www.example.com/')
+        self.assertEqual('pending', data['status'])
+        submit.assert_called_once_with(decode(data['result'].split('/')[-2]), 'http://www.example.com/')
+
+    @override_settings(URLS_VALIDATION = { 'MODE': 'queue' })
+    def test_failed_links_do_not_redirect(self):
+        data = self.create('http://www.example.com/404')
+        with patch('urls.contrib.urls.pool', PoolManagerMock(None, 404)):
+            # cached while pending
+            response = self.client.get(data['result'])
+            self.assertRedirects(response, 'http://www.example.com/404', 301, fetch_redirect_response = False)
+            validation.drain()
+
+        response = self.client.get(data['result'])
+        self.assertRedirects(response, reverse('urls:index'), 302, fetch_redirect_response = False)
+        redirect_cache.clear()
+        response = self.client.get(data['result'])
+        self.assertRedirects(response, reverse('urls:index'), 302, fetch_redirect_response = False)
+
+    @override_settings(URLS_VALIDATION = { 'MODE': 'queue' })
+    def test_queue_mode_validates_failed_links_again(self):
+        with patch('urls.contrib.urls.pool', PoolManagerMock(None, 404)):
+            data = self.create('http://www.example.com/moved')
+            validation.drain()
+        validation_cache.clear()
+
+        again = self.create('http://www.example.com/moved')
+        self.assertEqual(data['result'], again['result'])
+        self.assertEqual('pending', again['status'])
+        with patch('urls.contrib.urls.pool', PoolManagerMock(None)):
+            self.assertEqual(1, validation.drain())
+        self.assertEqual('valid', self.status(data)['status'])
+        response = self.client.get(data['result'])
+        self.assertRedirects(response, 'http://www.example.com/moved', 301, fetch_redirect_response = False)
+
+    @override_settings(URLS_VALIDATION = { 'MODE': 'thread' })
+    @patch('urls.contrib.validation.submit')
+    def test_thread_mode_submits_failed_links_again(self, submit):
+        redirect = URLRedirect.get_or_create('http://www.example.com/', status = UNREACHABLE)
+        data = self.create('http://www.example.com/')
+        self.assertEqual('pending', data['status'])
+        submit.assert_called_once_with(redirect.id, 'http://www.example.com/')
+
+    @override_settings(URLS_VALIDATION = { 'MODE': 'sync' })
+    @patch('urls.contrib.urls.pool', PoolManagerMock(None))
+    def test_sync_mode_records_failed_links_valid_again(self):
+        URLRedirect.get_or_create('http://www.example.com/', status = UNREACHABLE)
+        data = self.create('http://www.example.com/')
+        self.assertEqual('valid', data['status'])
+        self.assertEqual('valid', self.status(data)['status'])
+
 def create_redirect(url):
     obj = URLRedirect.objects.create(original_url = url)
     obj.save()
     return encode(obj.id)
 
+class FeistelAllocatorTests(TestCase):
+
+    def test_permutation_is_a_bijection(self):
+        allocator = FeistelAllocator(key = 'test', max_value = 5000)
+        self.assertEqual(list(range(5000)), sorted(allocator.permute(n) for n in range(5000)))
+
+    def test_permutation_depends_on_key(self):
+        a = FeistelAllocator(key = 'a')
+        b = FeistelAllocator(key = 'b')
+        self.assertNotEqual([ a.permute(n) for n in range(10) ], [ b.permute(n) for n in range(10) ])
+
+    def test_allocated_ids_are_unique_and_non_sequential(self):
+        allocator = FeistelAllocator(key = 'test', block_size = 10)
+        ids = [ allocator.allocate() for idx in range(100) ]
+        self.assertEqual(100, len(set(ids)))
+        self.assertNotEqual(sorted(ids), ids)
+        self.assertTrue(all(0 <= id < 2147483647 for id in ids))
+
+    def test_sequence_reserved_once_per_block(self):
+        allocator = FeistelAllocator(key = 'test', block_size = 10)
+        allocator.allocate()
+        with self.assertNumQueries(0):
+            for idx in range(9):
+                allocator.allocate()
+        self.assertEqual(10, Sequence.objects.get(name = 'urlredirect').value)
+
+    def test_get_or_create_skips_ids_taken_before_allocator(self):
+        allocator = FeistelAllocator(key = 'test', block_size = 10, sequence = 'legacy')
+        taken = allocator.permute(0)
+        URLRedirect.objects.create(id = taken, original_url = 'https://www.example.com/legacy')
+        with patch('urls.models.allocator', allocator):
+            redirect = URLRedirect.get_or_create('https://www.example.com/')
+        self.assertEqual(allocator.permute(1), redirect.id)
+
+class URLRedirectTests(TestCase):
+
+    def test_save_sets_url_hash(self):
+        obj = URLRedirect.objects.create(original_url = 'https://www.example.com/')
+        self.assertEqual(digest('https://www.example.com/'), obj.url_hash)
+        self.assertEqual(32, len(obj.url_hash))
+
+    def test_get_or_create_returns_existing(self):
+        self.assertEqual(
+                URLRedirect.get_or_create('https://www.example.com/').pk, 
+                URLRedirect.get_or_create('https://www.example.com/').pk)
+
+    def test_get_or_create_handles_hash_collisions(self):
+        with patch('urls.models.digest', lambda url: 'a' * 32):
+            a = URLRedirect.get_or_create('https://www.example.com/a')
+            b = URLRedirect.get_or_create('https://www.example.com/b')
+            self.assertEqual(b.pk, URLRedirect.get_or_create('https://www.example.com/b').pk)
+        self.assertNotEqual(a.pk, b.pk)
+        self.assertEqual('https://www.example.com/b', b.original_url)
+        self.assertIsNone(URLRedirect.objects.get(pk = b.pk).url_hash)
+
+    def test_links_without_hash_are_added_to_id_filter(self):
+        ids = IdFilter({ 'ENABLED': True, 'CAPACITY': 1000, 'TRUST_MISSES': True })
+        ids.rebuild()
+        with patch('urls.signals.id_filter', ids), patch('urls.models.digest', lambda url: 'a' * 32):
+            URLRedirect.get_or_create('https://www.example.com/a')
+            b = URLRedirect.get_or_create('https://www.example.com/b')
+        self.assertIn(b.pk, ids.filter)
+
+    def test_get_or_create_queries(self):
+        # reserves a block of ids
+        URLRedirect.get_or_create('https://www.example.com/')
+        with self.assertNumQueries(1):
+            URLRedirect.get_or_create('https://www.example.com/')
+        # the lookup, and the INSERT in a savepoint as TestCase runs in a transaction, see 
+        # GetOrCreateConcurrencyTests for autocommit
+        with self.assertNumQueries(4):
+            URLRedirect.get_or_create('https://www.example.org/')
+
+    def test_get_or_create_returns_concurrently_created(self):
+        def create_first(shard):
+            URLRedirect.objects.create(id = 7, original_url = 'https://www.example.com/')
+            return 8
+        with patch('urls.models.allocate_id', side_effect = create_first):
+            redirect = URLRedirect.get_or_create('https://www.example.com/')
+        self.assertEqual(7, redirect.pk)
+        self.assertEqual(1, URLRedirect.objects.count())
+
+    def test_url_hash_is_unique(self):
+        URLRedirect.objects.create(original_url = 'https://www.example.com/')
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                URLRedirect.objects.create(original_url = 'https://www.example.com/')
+
+    def test_clean_rejects_shortened_url(self):
+        existing = URLRedirect.objects.create(original_url = 'https://www.example.com/')
+        existing.full_clean()
+        with self.assertRaises(DjangoValidationError):
+            URLRedirect(original_url = 'https://www.example.com/').full_clean()
+
+class GetOrCreateConcurrencyTests(TransactionTestCase):
+
+    def test_new_link_outside_a_transaction_queries(self):
+        # reserves a block of ids
+        URLRedirect.get_or_create('https://www.example.com/')
+        # the lookup and the INSERT, without a savepoint
+        with self.assertNumQueries(2):
+            URLRedirect.get_or_create('https://www.example.org/')
+
+    def test_concurrent_creates_make_one_link(self):
+        threads = 8
+        barrier = Barrier(threads)
+        pks = []
+
+        def create(url):
+            try:
+                barrier.wait()
+                pks.append(URLRedirect.get_or_create(url).pk)
+            finally:
+                connection.close()
+
+        for url in ( 'https://www.example.com/', 'https://www.example.org/' ):
+            pks.clear()
+            workers = [ Thread(target = create, args = ( url, )) for idx in range(threads) ]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            self.assertEqual(threads, len(pks))
+            self.assertEqual(1, len(set(pks)))
+            self.assertEqual(pks[:1], list(URLRedirect.objects.filter(original_url = url).values_list('pk', flat = True)))
+
 class RedirectURLViewTests(TestCase):
 
+    def setUp(self):
+        clear_caches()
+
+    def tearDown(self):
+        clear_caches()
+
     def test_temp_redirect_to_index_if_not_found(self):
         response = self.client.get(reverse('urls:redirect', args = ('notindb', )))
         self.assertRedirects(response, reverse('urls:index'), 302, fetch_redirect_response = False)
@@ -250,8 +743,1566 @@ class RedirectURLViewTests(TestCase):
 
         for idx in range(n):
             self.client.get(reverse('urls:redirect', args = (t, )))
+        click_counter.flush()
 
         self.assertEqual(
                 n, 
                 URLRedirect.objects.get(original_url = 'https://www.example.com/').times_used)
 
+    def test_cached_redirect_does_not_read_database(self):
+        t = create_redirect('https://www.example.com/')
+        self.client.get(reverse('urls:redirect', args = (t, )))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('urls:redirect', args = (t, )))
+        self.assertRedirects(response, 'https://www.example.com/', 301, fetch_redirect_response = False)
+
+    def test_cache_invalidated_when_url_edited(self):
+        t = create_redirect('https://www.example.com/')
+        self.client.get(reverse('urls:redirect', args = (t, )))
+
+        obj = URLRedirect.objects.get(pk = decode(t))
+        obj.original_url = 'https://www.example.org/'
+        obj.save()
+
+        response = self.client.get(reverse('urls:redirect', args = (t, )))
+        self.assertRedirects(response, 'https://www.example.org/', 301, fetch_redirect_response = False)
+
+    def test_cache_invalidated_when_deleted(self):
+        t = create_redirect('https://www.example.com/')
+        self.client.get(reverse('urls:redirect', args = (t, )))
+
+        URLRedirect.objects.get(pk = decode(t)).delete()
+
+        response = self.client.get(reverse('urls:redirect', args = (t, )))
+        self.assertRedirects(response, reverse('urls:index'), 302, fetch_redirect_response = False)
+
+class ClickCounterTests(TransactionTestCase):
+
+    def setUp(self):
+        self.counter = ClickCounter({ 'FLUSH_INTERVAL': 3600, 'BATCH_SIZE': 2 })
+        self.pks = [ decode(create_redirect('https://www.example.com/{}'.format(idx))) for idx in range(5) ]
+
+    def tearDown(self):
+        self.counter.clear()
+
+    def times_used(self):
+        return dict(URLRedirect.objects.values_list('pk', 'times_used'))
+
+    def test_increments_are_buffered_until_flush(self):
+        self.counter.incr(self.pks[0])
+        self.counter.incr(self.pks[0])
+        self.assertEqual(2, self.counter.pending(self.pks[0]))
+        self.assertEqual(0, self.times_used()[self.pks[0]])
+
+        self.assertEqual(1, self.counter.flush())
+        self.assertEqual(0, self.counter.pending())
+        self.assertEqual(2, self.times_used()[self.pks[0]])
+
+    def test_incomplete_writer_fails_when_created(self):
+        class Incomplete(BufferedWriter):
+            def new_buffer(self):
+                return []
+        with self.assertRaises(TypeError):
+            Incomplete({ 'FLUSH_INTERVAL': 3600, 'FLUSH_THRESHOLD': 1000, 'BATCH_SIZE': 300, 'BACKGROUND': False })
+
+    def test_flushes_at_threshold(self):
+        counter = ClickCounter({ 'FLUSH_INTERVAL': 3600, 'FLUSH_THRESHOLD': 2 })
+        counter.incr(self.pks[0])
+        counter.incr(self.pks[1])
+        self.assertEqual(0, counter.pending())
+        self.assertEqual(1, self.times_used()[self.pks[1]])
+
+    def test_failed_flush_keeps_increments(self):
+        self.counter.incr(self.pks[0], 3)
+        with patch.object(self.counter, 'write', side_effect = DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.counter.flush()
+        self.assertEqual(3, self.counter.pending(self.pks[0]))
+
+    def test_no_lost_increments_across_concurrent_flushers(self):
+        threads, clicks = 4, 200
+
+        def click():
+            try:
+                for idx in range(clicks):
+                    self.counter.incr(self.pks[idx % len(self.pks)])
+                    if idx % 25 == 0:
+                        self.counter.flush()
+            finally:
+                connection.close()
+
+        workers = [ Thread(target = click) for idx in range(threads) ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.counter.flush()
+
+        self.assertEqual(threads * clicks, sum(self.times_used().values()))
+
+@override_settings(ROOT_URLCONF = 'mysite.urls_async')
+class AsyncCreateURLViewTests(CreateURLViewTests):
+    """
+    Runs CreateURLViewTests against the async views.
+    """
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch('urls.contrib.urls.async_pool', AsyncPoolAdapter())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+@override_settings(ROOT_URLCONF = 'mysite.urls_async')
+class AsyncRedirectURLViewTests(RedirectURLViewTests):
+    """
+    Runs RedirectURLViewTests against the async views.
+    """
+
+class ClickAnalyticsTests(TestCase):
+
+    now = datetime(2026, 3, 10, 12, 30, tzinfo = timezone.utc)
+
+    def setUp(self):
+        clear_caches()
+        self.redirect = URLRedirect.get_or_create('https://www.example.com/')
+        self.short = encode(self.redirect.id)
+
+    def tearDown(self):
+        clear_caches()
+
+    def add_events(self, *times):
+        ClickEvent.objects.bulk_create([ 
+                ClickEvent(redirect = self.redirect, time = time, agent = clicks.BROWSER) for time in times ])
+
+    def rollups(self, period):
+        return dict(ClickRollup.objects
+                .filter(redirect = self.redirect, period = period)
+                .values_list('start', 'clicks'))
+
+    def test_agent_class(self):
+        self.assertEqual(clicks.UNKNOWN, clicks.agent_class(''))
+        self.assertEqual(clicks.BOT, clicks.agent_class('Mozilla/5.0 (compatible; Googlebot/2.1)'))
+        self.assertEqual(clicks.MOBILE, clicks.agent_class('Mozilla/5.0 (iPhone; CPU iPhone OS 17_0) Mobile/15E148'))
+        self.assertEqual(clicks.BROWSER, clicks.agent_class('Mozilla/5.0 (X11; Linux x86_64) Firefox/120.0'))
+
+    def test_referrer_host(self):
+        self.assertEqual('news.example.org', clicks.referrer_host('https://news.example.org/a?b=c'))
+        self.assertEqual('', clicks.referrer_host(None))
+        self.assertEqual('', clicks.referrer_host('http://[invalid'))
+
+    def test_redirect_records_click_event(self):
+        self.client.get(reverse('urls:redirect', args = ( self.short, )), 
+                HTTP_REFERER = 'https://news.example.org/', HTTP_USER_AGENT = 'curl/8.0')
+        self.assertEqual(0, ClickEvent.objects.count())
+        self.assertEqual(1, click_log.pending(self.redirect.id))
+
+        click_log.flush()
+
+        event = ClickEvent.objects.get()
+        self.assertEqual(self.redirect.id, event.redirect_id)
+        self.assertEqual('news.example.org', event.referrer_host)
+        self.assertEqual(clicks.BOT, event.agent)
+
+    def test_rollup_counts_hours_and_days(self):
+        self.add_events(
+                datetime(2026, 3, 9, 23, 59, tzinfo = timezone.utc), 
+                datetime(2026, 3, 10, 10, 1, tzinfo = timezone.utc), 
+                datetime(2026, 3, 10, 10, 59, tzinfo = timezone.utc))
+
+        self.assertEqual(3, clicks.rollup(now = self.now))
+
+        self.assertEqual({
+            datetime(2026, 3, 9, 23, tzinfo = timezone.utc): 1, 
+            datetime(2026, 3, 10, 10, tzinfo = timezone.utc): 2, 
+        }, self.rollups(clicks.HOUR))
+        self.assertEqual({
+            datetime(2026, 3, 9, tzinfo = timezone.utc): 1, 
+            datetime(2026, 3, 10, tzinfo = timezone.utc): 2, 
+        }, self.rollups(clicks.DAY))
+
+    def test_rollup_is_incremental(self):
+        self.add_events(datetime(2026, 3, 10, 10, 1, tzinfo = timezone.utc))
+        clicks.rollup(now = self.now)
+        self.assertEqual(0, clicks.rollup(now = self.now))
+
+        self.add_events(datetime(2026, 3, 10, 10, 2, tzinfo = timezone.utc))
+        self.assertEqual(1, clicks.rollup(now = self.now))
+        self.assertEqual({ datetime(2026, 3, 10, tzinfo = timezone.utc): 2 }, self.rollups(clicks.DAY))
+
+    def test_rollup_leaves_recent_events(self):
+        self.add_events(self.now - timedelta(minutes = 5), self.now - timedelta(seconds = 5))
+        self.assertEqual(1, clicks.rollup(settle = 60, now = self.now))
+        self.assertEqual(0, clicks.rollup(settle = 60, now = self.now))
+        self.assertEqual(1, clicks.rollup(settle = 60, now = self.now + timedelta(minutes = 1)))
+
+    def test_rollup_drops_events_of_deleted_links(self):
+        deleted = URLRedirect.get_or_create('https://www.example.org/')
+        ClickEvent.objects.create(redirect = deleted, time = self.now - timedelta(hours = 1), agent = clicks.BROWSER)
+        self.add_events(self.now - timedelta(hours = 1))
+        deleted.delete()
+
+        self.assertEqual(2, clicks.rollup(now = self.now))
+        self.assertEqual(0, clicks.rollup(now = self.now))
+        # sqlite only checks the foreign keys on commit
+        connection.check_constraints()
+        self.assertFalse(ClickRollup.objects.filter(redirect_id = deleted.id).exists())
+        self.assertEqual(1, sum(self.rollups(clicks.DAY).values()))
+
+    def test_clicks_per_fills_missing_periods(self):
+        self.add_events(datetime(2026, 3, 8, 1, tzinfo = timezone.utc), datetime(2026, 3, 10, 1, tzinfo = timezone.utc))
+        clicks.rollup(now = self.now)
+
+        self.assertEqual([
+            ( datetime(2026, 3, 7, tzinfo = timezone.utc), 0 ), 
+            ( datetime(2026, 3, 8, tzinfo = timezone.utc), 1 ), 
+            ( datetime(2026, 3, 9, tzinfo = timezone.utc), 0 ), 
+            ( datetime(2026, 3, 10, tzinfo = timezone.utc), 1 ), 
+        ], clicks.clicks_per(self.redirect.id, clicks.DAY, 4, now = self.now))
+
+    @skipUnless(connection.vendor == 'sqlite', 'reads the sqlite query plan')
+    def test_clicks_per_reads_only_the_index(self):
+        plan = (ClickRollup.objects
+                .filter(redirect_id = self.redirect.id, period = clicks.DAY, start__gte = self.now)
+                .values_list('start', 'clicks')
+                .explain())
+        self.assertIn('COVERING INDEX urls_rollup_clicks_idx', plan)
+
+    def test_stats_view(self):
+        self.add_events(timezone.now() - timedelta(hours = 1))
+        clicks.rollup(settle = 0)
+
+        response = self.client.get(reverse('urls:stats', args = ( self.short, )), { 'count': 7 })
+        data = json.loads(response.content)
+
+        self.assertTrue(data['success'])
+        self.assertEqual('day', data['period'])
+        self.assertEqual(7, len(data['clicks']))
+        self.assertEqual(1, data['total'])
+
+    def test_stats_view_rejects_bad_parameters(self):
+        for params in ( { 'period': 'week' }, { 'count': 0 }, { 'count': 'x' }, { 'count': 10000 } ):
+            with self.subTest(params = params):
+                response = self.client.get(reverse('urls:stats', args = ( self.short, )), params)
+                self.assertEqual(404, response.status_code)
+        response = self.client.get(reverse('urls:stats', args = ( 'notindb', )))
+        self.assertEqual(404, response.status_code)
+
+    def test_rollup_clicks_command_prunes(self):
+        self.add_events(timezone.now() - timedelta(hours = 1))
+        out = StringIO()
+        call_command('rollup_clicks', '--prune', stdout = out)
+
+        self.assertIn('Rolled up 1 clicks', out.getvalue())
+        self.assertEqual(0, ClickEvent.objects.count())
+        self.assertEqual(1, sum(self.rollups(clicks.DAY).values()))
+
+class SnapshotTests(TestCase):
+
+    def setUp(self):
+        clear_caches()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = directory.name
+
+    def tearDown(self):
+        clear_caches()
+
+    def files(self):
+        return sorted(name for name in os.listdir(self.path) if name.endswith('.snap'))
+
+    def test_segment_round_trip(self):
+        path = os.path.join(self.path, 'test.snap')
+        rows = [ ( 3, 'https://www.example.com/' ), ( 7, 'https://www.example.com/caf\u00e9' ), ( 2 ** 31, '' ) ]
+        self.assertEqual(3, write_segment(path, rows))
+
+        segment = Segment(path)
+        self.assertEqual(3, len(segment))
+        for pk, url in rows:
+            self.assertEqual(url, segment.get(pk))
+        for pk in ( 0, 4, 8, 2 ** 32 - 1 ):
+            self.assertIsNone(segment.get(pk))
+
+    def test_empty_segment(self):
+        path = os.path.join(self.path, 'test.snap')
+        write_segment(path, [])
+        self.assertIsNone(Segment(path).get(1))
+
+    def test_export_full_then_delta(self):
+        first = URLRedirect.get_or_create('https://www.example.com/1')
+        self.assertEqual('full', snapshot.export(self.path)['kind'])
+        second = URLRedirect.get_or_create('https://www.example.com/2')
+        result = snapshot.export(self.path, overlap = 0)
+
+        self.assertEqual({ 'segment': 'delta-00000002.snap', 'kind': 'delta', 'entries': 1 }, result)
+        reader = Snapshot(self.path, 0)
+        self.assertEqual('https://www.example.com/1', reader.get(first.id))
+        self.assertEqual('https://www.example.com/2', reader.get(second.id))
+        self.assertEqual(2, reader.stats()['entries'])
+
+    def test_failed_links_are_not_exported(self):
+        valid = URLRedirect.get_or_create('https://www.example.com/1')
+        failed = URLRedirect.get_or_create('https://www.example.com/2', status = UNREACHABLE)
+        self.assertEqual(1, snapshot.export(self.path)['entries'])
+        reader = Snapshot(self.path, 0)
+        self.assertEqual('https://www.example.com/1', reader.get(valid.id))
+        self.assertIsNone(reader.get(failed.id))
+
+    def test_full_snapshot_replaces_deltas(self):
+        URLRedirect.get_or_create('https://www.example.com/1')
+        snapshot.export(self.path)
+        snapshot.export(self.path, max_deltas = 1)
+        self.assertEqual([ 'delta-00000002.snap', 'full-00000001.snap' ], self.files())
+
+        self.assertEqual('full', snapshot.export(self.path, max_deltas = 1)['kind'])
+        self.assertEqual([ 'full-00000003.snap' ], self.files())
+
+    def test_reader_reloads_new_snapshot(self):
+        reader = Snapshot(self.path, 0)
+        redirect = URLRedirect.get_or_create('https://www.example.com/')
+        self.assertIsNone(reader.get(redirect.id))
+
+        snapshot.export(self.path)
+        self.assertEqual('https://www.example.com/', reader.get(redirect.id))
+
+    def test_redirect_served_from_snapshot(self):
+        t = create_redirect('https://www.example.com/')
+        snapshot.export(self.path)
+        missing = create_redirect('https://www.example.org/')
+
+        with patch('urls.contrib.snapshot.snapshot', Snapshot(self.path, 0)):
+            with self.assertNumQueries(0):
+                response = self.client.get(reverse('urls:redirect', args = (t, )))
+            self.assertRedirects(response, 'https://www.example.com/', 301, fetch_redirect_response = False)
+
+            # not in the snapshot yet, read from the database
+            response = self.client.get(reverse('urls:redirect', args = (missing, )))
+            self.assertRedirects(response, 'https://www.example.org/', 301, fetch_redirect_response = False)
+
+    def test_edited_and_deleted_links_are_revoked(self):
+        edited = URLRedirect.get_or_create('https://www.example.com/1')
+        expired = URLRedirect.get_or_create('https://www.example.com/2')
+        deleted = [ URLRedirect.get_or_create('https://www.example.com/{}'.format(idx)) for idx in ( 3, 4 ) ]
+        snapshot.export(self.path)
+
+        with patch('urls.contrib.snapshot.snapshot', Snapshot(self.path, 0)):
+            with self.captureOnCommitCallbacks(execute = True):
+                edited.original_url = 'https://www.example.org/'
+                edited.save()
+            with self.captureOnCommitCallbacks(execute = True):
+                expired.expires = timezone.now() - timedelta(seconds = 1)
+                expired.save()
+            with self.captureOnCommitCallbacks(execute = True):
+                URLRedirect.objects.filter(pk__in = [ redirect.pk for redirect in deleted ]).delete()
+            # the id reused by a new link
+            URLRedirect.objects.create(id = deleted[0].pk, original_url = 'https://www.example.net/')
+
+            for redirect, url in (
+                    ( edited, 'https://www.example.org/' ), 
+                    ( expired, reverse('urls:index') ), 
+                    ( deleted[0], 'https://www.example.net/' ), 
+                    ( deleted[1], reverse('urls:index') ) ):
+                response = self.client.get(reverse('urls:redirect', args = ( encode(redirect.pk), )))
+                self.assertEqual(url, response['Location'])
+        # one segment per transaction
+        self.assertEqual(4, len(self.files()))
+
+    def test_import_makes_the_next_export_full(self):
+        URLRedirect.get_or_create('https://www.example.com/')
+        snapshot.export(self.path)
+        row = { 'id': 17, 'original_url': 'https://www.example.org/', 'created': timezone.now() - timedelta(days = 30) }
+        with override_settings(URLS_SNAPSHOT = { 'ENABLED': True, 'PATH': self.path }):
+            transfer.import_rows([ row ])
+
+        self.assertEqual('full', snapshot.export(self.path)['kind'])
+        self.assertEqual('https://www.example.org/', Snapshot(self.path, 0).get(17))
+        self.assertEqual('delta', snapshot.export(self.path)['kind'])
+
+    def test_full_export_requested_while_exporting_is_kept(self):
+        URLRedirect.get_or_create('https://www.example.com/')
+        snapshot.export(self.path)
+        write = snapshot.write_segment
+
+        def write_and_request(path, rows):
+            count = write(path, rows)
+            snapshot.require_full(self.path)
+            return count
+        with patch('urls.contrib.snapshot.write_segment', write_and_request):
+            self.assertEqual('full', snapshot.export(self.path, full = True)['kind'])
+        self.assertEqual('full', snapshot.export(self.path)['kind'])
+        self.assertEqual('delta', snapshot.export(self.path)['kind'])
+
+    def test_revoke_skips_ids_not_in_snapshot(self):
+        redirect = URLRedirect.get_or_create('https://www.example.com/')
+        snapshot.export(self.path)
+        self.assertEqual(0, snapshot.revoke([ redirect.pk + 1 ], self.path))
+        self.assertEqual(1, snapshot.revoke([ redirect.pk, redirect.pk + 1 ], self.path))
+        self.assertEqual(0, snapshot.revoke([ redirect.pk ], self.path))
+        self.assertIsNone(Snapshot(self.path, 0).get(redirect.pk))
+
+    def test_full_export_keeps_revocations_made_while_exporting(self):
+        redirect = URLRedirect.get_or_create('https://www.example.com/')
+        snapshot.export(self.path)
+        fan_out = shard_map.fan_out
+
+        def revoke_then_read(*args, **kwargs):
+            snapshot.revoke([ redirect.pk ], self.path)
+            return fan_out(*args, **kwargs)
+
+        with patch.object(shard_map, 'fan_out', side_effect = revoke_then_read):
+            snapshot.export(self.path, full = True)
+        self.assertIsNone(Snapshot(self.path, 0).get(redirect.pk))
+
+    def test_snapshot_redirects_command(self):
+        URLRedirect.get_or_create('https://www.example.com/')
+        out = StringIO()
+        call_command('snapshot_redirects', '--path', self.path, stdout = out)
+        self.assertIn('Wrote 1 urls to the full segment full-00000001.snap', out.getvalue())
+
+@override_settings(URLS_DATABASE_ROUTER = { 'REPLICAS': { 'replica': 1 } })
+class ReplicaRouterTests(TestCase):
+    """
+    The replica is a separate test database which is not replicated to, so reads which 
+    reach it do not see rows created on the primary.
+    """
+
+    databases = { 'default', 'replica' }
+
+    def setUp(self):
+        clear_caches()
+        self.router = router.routers[0]
+        self.router._down.clear()
+        patcher = patch('urls.contrib.urls.pool', PoolManagerMock(None))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        clear_caches()
+
+    def redirect(self, short):
+        return self.client.get(reverse('urls:redirect', args = ( short, )))
+
+    def test_redirect_reads_replica(self):
+        redirect = URLRedirect(id = 1, original_url = 'https://www.example.com/')
+        redirect.save(using = 'replica')
+        self.assertRedirects(self.redirect(encode(1)), 'https://www.example.com/', 301, fetch_redirect_response = False)
+
+        URLRedirect.objects.using('default').create(id = 2, original_url = 'https://www.example.org/')
+        self.assertRedirects(self.redirect(encode(2)), reverse('urls:index'), 302, fetch_redirect_response = False)
+
+    def test_created_link_resolves_for_creator(self):
+        response = self.client.post(reverse('urls:create'), { 'url': 'https://www.example.com/' })
+        self.assertIn(PIN_COOKIE, response.cookies)
+        short = json.loads(response.content)['result'].rstrip('/').rsplit('/', 1)[-1]
+
+        self.assertTrue(URLRedirect.objects.using('default').filter(pk = decode(short)).exists())
+        self.assertRedirects(self.redirect(short), 'https://www.example.com/', 301, fetch_redirect_response = False)
+
+        # another client reads the replica, which has not caught up
+        self.client.cookies.clear()
+        clear_caches()
+        self.assertRedirects(self.redirect(short), reverse('urls:index'), 302, fetch_redirect_response = False)
+
+    def test_reads_from_primary_outside_requests(self):
+        self.assertEqual('default', router.db_for_read(URLRedirect))
+        self.assertEqual('default', router.db_for_write(URLRedirect))
+
+    def test_unavailable_replica_fails_over_to_primary(self):
+        URLRedirect.objects.using('default').create(id = 2, original_url = 'https://www.example.org/')
+        with patch.object(connections['replica'], 'ensure_connection', side_effect = OperationalError('down')), \
+                self.assertLogs('urls.routers', 'WARNING'):
+            self.assertRedirects(self.redirect(encode(2)), 'https://www.example.org/', 301, fetch_redirect_response = False)
+        self.assertIn('replica', self.router._down)
+
+    @override_settings(URLS_DATABASE_ROUTER = { 'REPLICAS': { 'default': 0, 'replica': 1 } })
+    def test_choose_by_weight(self):
+        self.assertEqual({ 'replica' }, set(self.router.choose() for idx in range(20)))
+
+class HistogramTests(SimpleTestCase):
+
+    def test_cumulative_counts(self):
+        histogram = Histogram(( 1, 5 ))
+        for value in ( 0.5, 1, 2, 10 ):
+            histogram.observe(value)
+        self.assertEqual([ ( 1, 2 ), ( 5, 3 ), ( float('inf'), 4 ) ], histogram.cumulative())
+        self.assertEqual(13.5, histogram.sum)
+        self.assertEqual(4, histogram.count)
+
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        clear_caches()
+        registry.clear()
+        patcher = patch('urls.contrib.urls.pool', PoolManagerMock(None))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        clear_caches()
+
+    def stages(self, response):
+        return [ timing.split(';')[0] for timing in response['Server-Timing'].split(', ') ]
+
+    def test_create_server_timing(self):
+        response = self.client.post(reverse('urls:create'), { 'url' : 'https://www.example.com/' })
+        self.assertEqual(
+                [ 'canonicalize', 'hostname', 'validate', 'db', 'encode', 'total' ], 
+                self.stages(response))
+
+    def test_redirect_server_timing(self):
+        t = create_redirect('https://www.example.com/')
+        response = self.client.get(reverse('urls:redirect', args = (t, )))
+        self.assertIn('decode', self.stages(response))
+        self.assertIn('count', self.stages(response))
+        self.assertEqual('total', self.stages(response)[-1])
+
+    def test_metrics_endpoint(self):
+        t = create_redirect('https://www.example.com/')
+        self.client.get(reverse('urls:redirect', args = (t, )))
+        self.client.get(reverse('urls:redirect', args = (t, )))
+
+        response = self.client.get(reverse('urls:metrics'))
+        self.assertEqual(200, response.status_code)
+        text = response.content.decode('utf-8')
+        self.assertIn('urls_request_seconds_count{view="redirect"} 2\n', text)
+        self.assertIn('urls_request_queries_bucket{view="redirect",le="+Inf"} 2\n', text)
+        self.assertIn('urls_stage_seconds_count{view="redirect",stage="decode"} 2\n', text)
+        self.assertIn('urls_redirect_cache{stat="local_hits"} 1\n', text)
+        self.assertIn('urls_click_counter_pending 2\n', text)
+
+    def test_request_queries_counted(self):
+        t = create_redirect('https://www.example.com/')
+        self.client.get(reverse('urls:redirect', args = (t, )))
+        self.client.get(reverse('urls:redirect', args = (t, )))
+
+        histogram = registry.histogram('urls_request_queries', (( 'view', 'redirect' ),))
+        # the first redirect reads the database, the second is served from the cache
+        self.assertEqual(1, histogram.sum)
+
+    def test_metrics_endpoint_forbidden_to_other_hosts(self):
+        response = self.client.get(reverse('urls:metrics'), REMOTE_ADDR = '10.0.0.1')
+        self.assertEqual(403, response.status_code)
+
+    @override_settings(URLS_METRICS = { 'ALLOWED_IPS': None })
+    def test_metrics_endpoint_allowed_ips_none(self):
+        response = self.client.get(reverse('urls:metrics'), REMOTE_ADDR = '10.0.0.1')
+        self.assertEqual(200, response.status_code)
+
+@override_settings(ROOT_URLCONF = 'mysite.urls_async')
+class AsyncMetricsTests(MetricsTests):
+    """
+    Runs MetricsTests against the async views.
+    """
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch('urls.contrib.urls.async_pool', AsyncPoolAdapter())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_request_queries_counted(self):
+        t = create_redirect('https://www.example.com/')
+        self.client.get(reverse('urls:redirect', args = (t, )))
+
+        histogram = registry.histogram('urls_request_queries', (( 'view', 'redirect' ),))
+        # queries made through sync_to_async still count towards the request
+        self.assertEqual(1, histogram.sum)
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    def do_HEAD(self):
+        if self.path == '/loop':
+            self.send_response(302)
+            self.send_header('Location', '/loop')
+        elif self.path == '/moved':
+            self.send_response(301)
+            self.send_header('Location', '/')
+        else:
+            self.send_response(200 if self.path == '/' else 404)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+class AsyncPoolManagerTests(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = HTTPServer(( '127.0.0.1', 0 ), StubHandler)
+        cls.url = 'http://127.0.0.1:{}'.format(cls.server.server_port)
+        Thread(target = cls.server.serve_forever, daemon = True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def request(self, path):
+        return asyncio.run(AsyncPoolManager().request('HEAD', self.url + path, timeout = 2))
+
+    def test_status(self):
+        self.assertEqual(200, self.request('/').status)
+        self.assertEqual(404, self.request('/missing').status)
+
+    def test_follows_redirects(self):
+        self.assertEqual(200, self.request('/moved').status)
+
+    def test_too_many_redirects(self):
+        with self.assertRaises(MaxRetryError) as cm:
+            self.request('/loop')
+        self.assertEqual('too many redirects', str(cm.exception.reason))
+
+    def test_connection_refused(self):
+        server = HTTPServer(( '127.0.0.1', 0 ), StubHandler)
+        url = 'http://127.0.0.1:{}/'.format(server.server_port)
+        server.server_close()
+        with self.assertRaises(MaxRetryError) as cm:
+            asyncio.run(AsyncPoolManager().request('HEAD', url, timeout = 2))
+        self.assertIsInstance(cm.exception.reason, NewConnectionError)
+
+class ShardMapTests(SimpleTestCase):
+
+    def test_ids_map_to_ranges(self):
+        shards = ShardMap([ 'a', 'b', 'c' ], max_value = 30)
+        self.assertEqual([ ( 0, 10 ), ( 10, 20 ), ( 20, 30 ) ], [ ( shard.start, shard.end ) for shard in shards ])
+        self.assertEqual('a', shards.for_id(9).alias)
+        self.assertEqual('b', shards.for_id(10).alias)
+        self.assertEqual('c', shards.for_id(29).alias)
+        self.assertEqual('c', shards.using_id(29))
+
+    def test_single_shard_uses_routers(self):
+        shards = ShardMap([ 'default' ])
+        self.assertFalse(shards.sharded)
+        self.assertIsNone(shards.using_id(12345))
+        self.assertIsNone(shards.using_url('https://www.example.com/'))
+
+    def test_urls_are_spread_over_shards(self):
+        shards = ShardMap([ 'a', 'b' ])
+        owners = [ shards.for_url('https://www.example.com/{}'.format(idx)).alias for idx in range(100) ]
+        self.assertEqual(owners, [ shards.for_url('https://www.example.com/{}'.format(idx)).alias for idx in range(100) ])
+        self.assertTrue(20 < owners.count('a') < 80)
+
+    def test_sharded_allocator_stays_in_range(self):
+        shards = ShardMap([ 'a', 'b' ], max_value = 1000)
+        shard = shards.shards[1]
+        allocator = FeistelAllocator(key = 'test', max_value = shard.end - shard.start, offset = shard.start)
+        ids = [ allocator.offset + allocator.permute(n) for n in range(500) ]
+        self.assertEqual(500, len(set(ids)))
+        self.assertTrue(all(id in shard for id in ids))
+
+class ShardingTests(TestCase):
+    """
+    Shards the links over the two test databases.
+    """
+
+    databases = { 'default', 'replica' }
+
+    def setUp(self):
+        clear_caches()
+        shard_map.configure([ 'default', 'replica' ])
+        self.addCleanup(shard_map.configure, [ 'default' ])
+        patcher = patch('urls.contrib.urls.pool', PoolManagerMock(None))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        clear_caches()
+
+    def url_on(self, alias, exclude = ()):
+        for idx in range(1000):
+            url = 'https://www.example.com/{}'.format(idx)
+            if shard_map.for_url(url).alias == alias and url not in exclude:
+                return url
+
+    def test_get_or_create_uses_owner_shard(self):
+        for alias in shard_map.aliases:
+            url = self.url_on(alias)
+            redirect = URLRedirect.get_or_create(url)
+            self.assertEqual(alias, redirect._state.db)
+            self.assertIn(redirect.id, shard_map.for_id(redirect.id))
+            self.assertEqual(alias, shard_map.for_id(redirect.id).alias)
+            self.assertEqual(redirect.id, URLRedirect.get_or_create(url).id)
+            self.assertTrue(URLRedirect.objects.using(alias).filter(pk = redirect.id).exists())
+
+    def test_redirect_and_status_read_the_shard(self):
+        redirect = URLRedirect.get_or_create(self.url_on('replica'), VALID)
+        short = encode(redirect.id)
+        response = self.client.get(reverse('urls:redirect', args = ( short, )))
+        self.assertRedirects(response, redirect.original_url, 301, fetch_redirect_response = False)
+
+        data = json.loads(self.client.get(reverse('urls:status', args = ( short, ))).content)
+        self.assertEqual(VALID, data['status'])
+
+    def test_edits_are_saved_to_the_shard(self):
+        redirect = URLRedirect.get_or_create(self.url_on('replica'))
+        redirect.status_message = 'edited'
+        redirect.save()
+        self.assertEqual('edited', URLRedirect.objects.using('replica').get(pk = redirect.id).status_message)
+        self.assertFalse(URLRedirect.objects.using('default').filter(pk = redirect.id).exists())
+
+    def test_counter_flushes_each_shard(self):
+        pks = [ URLRedirect.get_or_create(self.url_on(alias)).id for alias in shard_map.aliases ]
+        counter = ClickCounter({ 'FLUSH_INTERVAL': 3600, 'FLUSH_THRESHOLD': 1000 })
+        counter.incr(pks[0], 2)
+        counter.incr(pks[1], 3)
+        self.assertEqual(2, counter.flush())
+        self.assertEqual(2, URLRedirect.objects.using('default').get(pk = pks[0]).times_used)
+        self.assertEqual(3, URLRedirect.objects.using('replica').get(pk = pks[1]).times_used)
+
+    def test_clicks_are_rolled_up_on_each_shard(self):
+        pks = [ URLRedirect.get_or_create(self.url_on(alias)).id for alias in shard_map.aliases ]
+        for pk in pks:
+            self.client.get(reverse('urls:redirect', args = ( encode(pk), )))
+        click_log.flush()
+        self.assertEqual(1, ClickEvent.objects.using('replica').count())
+
+        self.assertEqual(2, clicks.rollup(settle = 0))
+        for pk in pks:
+            self.assertEqual(1, sum(n for start, n in clicks.clicks_per(pk)))
+
+    def test_fan_out_merges_shards(self):
+        urls = [ self.url_on('default'), self.url_on('replica') ]
+        urls.append(self.url_on('default', exclude = urls))
+        pks = [ URLRedirect.get_or_create(url).id for url in urls ]
+
+        queryset = URLRedirect.objects.order_by('pk').values_list('pk', flat = True)
+        self.assertEqual(sorted(pks), list(shard_map.fan_out(queryset)))
+        self.assertEqual(sorted(pks)[:2], list(shard_map.fan_out(queryset, limit = 2)))
+
+        queryset = URLRedirect.objects.order_by('original_url').values_list('original_url', flat = True)
+        self.assertEqual(sorted(urls), list(shard_map.fan_out(queryset, key = lambda url: url)))
+
+    def test_bulk_shorten_spreads_links(self):
+        urls = [ self.url_on('default'), self.url_on('replica') ]
+        results = list(bulk.shorten_many(urls + urls[:1]))
+        self.assertTrue(all(result['success'] for result in results))
+        self.assertEqual(results[0]['short'], results[2]['short'])
+        for alias, result in zip(shard_map.aliases, results):
+            self.assertEqual(alias, shard_map.for_id(decode(result['short'])).alias)
+            self.assertTrue(URLRedirect.objects.using(alias).filter(pk = decode(result['short'])).exists())
+
+    def test_admin_lists_and_edits_one_shard(self):
+        redirect = URLRedirect.get_or_create(self.url_on('replica'))
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username = 'admin', password = 'password')
+
+        changelist = reverse('admin:urls_urlredirect_changelist')
+        self.assertNotContains(self.client.get(changelist), redirect.original_url)
+        self.assertContains(self.client.get(changelist, { 'shard': 'replica' }), redirect.original_url)
+        response = self.client.get(reverse('admin:urls_urlredirect_change', args = ( redirect.id, )))
+        self.assertContains(response, redirect.original_url)
+
+class TransferTests(TestCase):
+
+    def setUp(self):
+        clear_caches()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.created = datetime(2020, 1, 2, 3, 4, 5, tzinfo = timezone.utc)
+        for id in ( 5, 17, 230, 4000, 99999 ):
+            URLRedirect.objects.create(id = id, original_url = 'https://www.example.com/{}'.format(id), 
+                    times_used = id % 7, created = self.created, status_code = 200)
+        URLRedirect.objects.filter(pk = 230).update(
+                expires = self.created + timedelta(days = 30), max_idle = timedelta(days = 7, seconds = 1))
+        URLRedirect.objects.filter(pk = 4000).update(permanent = False)
+        URLRedirect.objects.filter(pk = 99999).update(permanent = True)
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def rows(self):
+        return list(URLRedirect.objects.order_by('pk').values_list(*transfer.COLUMNS))
+
+    def test_export_pages_by_id(self):
+        stream = StringIO()
+        # 5 rows in chunks of 2, the last query finds the 5th row only
+        with self.assertNumQueries(3):
+            self.assertEqual(5, transfer.export(stream, chunk_size = 2))
+        rows = [ json.loads(line) for line in stream.getvalue().splitlines() ]
+        self.assertEqual([ 5, 17, 230, 4000, 99999 ], [ row['id'] for row in rows ])
+        self.assertEqual(encode(230), rows[2]['short'])
+        self.assertEqual(self.created.isoformat(), rows[2]['created'])
+
+    def test_round_trip(self):
+        for name in ( 'urls.jsonl', 'urls.csv', 'urls.jsonl.gz', 'urls.csv.bz2', 'urls.jsonl.xz' ):
+            expected = self.rows()
+            call_command('export_urls', self.path(name), chunk_size = 2, stderr = StringIO())
+            URLRedirect.objects.all().delete()
+
+            stdout = StringIO()
+            call_command('import_urls', self.path(name), batch_size = 2, stdout = stdout, stderr = StringIO())
+            self.assertIn('Created 5, updated 0 and skipped 0', stdout.getvalue())
+            self.assertEqual(expected, self.rows(), name)
+            self.assertEqual(digest('https://www.example.com/17'), URLRedirect.objects.get(pk = 17).url_hash)
+            self.assertEqual(timedelta(days = 7, seconds = 1), URLRedirect.objects.get(pk = 230).max_idle)
+            self.assertIsNone(URLRedirect.objects.get(pk = 17).expires)
+            self.assertEqual([ None, False, True ], [ URLRedirect.objects.get(pk = pk).permanent for pk in ( 17, 4000, 99999 ) ])
+
+    def test_import_skips_or_updates_existing(self):
+        call_command('export_urls', self.path('urls.jsonl'), stderr = StringIO())
+        URLRedirect.objects.filter(pk = 17).update(times_used = 100)
+        URLRedirect.objects.filter(pk = 4000).delete()
+
+        stdout = StringIO()
+        call_command('import_urls', self.path('urls.jsonl'), stdout = stdout, stderr = StringIO())
+        self.assertIn('Created 1, updated 0 and skipped 4', stdout.getvalue())
+        self.assertEqual(100, URLRedirect.objects.get(pk = 17).times_used)
+
+        stdout = StringIO()
+        call_command('import_urls', self.path('urls.jsonl'), update = True, stdout = stdout, stderr = StringIO())
+        self.assertIn('Created 0, updated 5 and skipped 0', stdout.getvalue())
+        self.assertEqual(17 % 7, URLRedirect.objects.get(pk = 17).times_used)
+
+    def test_import_keeps_duplicate_urls_without_hash(self):
+        with open(self.path('urls.jsonl'), 'w') as f:
+            for id in ( 6, 7 ):
+                f.write(json.dumps({ 'id': id, 'original_url': 'https://www.example.com/5' }) + '\n')
+        call_command('import_urls', self.path('urls.jsonl'), stdout = StringIO(), stderr = StringIO())
+        self.assertEqual([ ( 5, digest('https://www.example.com/5') ), ( 6, None ), ( 7, None ) ], 
+                list(URLRedirect.objects.filter(pk__lte = 7).order_by('pk').values_list('pk', 'url_hash')))
+        self.assertEqual(5, URLRedirect.get_or_create('https://www.example.com/5').pk)
+
+    def test_import_update_invalidates_cached_redirects(self):
+        short = encode(17)
+        response = self.client.get(reverse('urls:redirect', args = ( short, )))
+        self.assertEqual('https://www.example.com/17', response['Location'])
+        redirect_cache.pin({ 17: 'https://www.example.com/17' })
+
+        transfer.import_rows([ { 'id': 17, 'original_url': 'https://www.example.org/' } ], mode = transfer.UPDATE)
+        response = self.client.get(reverse('urls:redirect', args = ( short, )))
+        self.assertEqual('https://www.example.org/', response['Location'])
+
+    def test_import_reads_short_codes(self):
+        with open(self.path('urls.csv'), 'w') as f:
+            f.write('short,original_url\n{},https://www.example.org/\n'.format(encode(123456)))
+        call_command('import_urls', self.path('urls.csv'), stdout = StringIO(), stderr = StringIO())
+        redirect = URLRedirect.objects.get(pk = 123456)
+        self.assertEqual('https://www.example.org/', redirect.original_url)
+        self.assertEqual(VALID, redirect.status)
+
+    def test_invalid_row_raises_error(self):
+        with open(self.path('urls.jsonl'), 'w') as f:
+            f.write('{"id": 1, "original_url": "https://www.example.org/"}\n{"original_url": "https://www.example.org/"}\n')
+        with self.assertRaisesMessage(CommandError, 'Invalid row 2'):
+            call_command('import_urls', self.path('urls.jsonl'), stdout = StringIO(), stderr = StringIO())
+        with self.assertRaisesMessage(ValueError, 'invalid expiry time'):
+            transfer.parse_row({ 'id': 1, 'original_url': 'https://www.example.org/', 'expires': 'soon' })
+        with self.assertRaisesMessage(ValueError, 'invalid permanent flag'):
+            transfer.parse_row({ 'id': 1, 'original_url': 'https://www.example.org/', 'permanent': 'maybe' })
+
+class AdminTests(TestCase):
+
+    def setUp(self):
+        clear_caches()
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username = 'admin', password = 'password')
+        self.now = datetime(2026, 3, 10, 12, tzinfo = timezone.utc)
+        self.redirects = [ URLRedirect.objects.create(id = id, original_url = 'https://www.example.com/{}'.format(idx), 
+                    times_used = idx % 3, created = self.now - timedelta(hours = idx)) 
+                for idx, id in enumerate(( 901, 17, 450, 3, 77 )) ]
+        patcher = patch.object(URLRedirectAdmin, 'list_per_page', 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def changelist(self, **params):
+        return self.client.get(reverse('admin:urls_urlredirect_changelist'), params)
+
+    def pages(self, **params):
+        response = self.changelist(**params)
+        pages = []
+        while True:
+            cl = response.context['cl']
+            pages.append([ redirect.id for redirect in cl.result_list ])
+            if not cl.next_url:
+                return pages
+            response = self.client.get(reverse('admin:urls_urlredirect_changelist') + cl.next_url)
+
+    def test_changelist_pages_by_key(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.changelist()
+        self.assertFalse([ query for query in queries if 'OFFSET' in query['sql'] ])
+        self.assertEqual([ [ 901, 17 ], [ 450, 3 ], [ 77 ] ], self.pages())
+
+    def test_changelist_pages_sorted_by_times_used(self):
+        # times_used is the third column
+        pages = self.pages(o = '-3')
+        # ties are ordered by the default ordering, newest first
+        self.assertEqual([ [ 450, 17 ], [ 77, 901 ], [ 3 ] ], pages)
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.changelist(after = 'nonsense')
+        self.assertRedirects(response, reverse('admin:urls_urlredirect_changelist') + '?e=1', fetch_redirect_response = False)
+
+    def test_unfiltered_count_is_estimated(self):
+        with patch('urls.contrib.pagination.table_estimate', return_value = 1234567):
+            response = self.changelist()
+        self.assertEqual(1234567, response.context['cl'].result_count)
+        self.assertContains(response, '~1234567 url redirects')
+
+        with patch('urls.contrib.pagination.table_estimate', return_value = 1234567):
+            response = self.changelist(used = '1-9')
+        self.assertEqual(3, response.context['cl'].result_count)
+
+    @skipUnless(connection.vendor == 'sqlite', 'reads sqlite_stat1')
+    def test_table_estimate_reads_statistics(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.assertEqual(5, pagination.table_estimate(URLRedirect, 'default'))
+
+    def test_times_used_filter(self):
+        ids = sum(self.pages(used = '0'), [])
+        self.assertEqual({ 901, 3 }, set(ids))
+
+    def test_search_by_code_and_url(self):
+        for term, expected in (
+                ( encode(450), [ 450 ] ), 
+                ( 'http://testserver' + reverse('urls:redirect', args = ( encode(17), )), [ 17 ] ), 
+                ( 'https://www.example.com/4', [ 77 ] ), 
+                ( 'example', [] ), 
+                ( 'http://[invalid/', [] ), ):
+            cl = self.changelist(q = term).context['cl']
+            self.assertEqual(expected, [ redirect.id for redirect in cl.result_list ], term)
+
+    def test_top_links(self):
+        for redirect, clicked in zip(self.redirects, ( 1, 5, 3 )):
+            ClickRollup.objects.create(redirect = redirect, period = clicks.DAY, 
+                    start = clicks.truncate(self.now, clicks.DAY), clicks = clicked)
+        self.assertEqual(7, top.refresh(size = 4, now = self.now))
+
+        ranked = lambda kind: list(TopLink.objects.filter(kind = kind).order_by('rank').values_list('link_id', 'value'))
+        self.assertEqual([ ( 450, 2 ), ( 77, 1 ), ( 17, 1 ), ( 901, 0 ) ], ranked(top.TIMES_USED))
+        self.assertEqual([ ( 17, 5 ), ( 450, 3 ), ( 901, 1 ) ], ranked(top.RECENT_CLICKS))
+
+        response = self.client.get(reverse('admin:urls_urlredirect_top'))
+        self.assertContains(response, 'https://www.example.com/1')
+        self.assertContains(response, reverse('admin:urls_urlredirect_change', args = ( 17, )))
+
+class ExpiryTests(TestCase):
+
+    def setUp(self):
+        clear_caches()
+        self.now = timezone.now()
+
+    def tearDown(self):
+        clear_caches()
+
+    def create(self, id, expires = None, max_idle = None):
+        return URLRedirect.objects.create(id = id, original_url = 'https://www.example.com/{}'.format(id), 
+                expires = expires, max_idle = max_idle)
+
+    def redirect(self, pk):
+        return self.client.get(reverse('urls:redirect', args = ( encode(pk), )))
+
+    def test_expired_link_does_not_redirect(self):
+        self.create(1, expires = self.now + timedelta(hours = 1))
+        self.create(2, expires = self.now - timedelta(seconds = 1))
+        self.assertRedirects(self.redirect(1), 'https://www.example.com/1', 301, fetch_redirect_response = False)
+        self.assertRedirects(self.redirect(2), reverse('urls:index'), 302, fetch_redirect_response = False)
+
+    def test_cached_link_expires(self):
+        self.create(1, expires = self.now + timedelta(hours = 1))
+        self.redirect(1)
+        self.assertEqual(( 'https://www.example.com/1', ( self.now + timedelta(hours = 1) ).timestamp() ), 
+                redirect_cache.get(1))
+
+        URLRedirect.objects.filter(pk = 1).update(expires = self.now)
+        with patch('urls.contrib.expiry.time.time', return_value = self.now.timestamp() + 7200):
+            self.assertRedirects(self.redirect(1), reverse('urls:index'), 302, fetch_redirect_response = False)
+
+    def test_click_extends_idle_link(self):
+        self.create(1, expires = self.now + timedelta(hours = 1), max_idle = timedelta(days = 1))
+        self.create(2, expires = self.now + timedelta(hours = 1))
+        for pk in ( 1, 2 ):
+            self.redirect(pk)
+        click_counter.flush()
+
+        expires = dict(URLRedirect.objects.values_list('pk', 'expires'))
+        self.assertGreater(expires[1], self.now + timedelta(hours = 23))
+        self.assertEqual(self.now + timedelta(hours = 1), expires[2])
+
+    @override_settings(URLS_EXPIRY = { 'LIFETIME': 3600 })
+    def test_new_links_get_lifetime(self):
+        redirect = URLRedirect.get_or_create('https://www.example.org/')
+        self.assertAlmostEqual(3600, (redirect.expires - self.now).total_seconds(), delta = 60)
+        self.assertIsNone(redirect.max_idle)
+
+    def test_shortening_an_expired_link_revives_it(self):
+        redirect = self.create(1, expires = self.now - timedelta(days = 1))
+        self.assertEqual(1, URLRedirect.get_or_create(redirect.original_url).id)
+        self.assertIsNone(URLRedirect.objects.get(pk = 1).expires)
+
+    def test_purge_deletes_expired_links_in_batches(self):
+        for id, expires in (( 1, self.now - timedelta(days = 2) ), ( 2, self.now - timedelta(days = 1) ), 
+                ( 3, self.now - timedelta(minutes = 1) ), ( 4, self.now + timedelta(days = 1) ), ( 5, None )):
+            self.create(id, expires)
+        ClickRollup.objects.create(redirect_id = 1, period = clicks.DAY, start = self.now, clicks = 3)
+        redirect_cache.set(2, expiry.entry('https://www.example.com/2', self.now - timedelta(days = 1)))
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(2, expiry.purge(batch_size = 1, sleep = 0, grace = 3600, now = self.now))
+        self.assertFalse([ query for query in queries if 'OFFSET' in query['sql'] ])
+        self.assertEqual([ 3, 4, 5 ], sorted(URLRedirect.objects.values_list('pk', flat = True)))
+        self.assertFalse(ClickRollup.objects.exists())
+        self.assertIsNone(redirect_cache.get(2))
+        self.assertFalse(FreeId.objects.exists())
+
+    @override_settings(URLS_EXPIRY = { 'REUSE_IDS': True, 'REUSE_AFTER': 3600 })
+    def test_purged_ids_are_reused(self):
+        self.create(12345, self.now - timedelta(days = 1))
+        call_command('purge_expired', sleep = 0, stdout = StringIO())
+        self.assertEqual(12345, FreeId.objects.get().id)
+
+        # held back for REUSE_AFTER
+        self.assertNotEqual(12345, URLRedirect.get_or_create('https://www.example.org/').id)
+        FreeId.objects.update(freed = self.now - timedelta(hours = 2))
+        self.assertEqual(12345, URLRedirect.get_or_create('https://www.example.net/').id)
+        self.assertFalse(FreeId.objects.exists())
+
+    def test_snapshot_leaves_expiring_links_to_the_database(self):
+        self.create(1)
+        self.create(2, expires = self.now + timedelta(days = 1))
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertEqual(1, snapshot.export(directory)['entries'])
+
+class BloomFilterTests(SimpleTestCase):
+
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(1000, 0.01)
+        for pk in range(0, 100000, 100):
+            bloom.add(pk)
+        self.assertTrue(all(pk in bloom for pk in range(0, 100000, 100)))
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(10000, 0.01)
+        for pk in range(10000):
+            bloom.add(pk)
+        false_positives = sum(1 for pk in range(10000, 110000) if pk in bloom)
+        self.assertLess(false_positives / 100000, 0.02)
+        self.assertAlmostEqual(0.01, bloom.expected_error_rate(), delta = 0.002)
+
+class IdFilterTests(TestCase):
+
+    def setUp(self):
+        clear_caches()
+        # as if the cache were shared by the workers
+        self.filter = IdFilter({ 'ENABLED': True, 'CAPACITY': 1000, 'TRUST_MISSES': True })
+        patcher = patch('urls.views.id_filter', self.filter)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch('urls.signals.id_filter', self.filter)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        URLRedirect.objects.create(id = 1, original_url = 'https://www.example.com/')
+        self.filter.rebuild()
+
+    def tearDown(self):
+        clear_caches()
+
+    def redirect(self, pk):
+        return self.client.get(reverse('urls:redirect', args = ( encode(pk), )))
+
+    def test_unknown_codes_skip_the_database(self):
+        self.assertRedirects(self.redirect(1), 'https://www.example.com/', 301, fetch_redirect_response = False)
+        missing = next(pk for pk in range(2, 1000) if pk not in self.filter.filter)
+        with self.assertNumQueries(0):
+            self.assertRedirects(self.redirect(missing), reverse('urls:index'), 302, fetch_redirect_response = False)
+        self.assertEqual(1, self.filter.stats()['rejected'])
+
+    def test_new_links_are_added(self):
+        redirect = URLRedirect.get_or_create('https://www.example.org/')
+        self.assertIn(redirect.id, self.filter.filter)
+        self.assertRedirects(self.redirect(redirect.id), 'https://www.example.org/', 301, fetch_redirect_response = False)
+
+    def test_links_created_by_other_workers_pass(self):
+        other = IdFilter({ 'ENABLED': True, 'CAPACITY': 1000, 'TRUST_MISSES': True })
+        other.rebuild()
+        redirect = URLRedirect.get_or_create('https://www.example.org/')
+        self.assertNotIn(redirect.id, other.filter)
+        self.assertTrue(other.might_exist(redirect.id))
+
+    def test_misses_are_checked_with_a_local_cache(self):
+        local = IdFilter({ 'ENABLED': True, 'CAPACITY': 1000 })
+        self.assertFalse(local.trusted)
+        local.rebuild()
+        # created by another worker, which could not mark it in this worker's cache
+        URLRedirect.objects.bulk_create([ URLRedirect(id = 2, original_url = 'https://www.example.org/') ])
+        self.assertNotIn(2, local.filter)
+
+        with patch('urls.views.id_filter', local):
+            self.assertRedirects(self.redirect(2), 'https://www.example.org/', 301, fetch_redirect_response = False)
+            missing = next(pk for pk in range(3, 1000) if pk not in local.filter)
+            self.assertRedirects(self.redirect(missing), reverse('urls:index'), 302, fetch_redirect_response = False)
+        self.assertIn(2, local.filter)
+        stats = local.stats()
+        self.assertEqual(2, stats['verified'])
+        self.assertEqual(0, stats['false_positives'])
+
+    def test_false_positives_are_counted(self):
+        # as if link 999 had been deleted since the rebuild
+        self.filter.filter.add(999)
+        self.redirect(999)
+        stats = self.filter.stats()
+        self.assertEqual(1, stats['false_positives'])
+        self.assertEqual(1.0, stats['false_positive_rate'])
+
+    def test_shared_filter_is_loaded(self):
+        shared = IdFilter({ 'ENABLED': True, 'CAPACITY': 1000, 'SHARED': True })
+        shared.rebuild()
+        loaded = IdFilter({ 'ENABLED': True, 'CAPACITY': 1000, 'SHARED': True })
+        with self.assertNumQueries(0):
+            loaded.rebuild()
+        self.assertIn(1, loaded.filter)
+        self.assertEqual(shared.filter.data, loaded.filter.data)
+
+class HTTPCacheTests(TestCase):
+
+    def setUp(self):
+        clear_caches()
+        self.now = timezone.now()
+        URLRedirect.objects.create(id = 1, original_url = 'https://www.example.com/')
+
+    def tearDown(self):
+        clear_caches()
+
+    def redirect(self, pk, method = 'get'):
+        return getattr(self.client, method)(reverse('urls:redirect', args = ( encode(pk), )))
+
+    def test_redirects_are_not_cached_by_default(self):
+        response = self.redirect(1)
+        self.assertRedirects(response, 'https://www.example.com/', 301, fetch_redirect_response = False)
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertIn('max-age=0', response['Cache-Control'])
+
+    @override_settings(URLS_HTTP_CACHE = { 'MAX_AGE': 3600, 'SHARED_MAX_AGE': 86400 })
+    def test_cacheable_redirects(self):
+        response = self.redirect(1)
+        self.assertEqual({ 'public', 'max-age=3600', 's-maxage=86400' }, 
+                set(response['Cache-Control'].split(', ')))
+        self.assertTrue(response.has_header('Expires'))
+
+    @override_settings(URLS_HTTP_CACHE = { 'MAX_AGE': 3600 })
+    def test_expiring_links_are_cached_until_they_expire(self):
+        URLRedirect.objects.create(id = 2, original_url = 'https://www.example.org/', 
+                expires = self.now + timedelta(seconds = 600))
+        for attempt in range(2): # from the database, then the redirect cache
+            cache_control = set(self.redirect(2)['Cache-Control'].split(', '))
+            self.assertNotIn('max-age=3600', cache_control)
+            self.assertTrue({ 'max-age=599', 'max-age=600' } & cache_control)
+
+    def test_link_policy(self):
+        URLRedirect.objects.create(id = 2, original_url = 'https://www.example.org/', permanent = False)
+        for attempt in range(2):
+            self.assertRedirects(self.redirect(2), 'https://www.example.org/', 302, fetch_redirect_response = False)
+        with override_settings(URLS_HTTP_CACHE = { 'PERMANENT': False }):
+            self.assertRedirects(self.redirect(1), 'https://www.example.com/', 302, fetch_redirect_response = False)
+            URLRedirect.objects.filter(id = 2).update(permanent = True)
+            redirect_cache.delete(2)
+            self.assertRedirects(self.redirect(2), 'https://www.example.org/', 301, fetch_redirect_response = False)
+
+    def test_head_is_not_a_click(self):
+        response = self.redirect(1, 'head')
+        self.assertEqual(301, response.status_code)
+        self.assertEqual('https://www.example.com/', response['Location'])
+        self.assertEqual(0, click_counter.pending(1))
+        self.redirect(1)
+        self.assertEqual(1, click_counter.pending(1))
+
+    def test_index_is_rendered_once(self):
+        with patch('urls.views.render_to_string', return_value = '<html></html>') as render:
+            first = self.client.get(reverse('urls:index'))
+            second = self.client.get(reverse('urls:index'))
+        self.assertEqual(1, render.call_count)
+        self.assertEqual(first['ETag'], second['ETag'])
+        self.assertEqual(b'<html></html>', second.content)
+
+    def test_index_conditional_get(self):
+        response = self.client.get(reverse('urls:index'))
+        self.assertEqual(200, response.status_code)
+        # the same for every visitor
+        self.assertNotIn('name="csrfmiddlewaretoken"', response.content.decode('utf-8'))
+        response = self.client.get(reverse('urls:index'), HTTP_IF_NONE_MATCH = response['ETag'])
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(b'', response.content)
+
+    def test_index_sets_the_csrf_cookie(self):
+        response = self.client.get(reverse('urls:index'))
+        self.assertIn('csrftoken', response.cookies)
+        self.assertIn('private', response['Cache-Control'])
+        # the client sends the cookie back
+        response = self.client.get(reverse('urls:index'))
+        self.assertNotIn('private', response['Cache-Control'])
+        self.assertIn('max-age=300', response['Cache-Control'])
+
+    def test_create_with_the_cookie_token(self):
+        client = self.client_class(enforce_csrf_checks = True)
+        client.get(reverse('urls:index'))
+        token = client.cookies['csrftoken'].value
+        with patch('urls.views.validation.mode', return_value = validation.QUEUE):
+            response = client.post(reverse('urls:create'), { 'url': 'https://www.example.net/', 'csrfmiddlewaretoken': token })
+        self.assertTrue(response.json()['success'])
+
+@override_settings(ROOT_URLCONF = 'mysite.urls_async')
+class AsyncHTTPCacheTests(HTTPCacheTests):
+    """
+    Runs HTTPCacheTests against the async views.
+    """
+
+class ValidationStubHandler(BaseHTTPRequestHandler):
+    """
+    A site which is slow on /slow and rejects HEAD on /no-head.
+    """
+
+    def respond(self):
+        self.server.requests.append(( self.command, self.path ))
+        if self.path == '/slow':
+            time.sleep(self.server.delay)
+        if self.path == '/no-head' and self.command == 'HEAD':
+            self.send_response(405)
+        else:
+            self.send_response(200 if self.path in ( '/', '/slow', '/no-head' ) else 404)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    do_HEAD = respond
+    do_GET = respond
+
+    def log_message(self, *args):
+        pass
+
+class ValidationClientTests(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.servers = []
+        for idx in range(2):
+            server = ThreadingHTTPServer(( '127.0.0.1', 0 ), ValidationStubHandler)
+            server.daemon_threads = True
+            Thread(target = server.serve_forever, daemon = True).start()
+            cls.servers.append(server)
+
+    @classmethod
+    def tearDownClass(cls):
+        for server in cls.servers:
+            server.shutdown()
+            server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        for server in self.servers:
+            server.requests = []
+            server.delay = 0.5
+
+    def url(self, path, server = 0, scheme = 'http'):
+        return '{}://127.0.0.1:{}{}'.format(scheme, self.servers[server].server_port, path)
+
+    def validation_client(self, **options):
+        return ValidationClient(options, retries = 0)
+
+    def test_head_falls_back_to_get(self):
+        client = self.validation_client()
+        self.assertEqual(200, client.request('HEAD', self.url('/no-head'), timeout = 2).status)
+        self.assertEqual([ ( 'HEAD', '/no-head' ), ( 'GET', '/no-head' ) ], self.servers[0].requests)
+        self.assertEqual(1, client.stats()[self.url('')]['fallbacks'])
+        # the closed connection is not reused
+        self.assertEqual(200, client.request('HEAD', self.url('/'), timeout = 2).status)
+
+    def test_timeouts_open_the_circuit(self):
+        client = self.validation_client(FAILURE_THRESHOLD = 2)
+        for attempt in range(2):
+            with self.assertRaises(MaxRetryError) as cm:
+                client.request('HEAD', self.url('/slow'), timeout = 0.1)
+            self.assertIsInstance(cm.exception.reason, ReadTimeoutError)
+        with self.assertRaises(MaxRetryError) as cm:
+            client.request('HEAD', self.url('/'), timeout = 2)
+        self.assertIsInstance(cm.exception.reason, CircuitOpenError)
+        self.assertEqual(2, len(self.servers[0].requests))
+        # other hosts are not affected
+        self.assertEqual(200, client.request('HEAD', self.url('/', server = 1), timeout = 2).status)
+        stats = client.stats()[self.url('')]
+        self.assertEqual(( 1, 2, 1, 1 ), ( stats['open'], stats['failures'], stats['rejected'], stats['opened'] ))
+
+    def test_ssl_errors_open_the_circuit(self):
+        client = self.validation_client(FAILURE_THRESHOLD = 1)
+        with self.assertRaises(MaxRetryError) as cm:
+            client.request('HEAD', self.url('/', scheme = 'https'), timeout = 2)
+        self.assertIsInstance(cm.exception.reason, SSLError)
+        with self.assertRaises(MaxRetryError) as cm:
+            client.request('HEAD', self.url('/', scheme = 'https'), timeout = 2)
+        self.assertIsInstance(cm.exception.reason, CircuitOpenError)
+
+    def test_circuit_closes_after_a_successful_trial(self):
+        client = self.validation_client(FAILURE_THRESHOLD = 1, RESET_TIMEOUT = 0.2)
+        with self.assertRaises(MaxRetryError):
+            client.request('HEAD', self.url('/slow'), timeout = 0.1)
+        with self.assertRaises(MaxRetryError):
+            client.request('HEAD', self.url('/'), timeout = 2)
+        time.sleep(0.25)
+        # a failed trial opens the circuit again
+        with self.assertRaises(MaxRetryError) as cm:
+            client.request('HEAD', self.url('/slow'), timeout = 0.1)
+        self.assertIsInstance(cm.exception.reason, ReadTimeoutError)
+        with self.assertRaises(MaxRetryError) as cm:
+            client.request('HEAD', self.url('/'), timeout = 2)
+        self.assertIsInstance(cm.exception.reason, CircuitOpenError)
+        time.sleep(0.25)
+        self.assertEqual(200, client.request('HEAD', self.url('/'), timeout = 2).status)
+        self.assertEqual(0, client.stats()[self.url('')]['open'])
+        self.assertEqual(200, client.request('HEAD', self.url('/'), timeout = 2).status)
+
+    def concurrently(self, client, *urls):
+        errors = []
+
+        def request(url):
+            try:
+                client.request('HEAD', url, timeout = 2)
+            except MaxRetryError as e:
+                errors.append(( url, e.reason ))
+
+        threads = [ Thread(target = request, args = ( url, )) for url in urls ]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.05)
+        for thread in threads:
+            thread.join()
+        return errors
+
+    def test_per_host_limit(self):
+        client = self.validation_client(HOST_CONNECTIONS = 1, POOL_TIMEOUT = 0.1)
+        self.servers[0].delay = 0.4
+        errors = self.concurrently(client, self.url('/slow'), self.url('/slow'), self.url('/', server = 1))
+        self.assertEqual(1, len(errors))
+        self.assertEqual(self.url('/slow'), errors[0][0])
+        self.assertIsInstance(errors[0][1], EmptyPoolError)
+        self.assertEqual(1, client.stats()[self.url('')]['busy'])
+        self.assertEqual(0, client.stats()[self.url('')]['failures'])
+
+    def test_global_limit(self):
+        client = self.validation_client(MAX_CONNECTIONS = 1, POOL_TIMEOUT = 0.1)
+        self.servers[0].delay = 0.4
+        errors = self.concurrently(client, self.url('/slow'), self.url('/', server = 1))
+        self.assertEqual([ self.url('/', server = 1) ], [ url for url, reason in errors ])
+
+    def test_validation_messages(self):
+        client = self.validation_client(FAILURE_THRESHOLD = 1)
+        with patch('urls.contrib.urls.pool', client):
+            with self.assertRaises(ValidationError):
+                validate_url(self.url('/slow'), timeout = 0.1)
+            with self.assertRaises(ValidationError) as cm:
+                validate_url(self.url('/'), timeout = 2)
+            validate_url(self.url('/no-head', server = 1), timeout = 2)
+        self.assertEqual(UNREACHABLE, cm.exception.status)
+        self.assertFalse(cm.exception.host_error)
+        self.assertEqual('That site is not responding, please try again later', cm.exception.message)
+
+    def async_validation_client(self, client):
+        return AsyncValidationClient(client, AsyncPoolManager())
+
+    async def test_async_requests_share_the_circuit(self):
+        client = self.validation_client(FAILURE_THRESHOLD = 2)
+        async_client = self.async_validation_client(client)
+        for attempt in range(2):
+            with self.assertRaises(MaxRetryError) as cm:
+                await async_client.request('HEAD', self.url('/slow'), timeout = 0.1)
+            self.assertIsInstance(cm.exception.reason, ReadTimeoutError)
+        with self.assertRaises(MaxRetryError) as cm:
+            await async_client.request('HEAD', self.url('/'), timeout = 2)
+        self.assertIsInstance(cm.exception.reason, CircuitOpenError)
+        with self.assertRaises(MaxRetryError) as cm:
+            client.request('HEAD', self.url('/'), timeout = 2)
+        self.assertIsInstance(cm.exception.reason, CircuitOpenError)
+        self.assertEqual(2, len(self.servers[0].requests))
+        self.assertEqual(200, (await async_client.request('HEAD', self.url('/', server = 1), timeout = 2)).status)
+        stats = client.stats()[self.url('')]
+        self.assertEqual(( 1, 2, 2 ), ( stats['open'], stats['failures'], stats['rejected'] ))
+
+    async def test_async_head_falls_back_to_get(self):
+        client = self.validation_client()
+        response = await self.async_validation_client(client).request('HEAD', self.url('/no-head'), timeout = 2)
+        self.assertEqual(200, response.status)
+        self.assertEqual([ ( 'HEAD', '/no-head' ), ( 'GET', '/no-head' ) ], self.servers[0].requests)
+        self.assertEqual(1, client.stats()[self.url('')]['fallbacks'])
+
+    async def test_async_per_host_limit(self):
+        client = self.validation_client(HOST_CONNECTIONS = 1, POOL_TIMEOUT = 0.1)
+        self.servers[0].delay = 0.4
+        async_client = self.async_validation_client(client)
+        results = await asyncio.gather(*[ async_client.request('HEAD', self.url('/slow'), timeout = 2) for idx in range(2) ], 
+                return_exceptions = True)
+        errors = [ result for result in results if isinstance(result, MaxRetryError) ]
+        self.assertEqual(1, len(errors))
+        self.assertIsInstance(errors[0].reason, EmptyPoolError)
+        self.assertEqual(1, client.stats()[self.url('')]['busy'])
+
+    async def test_async_validation_with_open_circuit(self):
+        client = self.validation_client(FAILURE_THRESHOLD = 1)
+        with self.assertRaises(MaxRetryError):
+            client.request('HEAD', self.url('/slow'), timeout = 0.1)
+        with patch('urls.contrib.urls.async_pool', self.async_validation_client(client)):
+            with self.assertRaises(ValidationError) as cm:
+                await avalidate_url(self.url('/'), timeout = 2)
+        self.assertEqual(UNREACHABLE, cm.exception.status)
+        self.assertEqual('That site is not responding, please try again later', cm.exception.message)
+        self.assertEqual([ ( 'HEAD', '/slow' ) ], self.servers[0].requests)
+
+class SpaceSavingTests(SimpleTestCase):
+
+    def test_heavy_hitters_are_found(self):
+        sketch = SpaceSaving(10)
+        for idx in range(1000):
+            sketch.add(idx % 3)         # 3 keys with 1/6 of the stream each
+            sketch.add(1000 + idx)      # and a long tail seen once
+        self.assertEqual({ 0, 1, 2 }, set(key for key, count, error in sketch.top(3)))
+        self.assertEqual(10, len(sketch))
+        for key, count, error in sketch.top(3):
+            # never underestimated, overestimated by at most the error
+            self.assertGreaterEqual(count, 334 if key == 0 else 333)
+            self.assertLessEqual(count - error, 334)
+
+    def test_smallest_count_is_replaced(self):
+        sketch = SpaceSaving(3)
+        sketch.add('a', 5)
+        sketch.add('b', 1)
+        sketch.add('c', 3)
+        for idx in range(3):
+            sketch.add('b')     # b was the smallest, now c is
+        sketch.add('d')
+        self.assertEqual([ ( 'a', 5, 0 ), ( 'b', 4, 0 ), ( 'd', 4, 3 ) ], sketch.top())
+        sketch.add('a')
+        sketch.add('b')
+        sketch.add('e', 2)
+        self.assertEqual([ ( 'a', 6, 0 ), ( 'e', 6, 4 ), ( 'b', 5, 0 ) ], sketch.top())
+
+    def test_heap_stays_bounded(self):
+        sketch = SpaceSaving(10)
+        for idx in range(10000):
+            sketch.add(idx % 20)
+        self.assertLessEqual(len(sketch._heap), SpaceSaving.COMPACT * 10)
+        self.assertEqual(10, len(sketch))
+
+    def test_decay(self):
+        sketch = SpaceSaving(10)
+        sketch.add('a', 4)
+        sketch.add('b', 1)
+        sketch.decay()
+        self.assertEqual([ ( 'a', 2, 0 ) ], sketch.top())
+        self.assertEqual(2, sketch.total)
+
+class HotLinksTests(TestCase):
+
+    def setUp(self):
+        clear_caches()
+        for pk in range(1, 5):
+            URLRedirect.objects.create(id = pk, original_url = 'https://www.example.com/{}'.format(pk), times_used = pk)
+        self.hot = HotLinks({ 'PINNED': 2, 'INTERVAL': 3600 })
+        patcher = patch('urls.views.hot_links', self.hot)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        clear_caches()
+
+    def redirect(self, pk):
+        return self.client.get(reverse('urls:redirect', args = ( encode(pk), )))
+
+    def test_hottest_links_are_pinned(self):
+        for pk, clicks in ( ( 1, 3 ), ( 2, 1 ), ( 3, 5 ) ):
+            for click in range(clicks):
+                self.redirect(pk)
+        self.assertEqual([ 3, 1, 2 ], [ pk for pk, count, error in self.hot.top() ])
+        self.hot.tick()
+        self.assertEqual({ 1, 3 }, set(redirect_cache.pinned))
+        self.assertEqual([ ( 3, 2, 0 ), ( 1, 1, 0 ) ], self.hot.top())
+
+        # served when the other tiers have lost them
+        redirect_cache.local.clear()
+        caches['default'].clear()
+        with self.assertNumQueries(0):
+            self.assertRedirects(self.redirect(3), 'https://www.example.com/3', 301, fetch_redirect_response = False)
+
+    def test_edited_links_are_unpinned(self):
+        self.redirect(1)
+        self.hot.tick()
+        self.assertIn(1, redirect_cache.pinned)
+        URLRedirect.objects.filter(id = 1).update(original_url = 'https://www.example.org/')
+        URLRedirect.objects.get(id = 1).save()
+        self.assertNotIn(1, redirect_cache.pinned)
+        self.assertRedirects(self.redirect(1), 'https://www.example.org/', 301, fetch_redirect_response = False)
+
+    def test_head_is_not_counted(self):
+        self.client.head(reverse('urls:redirect', args = ( encode(1), )))
+        self.assertEqual([], self.hot.top())
+
+    def test_trending(self):
+        for pk in ( 2, 2, 4 ):
+            self.redirect(pk)
+        response = self.client.get(reverse('urls:trending'), { 'count': 1 })
+        self.assertEqual([ {
+            'short': encode(2), 
+            'result': 'http://testserver' + reverse('urls:redirect', args = ( encode(2), )), 
+            'clicks': 2, 
+            'error': 0, 
+        } ], response.json()['links'])
+        self.assertEqual(400, self.client.get(reverse('urls:trending'), { 'count': 0 }).status_code)
+
+    def test_warm_up(self):
+        URLRedirect.objects.create(id = 5, original_url = 'https://www.example.com/5', times_used = 9, 
+                expires = timezone.now() - timedelta(seconds = 1))
+        with patch.object(hot_links, 'pinned', 1):
+            self.assertEqual(2, hot.warm_up(used = 2, recent = 1))
+        # the most used, 4 and 3, and the newest, 4
+        self.assertEqual('https://www.example.com/3', redirect_cache.local.get(3))
+        self.assertEqual('https://www.example.com/4', redirect_cache.local.get(4))
+        self.assertIsNone(redirect_cache.local.get(2))
+        self.assertIsNone(redirect_cache.local.get(5))
+        self.assertEqual([ 4 ], list(redirect_cache.pinned))
+        redirect_cache.clear()
+        with self.assertNumQueries(0):
+            self.assertRedirects(self.redirect(3), 'https://www.example.com/3', 301, fetch_redirect_response = False)
+
+    @override_settings(URLS_HOT_LINKS = { 'WARM_UP': True })
+    def test_warm_up_on_first_request(self):
+        hot.connect()
+        self.addCleanup(request_started.disconnect, hot._warm_up_on_start, dispatch_uid = 'urls.hot.warm_up')
+        with patch('urls.contrib.hot.Thread') as thread:
+            self.client.get(reverse('urls:index'))
+            self.client.get(reverse('urls:index'))
+        self.assertEqual(1, thread.call_count)
+        self.assertEqual(1, thread.return_value.start.call_count)
+
+class RedirectMiddlewareTests(TestCase):
+
+    def setUp(self):
+        clear_caches()
+        self.short = create_redirect('https://www.example.com/')
+
+    def tearDown(self):
+        clear_caches()
+
+    def test_redirects_skip_the_stack(self):
+        response = self.client.get(reverse('urls:redirect', args = ( self.short, )))
+        self.assertRedirects(response, 'https://www.example.com/', 301, fetch_redirect_response = False)
+        # XFrameOptionsMiddleware is at the bottom of the stack
+        self.assertFalse(response.has_header('X-Frame-Options'))
+        self.assertTrue(response.has_header('Server-Timing'))
+        self.assertEqual('redirect', response.resolver_match.url_name)
+
+    def test_other_requests_go_down_the_stack(self):
+        self.assertTrue(self.client.get(reverse('urls:index')).has_header('X-Frame-Options'))
+        response = self.client.post(reverse('urls:redirect', args = ( self.short, )))
+        self.assertEqual(405, response.status_code)
+        self.assertTrue(response.has_header('X-Frame-Options'))
+        # CommonMiddleware appends the slash
+        response = self.client.get(reverse('urls:redirect', args = ( self.short, )).rstrip('/'))
+        self.assertRedirects(response, reverse('urls:redirect', args = ( self.short, )), 301, 
+                fetch_redirect_response = False)
+
+    @override_settings(ROOT_URLCONF = 'mysite.urls_async')
+    async def test_async_handler(self):
+        client = AsyncClient()
+        response = await client.get(reverse('urls:redirect', args = ( self.short, )))
+        self.assertRedirects(response, 'https://www.example.com/', 301, fetch_redirect_response = False)
+        self.assertFalse(response.has_header('X-Frame-Options'))
+        response = await client.get(reverse('urls:index'))
+        self.assertTrue(response.has_header('X-Frame-Options'))
@@ -2,9 +2,17 @@ from django.conf.urls import url
 
 from . import views
 
+def patterns(views):
+    return [
+        url(r'^$', views.IndexView.as_view(), name = 'index'), 
+        url(r'^create/$', views.CreateURLView.as_view(), name = 'create'), 
+        url(r'^bulk/$', views.BulkCreateURLView.as_view(), name = 'bulk'), 
+        url(r'^status/(?P<short>[A-Za-z0-9]+)/$', views.StatusView.as_view(), name = 'status'), 
+        url(r'^stats/(?P<short>[A-Za-z0-9]+)/$', views.ClickStatsView.as_view(), name = 'stats'), 
+        url(r'^trending/$', views.TrendingView.as_view(), name = 'trending'), 
+        url(r'^metrics/$', views.MetricsView.as_view(), name = 'metrics'), 
+        url(r'^(?P<short>[A-Za-z0-9]+)/', views.RedirectURLView.as_view(), name = 'redirect'), 
+    ]
+
 app_name = 'urls'
-urlpatterns = [
-    url(r'^$', views.IndexView.as_view(), name = 'index'), 
-    url(r'^create/$', views.CreateURLView.as_view(), name = 'create'), 
-    url(r'^(?P<short>[A-Za-z0-9]+)/', views.RedirectURLView.as_view(), name = 'redirect'), 
-]
+urlpatterns = patterns(views)
@@ -1,22 +1,64 @@
+from django.conf import settings
 from django.views import generic
-from django.http import JsonResponse, HttpResponseRedirect, HttpResponsePermanentRedirect
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
 from django.urls import reverse
-from django.db.models import F
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_response_headers
 
-from .models import URLRedirect
-from .contrib.base_n import encode, decode
-from .contrib.urls import hostname, canonicalize, validate_url, ValidationError
+from .models import URLRedirect, MAX_INT
+from .contrib.base_n import encode, decode, is_valid
+from .contrib.urls import hostname, canonicalize, validate_scheme, ValidationError, PENDING, VALID, FAILED
+from .contrib import validation, bulk, metrics, expiry, headers, snapshot as snapshots
+from .contrib.metrics import timer
+from .contrib.cache import redirect_cache
+from .contrib.bloom import id_filter
+from .contrib.counters import click_counter
+from .contrib.hot import hot_links
+from .contrib.clicks import click_log, clicks_per, PERIODS, DAY
+from .contrib.sharding import shard_map
+
+import codecs
+import json
 
 # Create your views here.
-MAX_DECODE_LENGTH = 10 # 10 ** len(base_n.alphabet) > model.IntegerField.max
+MAX_CODE_LENGTH = len(encode(MAX_INT)) # longer codes decode to more than model.IntegerField.max
 
 class IndexView(generic.TemplateView):
+    """
+    The page is the same for every visitor, its script reads the CSRF token from the cookie, 
+    so it is rendered at most once every URLS_HTTP_CACHE INDEX_MAX_AGE seconds and browsers 
+    revalidate their copy with its ETag.
+    """
     template_name = 'urls/index.html'
 
+    def get(self, request, *args, **kwargs):
+        content, etag = headers.page_cache.get(self.template_name, 
+                lambda: render_to_string(self.template_name, self.get_context_data(**kwargs)))
+        # sets the cookie for new visitors
+        has_cookie = settings.CSRF_COOKIE_NAME in request.COOKIES
+        get_token(request)
+        response = get_conditional_response(request, etag = etag) or HttpResponse(content)
+        response['ETag'] = etag
+        patch_response_headers(response, headers.option('INDEX_MAX_AGE'))
+        if not has_cookie:
+            # a shared cache must not hand the cookie to other visitors
+            patch_cache_control(response, private = True)
+        return response
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['csrf_cookie_name'] = settings.CSRF_COOKIE_NAME
+        return context
+
 class CreateURLView(generic.View):
     """
     A View to create the shortened urls. Used by AJAX and not designed to be accessed from 
     the address bar.
+
+    Depending on the URLS_VALIDATION mode the url is either accessed before the link is 
+    created, or the link is created immediately with a pending status and validated in the 
+    background. The status can then be polled with StatusView.
     """
 
     def post(self, request):
@@ -25,54 +67,285 @@ class CreateURLView(generic.View):
             return JsonResponse({
                 'success': False, 
             })
-        url = canonicalize(url.strip())
-        host = hostname(url)
+        url, host = self.clean(url)
+        try:
+            if validation.mode() == validation.SYNC:
+                with timer('validate'):
+                    validation.validate(url)
+            with timer('db'):
+                redirect = self.create(url)
+        except ValidationError as e:
+            return self.failure(url, host, e)
+        return self.success(request, redirect, url, host)
+
+    def clean(self, url):
+        """
+        Returns:
+            the canonicalized url and its hostname
+        """
+        with timer('canonicalize'):
+            url = canonicalize(url.strip())
+        with timer('hostname'):
+            host = hostname(url)
         if host == '':
             host = url
-        try:
-            validate_url(url)
+        return url, host
+
+    def create(self, url):
+        """
+        Gets or creates the URLRedirect for a url, which has already been validated in the 
+        sync validation mode. An existing link which failed validation is validated again.
+        """
+        if validation.mode() == validation.SYNC:
             redirect = URLRedirect.get_or_create(url) 
-        except ValidationError as e:
-            return JsonResponse({ 
-                'success': False, 
-                'url': url, 
-                'hostname': host, 
-                'result':  e.message
-            })
+            if redirect.status in FAILED:
+                validation.retry(redirect, validation.check(url))
+            return redirect
+        validate_scheme(url)
+        redirect = URLRedirect.get_or_create(url, status = PENDING) 
+        if redirect.status in FAILED:
+            validation.retry(redirect)
+        if redirect.status == PENDING and validation.mode() == validation.THREAD:
+            validation.submit(redirect.id, url)
+        return redirect
 
+    def failure(self, url, host, error):
+        return JsonResponse({ 
+            'success': False, 
+            'url': url, 
+            'hostname': host, 
+            'result':  error.message
+        })
+
+    def success(self, request, redirect, url, host):
+        with timer('encode'):
+            short = encode(redirect.id)
         return JsonResponse({
             'success': True, 
             'url': url, 
             'result': request.build_absolute_uri(
                 reverse('urls:redirect', args = ( 
-                    encode(redirect.id), 
+                    short, 
                 ))), 
             'hostname': host, 
-            'times_used': redirect.times_used, 
+            'times_used': redirect.times_used + click_counter.pending(redirect.id), 
+            'status': redirect.status, 
+            'status_url': reverse('urls:status', args = ( short, )), 
         })
 
+class BulkCreateURLView(generic.View):
+    """
+    A View to shorten many urls at once, for staff users. The request body is a JSON list, a 
+    CSV file with a url column, or a url per line, chosen by the content type. The body is 
+    parsed as it is read and the response streams a JSON object per line in the order of the 
+    input, so neither is held in memory whole.
+    """
+
+    def post(self, request):
+        if not request.user.is_staff:
+            return JsonResponse({
+                'success': False, 
+            }, status = 403)
+
+        encoding = request.encoding or 'utf-8'
+        format = bulk.format_for(request.content_type)
+        if format == bulk.JSON:
+            # in blocks, a JSON body may well be a single line
+            lines = codecs.iterdecode(iter(lambda: request.read(bulk.READ_SIZE), b''), encoding)
+        else:
+            lines = ( line.decode(encoding) for line in request )
+        urls = bulk.read_urls(lines, format)
+
+        def stream():
+            for result in bulk.shorten_many(urls):
+                if result['success']:
+                    result['result'] = request.build_absolute_uri(
+                            reverse('urls:redirect', args = ( result['short'], )))
+                yield json.dumps(result) + '\n'
+
+        return StreamingHttpResponse(stream(), content_type = 'application/x-ndjson')
+
+class StatusView(generic.View):
+    """
+    A View returning the validation status of a shortened url, polled by AJAX while the 
+    status is pending.
+    """
+
+    def get(self, request, *args, **kwargs):
+        try:
+            pk = decode(kwargs.get('short'), max_length = MAX_CODE_LENGTH)
+            redirect = (URLRedirect.objects
+                    .using(shard_map.using_id(pk))
+                    .only('status', 'status_code', 'status_message')
+                    .get(pk = pk))
+        except (KeyError, ValueError, URLRedirect.DoesNotExist):
+            return JsonResponse({
+                'success': False, 
+            }, status = 404)
+
+        return JsonResponse({
+            'success': redirect.status in ( PENDING, VALID ), 
+            'status': redirect.status, 
+            'status_code': redirect.status_code, 
+            'result': redirect.status_message, 
+        })
+
+class ClickStatsView(generic.View):
+    """
+    A View returning the clicks on a shortened url per day or hour, read from the click 
+    rollups. The period and count query parameters default to the last 90 days.
+    """
+
+    MAX_COUNT = {
+        'day': 366, 
+        'hour': 24 * 31, 
+    }
+
+    def get(self, request, *args, **kwargs):
+        period = request.GET.get('period', DAY)
+        try:
+            pk = decode(kwargs.get('short'), max_length = MAX_CODE_LENGTH)
+            count = int(request.GET.get('count', 90))
+            if period not in PERIODS or not 0 < count <= self.MAX_COUNT[period]:
+                raise ValueError(period, count)
+            if not URLRedirect.objects.using(shard_map.using_id(pk)).filter(pk = pk).exists():
+                raise URLRedirect.DoesNotExist()
+        except (KeyError, ValueError, URLRedirect.DoesNotExist):
+            return JsonResponse({
+                'success': False, 
+            }, status = 404)
+
+        clicks = clicks_per(pk, period, count)
+        return JsonResponse({
+            'success': True, 
+            'period': period, 
+            'total': sum(n for start, n in clicks), 
+            'clicks': [ { 'start': start.isoformat(), 'clicks': n } for start, n in clicks ], 
+        })
+
+class TrendingView(generic.View):
+    """
+    A View returning the links clicked most recently on this worker, as estimated by 
+    urls.contrib.hot. A count may overestimate the clicks by up to its error. The count query 
+    parameter defaults to 10.
+    """
+
+    def get(self, request, *args, **kwargs):
+        try:
+            count = int(request.GET.get('count', 10))
+            if not 0 < count <= hot_links.sketch.capacity:
+                raise ValueError(count)
+        except ValueError:
+            return JsonResponse({
+                'success': False, 
+            }, status = 400)
+
+        links = []
+        for pk, clicks, error in hot_links.top(count):
+            short = encode(pk)
+            links.append({
+                'short': short, 
+                'result': request.build_absolute_uri(reverse('urls:redirect', args = ( short, ))), 
+                'clicks': clicks, 
+                'error': error, 
+            })
+        return JsonResponse({
+            'success': True, 
+            'links': links, 
+        })
 
 class RedirectURLView(generic.View):
     """
     A View which decodes the kwarg in the url and redirects to either the mapped original url, 
-    or if it has not been created, the urls index.
+    or if it has not been created, the urls index. The mapping is read through the redirect 
+    cache so repeat clicks do not query the database for the url, and the click is buffered in 
+    the click counter rather than written on every request. The status and caching headers of 
+    the redirect follow the URLS_HTTP_CACHE setting and the link's own policy.
     """
 
     def get(self, request, *args, **kwargs):
-        short = kwargs.get('short')
-        if len(short) > MAX_DECODE_LENGTH:
-            # not in the database as the decoded 
-            # value will definitely be too large.
-            return HttpResponseRedirect(reverse('urls:index'))
+        return self.follow(request, kwargs.get('short'), count = True)
 
-        try:
-            pk = decode(short) 
-            redirect = URLRedirect.objects.get(pk = pk)
-            redirect.times_used = F('times_used') + 1
-            redirect.save(update_fields = [ 'times_used'] )
-            return HttpResponsePermanentRedirect(redirect.original_url)
-        except (KeyError, URLRedirect.DoesNotExist):
-            # KeyError                  invalid characters in url 
-            # URLRedirect.DoesNotExist  url has not been created
+    def head(self, request, *args, **kwargs):
+        # link checkers and previews rather than clicks
+        return self.follow(request, kwargs.get('short'), count = False)
+
+    def follow(self, request, short, count):
+        with timer('decode'):
+            pk = self.decode(short)
+        found = None if pk is None else self.lookup(pk)
+        if found is None:
             return HttpResponseRedirect(reverse('urls:index'))
-            
+        if count:
+            with timer('count'):
+                click_counter.incr(pk)
+                click_log.record(pk, request)
+                hot_links.add(pk)
+        return self.redirect(*found)
+
+    def redirect(self, url, expires, permanent):
+        return headers.redirect(url, permanent, expires)
+
+    def decode(self, short):
+        """
+        Returns:
+            the primary key the short code decodes to, or None if it cannot be one
+        """
+        if not is_valid(short, MAX_CODE_LENGTH):
+            # invalid characters in url, or not in the database 
+            # as the decoded value will definitely be too large.
+            return None
+        pk = decode(short) 
+        return pk if pk <= MAX_INT else None
+
+    def lookup(self, pk):
+        """
+        Reads the url from the snapshot when it is enabled, then from the redirect cache and 
+        the database, which is skipped for the ids the id filter knows do not exist. The cache 
+        entries of expiring links carry their expiry time. Links which failed validation are 
+        never cached or exported to the snapshot.
+
+        Returns:
+            a (url, expiry timestamp or None, permanent or None) tuple for the primary key, or 
+            None if it has not been created, has expired or failed validation
+        """
+        if snapshots.snapshot is not None:
+            with timer('snapshot'):
+                url = snapshots.snapshot.get(pk)
+            if url is not None:
+                return ( url, None, None )
+        with timer('cache'):
+            found = expiry.read(redirect_cache.get(pk))
+        if found is None:
+            with timer('filter'):
+                if not id_filter.might_exist(pk):
+                    return None
+            try:
+                with timer('db'):
+                    url, expires, permanent, status = (URLRedirect.objects
+                            .using(shard_map.using_id(pk))
+                            .values_list('original_url', 'expires', 'permanent', 'status')
+                            .get(pk = pk))
+            except URLRedirect.DoesNotExist:
+                id_filter.false_positive(pk)
+                return None
+            id_filter.found(pk)
+            if expiry.is_expired(expires) or status in FAILED:
+                return None
+            entry = expiry.entry(url, expires, permanent)
+            redirect_cache.set(pk, entry)
+            found = expiry.read(entry)
+        return found
+
+class MetricsView(generic.View):
+    """
+    A View exposing the request histograms, cache hit rates, click counter and connection 
+    pool state in the Prometheus text format. Only served to the URLS_METRICS ALLOWED_IPS.
+    """
+
+    def get(self, request, *args, **kwargs):
+        allowed = metrics.option('ALLOWED_IPS')
+        if allowed is not None and request.META.get('REMOTE_ADDR') not in allowed:
+            return HttpResponseForbidden()
+        return HttpResponse(metrics.registry.render(metrics.gauges()), 
+                content_type = 'text/plain; version=0.0.4; charset=utf-8')